@@ -1,9 +1,11 @@
-from typing import Any
+import asyncio
+from typing import Any, Optional
+from concurrent.futures import ThreadPoolExecutor
 from loguru import logger
 
 from macrec.agents.base import ToolAgent
-from macrec.tools import InfoDatabase, InteractionRetriever
-from macrec.utils import read_json, get_rm, parse_action
+from macrec.tools import InfoDatabase, InteractionRetriever, SimilarItemRetriever
+from macrec.utils import read_json, get_rm, parse_commands
 
 class Analyst(ToolAgent):
     def __init__(self, config_path: str, *args, **kwargs) -> None:
@@ -12,6 +14,8 @@ class Analyst(ToolAgent):
         tool_config: dict[str, dict] = get_rm(config, 'tool_config', {})
         self.get_tools(tool_config)
         self.max_turns = get_rm(config, 'max_turns', 20)
+        # the maximum number of commands run in one turn
+        self.max_commands = get_rm(config, 'max_commands', 8)
         self.analyst = self.get_LLM(config=config)
         self.json_mode = self.analyst.json_mode
         self.reset()
@@ -31,6 +35,14 @@ class Analyst(ToolAgent):
     def interaction_retriever(self) -> InteractionRetriever:
         return self.tools['interaction_retriever']
 
+    @property
+    def similar_retriever(self) -> Optional[SimilarItemRetriever]:
+        # optional tool for the SimilarItems command
+        if 'similar_retriever' not in self.tools:
+            return None
+        assert isinstance(self.tools['similar_retriever'], SimilarItemRetriever), 'Tool similar_retriever must be an instance of SimilarItemRetriever.'
+        return self.tools['similar_retriever']
+
     @property
     def analyst_prompt(self) -> str:
         if self.json_mode:
@@ -70,13 +82,16 @@ class Analyst(ToolAgent):
 
     def _prompt_analyst(self, **kwargs) -> str:
         analyst_prompt = self._build_analyst_prompt(**kwargs)
-        command = self.analyst(analyst_prompt)
+        command = self.call_llm(self.analyst, analyst_prompt)
         return command
 
-    def command(self, command: str) -> None:
-        logger.debug(f'Command: {command}')
+    async def _aprompt_analyst(self, **kwargs) -> str:
+        analyst_prompt = self._build_analyst_prompt(**kwargs)
+        command = await self.acall_llm(self.analyst, analyst_prompt)
+        return command
+
+    def _execute(self, action_type: str, argument: Any) -> tuple[str, str]:
         log_head = ''
-        action_type, argument = parse_action(command, json_mode=self.json_mode)
         if action_type.lower() == 'userinfo':
             try:
                 query_user_id = int(argument)
@@ -135,24 +150,103 @@ class Analyst(ToolAgent):
             if valid:
                 observation = self.interaction_retriever.item_retrieve(item_id=query_item_id, k=k)
                 log_head = f':violet[Look up ItemHistory of item] :red[{query_item_id}] :violet[with at most] :red[{k}] :violet[users...]\n- '
+        elif action_type.lower() == 'similaritems':
+            valid = True
+            if self.similar_retriever is None:
+                observation = 'Similar item retriever not available.'
+                valid = False
+            elif self.json_mode:
+                if not isinstance(argument, list) or len(argument) != 2:
+                    observation = f"Invalid item id and retrieval number: {argument}"
+                    valid = False
+                else:
+                    query_item_id, k = argument
+                    if not isinstance(query_item_id, int) or not isinstance(k, int):
+                        observation = f"Invalid item id and retrieval number: {argument}"
+                        valid = False
+            else:
+                try:
+                    query_item_id, k = argument.split(',')
+                    query_item_id = int(query_item_id)
+                    k = int(k)
+                except ValueError or TypeError:
+                    observation = f"Invalid item id and retrieval number: {argument}"
+                    valid = False
+            if valid:
+                observation = self.similar_retriever.similar_items(item_id=query_item_id, k=k)
+                log_head = f':violet[Look up SimilarItems of item] :red[{query_item_id}] :violet[with at most] :red[{k}] :violet[items...]\n- '
         elif action_type.lower() == 'finish':
             observation = self.finish(results=argument)
             log_head = ':violet[Finish with results]:\n- '
         else:
             observation = f'Unknown command type: {action_type}.'
-        logger.debug(f'Observation: {observation}')
-        self.observation(observation, log_head)
+        return observation, log_head
+
+    def _execute_all(self, commands: list[tuple[str, Any]]) -> list[tuple[str, str]]:
+        # the tool calls are independent and run concurrently, while Finish (always the last command, see `parse_commands`) is run after them
+        results: list[Optional[tuple[str, str]]] = [None] * len(commands)
+        tool_calls = [i for i, (action_type, _) in enumerate(commands) if action_type.lower() != 'finish']
+        if len(tool_calls) > 1:
+            with ThreadPoolExecutor(max_workers=len(tool_calls)) as executor:
+                for i, result in zip(tool_calls, executor.map(lambda i: self._execute(*commands[i]), tool_calls)):
+                    results[i] = result
+        for i, (action_type, argument) in enumerate(commands):
+            if results[i] is None:
+                results[i] = self._execute(action_type, argument)
+        return results
+
+    async def _aexecute_all(self, commands: list[tuple[str, Any]]) -> list[tuple[str, str]]:
+        # the blocking tool calls are run in the default executor, while Finish is run after them in the event loop
+        results: list[Optional[tuple[str, str]]] = [None] * len(commands)
+        tool_calls = [i for i, (action_type, _) in enumerate(commands) if action_type.lower() != 'finish']
+        tool_results = await asyncio.gather(*[asyncio.to_thread(self._execute, *commands[i]) for i in tool_calls])
+        for i, result in zip(tool_calls, tool_results):
+            results[i] = result
+        for i, (action_type, argument) in enumerate(commands):
+            if results[i] is None:
+                results[i] = self._execute(action_type, argument)
+        return results
+
+    def command(self, command: str) -> None:
+        logger.debug(f'Command: {command}')
+        commands = parse_commands(command, json_mode=self.json_mode)
+        results = self._execute_all(commands) if len(commands) <= self.max_commands else None
+        self._record(command, commands, results)
+
+    async def acommand(self, command: str) -> None:
+        logger.debug(f'Command: {command}')
+        commands = parse_commands(command, json_mode=self.json_mode)
+        results = await self._aexecute_all(commands) if len(commands) <= self.max_commands else None
+        self._record(command, commands, results)
+
+    def _record(self, command: str, commands: list[tuple[str, Any]], results: Optional[list[tuple[str, str]]]) -> None:
+        # `results` is `None` if the turn has too many commands to run
+        if results is None:
+            observation = f'Too many commands: {len(commands)}. At most {self.max_commands} commands can be run in one turn.'
+            self.observation(observation)
+        else:
+            for result_observation, log_head in results:
+                logger.debug(f'Observation: {result_observation}')
+                self.observation(result_observation, log_head)
+            if len(results) == 1:
+                observation = results[0][0]
+            else:
+                # all the observations of the turn are returned in one history entry
+                observation = '\n'.join([f'({i + 1}) {result_observation}' for i, (result_observation, _) in enumerate(results)])
         turn = {
             'command': command,
             'observation': observation,
         }
         self._history.append(turn)
 
-    def forward(self, id: int, analyse_type: str, *args: Any, **kwargs: Any) -> str:
+    def _reset_retriever(self) -> None:
         assert self.system.data_sample is not None, "Data sample is not provided."
         assert 'user_id' in self.system.data_sample, "User id is not provided."
         assert 'item_id' in self.system.data_sample, "Item id is not provided."
         self.interaction_retriever.reset(user_id=self.system.data_sample['user_id'], item_id=self.system.data_sample['item_id'])
+
+    def forward(self, id: int, analyse_type: str, *args: Any, **kwargs: Any) -> str:
+        self._reset_retriever()
         while not self.is_finished():
             command = self._prompt_analyst(id=id, analyse_type=analyse_type)
             self.command(command)
@@ -160,7 +254,17 @@ class Analyst(ToolAgent):
             return "Analyst did not return any result."
         return self.results
 
-    def invoke(self, argument: Any, json_mode: bool) -> str:
+    async def aforward(self, id: int, analyse_type: str, *args: Any, **kwargs: Any) -> str:
+        self._reset_retriever()
+        while not self.is_finished():
+            command = await self._aprompt_analyst(id=id, analyse_type=analyse_type)
+            await self.acommand(command)
+        if not self.finished:
+            return "Analyst did not return any result."
+        return self.results
+
+    def _parse_argument(self, argument: Any, json_mode: bool) -> tuple[str, int] | str:
+        # the analyse type and id, or the observation of the invalid argument
         if json_mode:
             if not isinstance(argument, list) or len(argument) != 2:
                 observation = "The argument of the action 'Analyse' should be a list with two elements: analyse type (user or item) and id."
@@ -194,8 +298,22 @@ class Analyst(ToolAgent):
                     except ValueError or TypeError:
                         observation = f"Invalid id: {id}. The id should be an integer."
                         return observation
+        return analyse_type, id
+
+    def invoke(self, argument: Any, json_mode: bool) -> str:
+        parsed = self._parse_argument(argument, json_mode)
+        if isinstance(parsed, str):
+            return parsed
+        analyse_type, id = parsed
         return self(analyse_type=analyse_type, id=id)
 
+    async def ainvoke(self, argument: Any, json_mode: bool) -> str:
+        parsed = self._parse_argument(argument, json_mode)
+        if isinstance(parsed, str):
+            return parsed
+        analyse_type, id = parsed
+        return await self.acall(analyse_type=analyse_type, id=id)
+
 if __name__ == '__main__':
     from langchain.prompts import PromptTemplate
     from macrec.utils import init_openai_api, read_prompts
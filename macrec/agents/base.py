@@ -1,10 +1,11 @@
 import json
+import asyncio
 from abc import ABC, abstractmethod
 from loguru import logger
 from typing import Any, Optional, TYPE_CHECKING
 from langchain.prompts import PromptTemplate
 
-from macrec.llms import BaseLLM, AnyOpenAILLM, OpenSourceLLM
+from macrec.llms import BaseLLM, AnyOpenAILLM, OpenSourceLLM, CachedLLM, SingleFlightLLM, get_llm_cache, get_single_flight, llm_context
 from macrec.tools import TOOL_MAP, Tool
 from macrec.utils import run_once, format_history, read_prompts
 
@@ -51,8 +52,21 @@ class Agent(ABC):
         else:
             logger.debug(f'Observation: {message}')
 
+    def llm_context(self, **kwargs: Any):
+        """The telemetry context of the LLM calls in a forward pass of the agent, attributed to the agent class and the `stage` argument (if any).
+
+        Returns:
+            `ContextManager`: The context manager.
+        """
+        return llm_context(agent=self.__class__.__name__, stage=str(kwargs.get('stage', 'forward')))
+
     def __call__(self, *args: Any, **kwargs: Any) -> Any:
-        return self.forward(*args, **kwargs)
+        with self.llm_context(**kwargs):
+            return self.forward(*args, **kwargs)
+
+    async def acall(self, *args: Any, **kwargs: Any) -> Any:
+        with self.llm_context(**kwargs):
+            return await self.aforward(*args, **kwargs)
 
     @abstractmethod
     def forward(self, *args: Any, **kwargs: Any) -> Any:
@@ -65,6 +79,45 @@ class Agent(ABC):
         """
         raise NotImplementedError("Agent.forward() not implemented")
 
+    async def aforward(self, *args: Any, **kwargs: Any) -> Any:
+        """Asynchronous forward pass of the agent. By default, `forward` is run in the default executor of the running event loop. Agents whose LLM calls dominate the running time should override this method with native asynchronous LLM calls.
+
+        Returns:
+            `Any`: The agent output.
+        """
+        return await asyncio.to_thread(self.forward, *args, **kwargs)
+
+    def call_llm(self, llm: BaseLLM, prompt: str) -> str:
+        """Call the LLM with the prompt. If the system streams the outputs, the LLM is called in streaming mode and the partial output is fed to the stream callback of the system.
+
+        Args:
+            `llm` (`BaseLLM`): The LLM to call.
+            `prompt` (`str`): The prompt to feed into the LLM.
+        Returns:
+            `str`: The LLM output.
+        """
+        if self.system is None or not self.system.stream:
+            return llm(prompt)
+        callback = self.system.stream_callback(self)
+        try:
+            return llm.stream_call(prompt, callback=callback)
+        finally:
+            if callback is not None and hasattr(callback, 'close'):
+                callback.close()
+
+    async def acall_llm(self, llm: BaseLLM, prompt: str) -> str:
+        """Asynchronously call the LLM with the prompt. If the system streams the outputs, the streaming call of `call_llm` is run in the default executor, so the stream callback and the time to first token are kept with concurrent samples.
+
+        Args:
+            `llm` (`BaseLLM`): The LLM to call.
+            `prompt` (`str`): The prompt to feed into the LLM.
+        Returns:
+            `str`: The LLM output.
+        """
+        if self.system is None or not self.system.stream:
+            return await llm.acall(prompt)
+        return await asyncio.to_thread(self.call_llm, llm, prompt)
+
     def get_LLM(self, config_path: Optional[str] = None, config: Optional[dict] = None) -> BaseLLM:
         """Get the base large language model for the agent.
 
@@ -81,9 +134,16 @@ class Agent(ABC):
         model_type = config['model_type']
         del config['model_type']
         if model_type != 'api':
-            return OpenSourceLLM(**config)
+            llm = OpenSourceLLM(**config)
         else:
-            return AnyOpenAILLM(**config)
+            llm = AnyOpenAILLM(**config)
+        single_flight = get_single_flight()
+        if single_flight is not None:
+            llm = SingleFlightLLM(llm, single_flight)
+        cache = get_llm_cache()
+        if cache is not None:
+            llm = CachedLLM(llm, cache)
+        return llm
 
 class ToolAgent(Agent):
     """
@@ -136,7 +196,14 @@ class ToolAgent(Agent):
     def __call__(self, *args: Any, **kwargs: Any) -> Any:
         self.validate_tools()
         self.reset()
-        return self.forward(*args, **kwargs)
+        with self.llm_context(**kwargs):
+            return self.forward(*args, **kwargs)
+
+    async def acall(self, *args: Any, **kwargs: Any) -> Any:
+        self.validate_tools()
+        self.reset()
+        with self.llm_context(**kwargs):
+            return await self.aforward(*args, **kwargs)
 
     @abstractmethod
     def invoke(self, argument: Any, json_mode: bool) -> str:
@@ -152,6 +219,17 @@ class ToolAgent(Agent):
         """
         raise NotImplementedError("ToolAgent.invoke() not implemented")
 
+    async def ainvoke(self, argument: Any, json_mode: bool) -> str:
+        """Asynchronously invoke the agent with the argument. By default, `invoke` is run in the default executor of the running event loop. Agents whose LLM calls dominate the running time should override this method to await `acall`, and run only the blocking tool calls in the executor.
+
+        Args:
+            `argument` (`Any`): The argument for the agent.
+            `json_mode` (`bool`): Whether the argument is in JSON mode.
+        Returns:
+            `str`: The observation of the invoking process.
+        """
+        return await asyncio.to_thread(self.invoke, argument, json_mode)
+
     def reset(self) -> None:
         self._history = []
         self.finished = False
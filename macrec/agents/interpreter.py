@@ -1,3 +1,4 @@
+import asyncio
 from typing import Any
 from loguru import logger
 from langchain.prompts import PromptTemplate
@@ -13,6 +14,8 @@ class Interpreter(ToolAgent):
         tool_config: dict[str, dict] = get_rm(config, 'tool_config', {})
         self.get_tools(tool_config)
         self.max_turns = get_rm(config, 'max_turns', 6)
+        # summarize the chat history turn by turn, so that the summaries of the previous turns are reused
+        self.split_turns: bool = get_rm(config, 'split_turns', False)
         self.interpreter = self.get_LLM(config=config)
         self.json_mode = self.interpreter.json_mode
         self.reset()
@@ -50,21 +53,46 @@ class Interpreter(ToolAgent):
 
     def _prompt_interpreter(self, **kwargs) -> str:
         interpreter_prompt = self._build_interpreter_prompt(**kwargs)
-        command = self.interpreter(interpreter_prompt)
+        command = self.call_llm(self.interpreter, interpreter_prompt)
         return command
 
-    def command(self, command: str, input: str) -> None:
-        logger.debug(f'Command: {command}')
+    async def _aprompt_interpreter(self, **kwargs) -> str:
+        interpreter_prompt = self._build_interpreter_prompt(**kwargs)
+        command = await self.acall_llm(self.interpreter, interpreter_prompt)
+        return command
+
+    def _execute(self, action_type: str, argument: Any, input: str) -> tuple[str, str]:
         log_head = ''
-        action_type, argument = parse_action(command, json_mode=self.json_mode)
         if action_type.lower() == 'summarize':
-            observation = self.summarizer.summarize(text=input)
+            if self.split_turns:
+                observation = self.summarizer.summarize_turns(text=input)
+            else:
+                observation = self.summarizer.summarize(text=input)
             log_head = ':violet[Summarize input...]\n- '
         elif action_type.lower() == 'finish':
             observation = self.finish(results=argument)
             log_head = ':violet[Finish with results]:\n- '
         else:
             observation = f'Unknown command type: {action_type}.'
+        return observation, log_head
+
+    def command(self, command: str, input: str) -> None:
+        logger.debug(f'Command: {command}')
+        action_type, argument = parse_action(command, json_mode=self.json_mode)
+        observation, log_head = self._execute(action_type, argument, input)
+        self._record(command, observation, log_head)
+
+    async def acommand(self, command: str, input: str) -> None:
+        logger.debug(f'Command: {command}')
+        action_type, argument = parse_action(command, json_mode=self.json_mode)
+        if action_type.lower() == 'summarize':
+            # the summarization model blocks
+            observation, log_head = await asyncio.to_thread(self._execute, action_type, argument, input)
+        else:
+            observation, log_head = self._execute(action_type, argument, input)
+        self._record(command, observation, log_head)
+
+    def _record(self, command: str, observation: str, log_head: str) -> None:
         logger.debug(f'Observation: {observation}')
         self.observation(observation, log_head)
         turn = {
@@ -73,12 +101,15 @@ class Interpreter(ToolAgent):
         }
         self._history.append(turn)
 
-    def forward(self, input: str, *args, **kwargs) -> str:
+    @staticmethod
+    def _truncate(input: str) -> str:
         tokens = input.split()
         if len(tokens) > 100:
-            truncated_input = '...' + ' '.join(tokens[-100:])
-        else:
-            truncated_input = input
+            return '...' + ' '.join(tokens[-100:])
+        return input
+
+    def forward(self, input: str, *args, **kwargs) -> str:
+        truncated_input = self._truncate(input)
         while not self.is_finished():
             command = self._prompt_interpreter(input=truncated_input)
             self.command(command, input=input)
@@ -86,11 +117,25 @@ class Interpreter(ToolAgent):
             return 'Interpreter did not return any result.'
         return self.results
 
+    async def aforward(self, input: str, *args, **kwargs) -> str:
+        truncated_input = self._truncate(input)
+        while not self.is_finished():
+            command = await self._aprompt_interpreter(input=truncated_input)
+            await self.acommand(command, input=input)
+        if not self.finished:
+            return 'Interpreter did not return any result.'
+        return self.results
+
     def invoke(self, argument: Any, json_mode: bool) -> str:
         if not isinstance(argument, str):
             return f'Invalid argument type: {type(argument)}. Must be a string.'
         return self(input=argument)
 
+    async def ainvoke(self, argument: Any, json_mode: bool) -> str:
+        if not isinstance(argument, str):
+            return f'Invalid argument type: {type(argument)}. Must be a string.'
+        return await self.acall(input=argument)
+
 if __name__ == '__main__':
     from macrec.utils import init_openai_api, read_prompts
     init_openai_api(read_json('config/api-config.json'))
@@ -1,12 +1,81 @@
 import tiktoken
 from loguru import logger
-from transformers import AutoTokenizer
+from typing import Any, Callable
+from transformers import AutoTokenizer, PreTrainedTokenizerBase
 from langchain.prompts import PromptTemplate
 
 from macrec.agents.base import Agent
-from macrec.llms import AnyOpenAILLM
+from macrec.llms import BaseLLM, AnyOpenAILLM, OpenSourceLLM
 from macrec.utils import format_step, run_once
 
+class TokenCounter:
+    """
+    Count the tokens of the manager prompts incrementally. The prompt is split into the static part (the prompt rendered with an empty scratchpad) and the scratchpad. The count of the static part is cached for the same prompt arguments, and the scratchpad is append-only within a trial, so only the newly appended text is encoded. The count is the sum of the two, which may differ from encoding the whole prompt by a few tokens at the boundaries.
+    """
+    def __init__(self, enc: tiktoken.Encoding | PreTrainedTokenizerBase) -> None:
+        """Initialize the token counter.
+
+        Args:
+            `enc` (`tiktoken.Encoding | PreTrainedTokenizerBase`): The encoder of the LLM.
+        """
+        self.enc = enc
+        self.static_key = None
+        self.static_tokens = 0
+        self.scratchpad = ''
+        self.scratchpad_tokens = 0
+
+    def _encode_len(self, text: str, add_special_tokens: bool = True) -> int:
+        if text == '':
+            return 0
+        if isinstance(self.enc, PreTrainedTokenizerBase):
+            return len(self.enc.encode(text, add_special_tokens=add_special_tokens))
+        return len(self.enc.encode(text))
+
+    def count(self, build_prompt: Callable[..., str], scratchpad: str, **kwargs: Any) -> int:
+        """Count the tokens of the prompt built with the scratchpad and other prompt arguments.
+
+        Args:
+            `build_prompt` (`Callable[..., str]`): The function to build the prompt.
+            `scratchpad` (`str`): The scratchpad.
+        Returns:
+            `int`: The number of tokens of the prompt.
+        """
+        key = tuple(sorted(kwargs.items()))
+        if key != self.static_key:
+            self.static_key = key
+            self.static_tokens = self._encode_len(build_prompt(scratchpad='', **kwargs))
+        if scratchpad.startswith(self.scratchpad):
+            self.scratchpad_tokens += self._encode_len(scratchpad[len(self.scratchpad):], add_special_tokens=False)
+        else:
+            self.scratchpad_tokens = self._encode_len(scratchpad, add_special_tokens=False)
+        self.scratchpad = scratchpad
+        return self.static_tokens + self.scratchpad_tokens
+
+def get_encoder(llm: BaseLLM) -> tiktoken.Encoding | PreTrainedTokenizerBase:
+    """Get the encoder of the LLM. The tokenizer already loaded by an OpenSource LLM is reused.
+
+    Args:
+        `llm` (`BaseLLM`): The LLM.
+    Returns:
+        `tiktoken.Encoding | PreTrainedTokenizerBase`: The encoder of the LLM.
+    """
+    llm = llm.unwrapped
+    if isinstance(llm, AnyOpenAILLM):
+        return tiktoken.encoding_for_model(llm.model_name)
+    elif isinstance(llm, OpenSourceLLM):
+        return llm.tokenizer
+    else:
+        return AutoTokenizer.from_pretrained(llm.model_name)
+
+def same_encoder(enc1: tiktoken.Encoding | PreTrainedTokenizerBase, enc2: tiktoken.Encoding | PreTrainedTokenizerBase) -> bool:
+    if enc1 is enc2:
+        return True
+    if isinstance(enc1, tiktoken.Encoding) and isinstance(enc2, tiktoken.Encoding):
+        return enc1.name == enc2.name
+    if isinstance(enc1, PreTrainedTokenizerBase) and isinstance(enc2, PreTrainedTokenizerBase):
+        return enc1.name_or_path == enc2.name_or_path
+    return False
+
 class Manager(Agent):
     """
     The manager agent. The manager agent is a two-stage agent, which first prompts the thought LLM and then prompts the action LLM.
@@ -22,18 +91,19 @@ class Manager(Agent):
         self.thought_llm = self.get_LLM(thought_config_path)
         self.action_llm = self.get_LLM(action_config_path)
         self.json_mode = self.action_llm.json_mode
-        if isinstance(self.thought_llm, AnyOpenAILLM):
-            self.thought_enc = tiktoken.encoding_for_model(self.thought_llm.model_name)
-        else:
-            self.thought_enc = AutoTokenizer.from_pretrained(self.thought_llm.model_name)
-        if isinstance(self.action_llm, AnyOpenAILLM):
-            self.action_enc = tiktoken.encoding_for_model(self.action_llm.model_name)
-        else:
-            self.action_enc = AutoTokenizer.from_pretrained(self.action_llm.model_name)
+        self.thought_enc = get_encoder(self.thought_llm)
+        self.action_enc = get_encoder(self.action_llm)
+        self.thought_counter = TokenCounter(self.thought_enc)
+        # the prompt is encoded once if the thought and action LLMs share the tokenizer
+        self.action_counter = self.thought_counter if same_encoder(self.thought_enc, self.action_enc) else TokenCounter(self.action_enc)
 
-    def over_limit(self, **kwargs) -> bool:
-        prompt = self._build_manager_prompt(**kwargs)
-        return len(self.action_enc.encode(prompt)) > self.action_llm.tokens_limit or len(self.thought_enc.encode(prompt)) > self.thought_llm.tokens_limit
+    def over_limit(self, scratchpad: str = '', **kwargs) -> bool:
+        thought_tokens = self.thought_counter.count(self._build_manager_prompt, scratchpad=scratchpad, **kwargs)
+        if self.action_counter is self.thought_counter:
+            action_tokens = thought_tokens
+        else:
+            action_tokens = self.action_counter.count(self._build_manager_prompt, scratchpad=scratchpad, **kwargs)
+        return action_tokens > self.action_llm.tokens_limit or thought_tokens > self.thought_llm.tokens_limit
 
     @property
     def manager_prompt(self) -> PromptTemplate:
@@ -76,12 +146,23 @@ class Manager(Agent):
     def _prompt_thought(self, **kwargs) -> str:
         thought_prompt = self._build_manager_prompt(**kwargs)
         self._log_prompt(thought_prompt)
-        thought_response = self.thought_llm(thought_prompt)
+        thought_response = self.call_llm(self.thought_llm, thought_prompt)
         return format_step(thought_response)
 
     def _prompt_action(self, **kwargs) -> str:
         action_prompt = self._build_manager_prompt(**kwargs)
-        action_response = self.action_llm(action_prompt)
+        action_response = self.call_llm(self.action_llm, action_prompt)
+        return format_step(action_response)
+
+    async def _aprompt_thought(self, **kwargs) -> str:
+        thought_prompt = self._build_manager_prompt(**kwargs)
+        self._log_prompt(thought_prompt)
+        thought_response = await self.acall_llm(self.thought_llm, thought_prompt)
+        return format_step(thought_response)
+
+    async def _aprompt_action(self, **kwargs) -> str:
+        action_prompt = self._build_manager_prompt(**kwargs)
+        action_response = await self.acall_llm(self.action_llm, action_prompt)
         return format_step(action_response)
 
     def forward(self, stage: str, *args, **kwargs) -> str:
@@ -91,3 +172,11 @@ class Manager(Agent):
             return self._prompt_action(**kwargs)
         else:
             raise ValueError(f"Unsupported stage: {stage}")
+
+    async def aforward(self, stage: str, *args, **kwargs) -> str:
+        if stage == 'thought':
+            return await self._aprompt_thought(**kwargs)
+        elif stage == 'action':
+            return await self._aprompt_action(**kwargs)
+        else:
+            raise ValueError(f"Unsupported stage: {stage}")
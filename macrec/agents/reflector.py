@@ -1,6 +1,7 @@
 import tiktoken
 from enum import Enum
 from loguru import logger
+from typing import Optional
 from transformers import AutoTokenizer
 from langchain.prompts import PromptTemplate
 
@@ -32,7 +33,7 @@ class Reflector(Agent):
         keep_reflections = get_rm(config, 'keep_reflections', True)
         reflection_strategy = get_rm(config, 'reflection_strategy', ReflectionStrategy.REFLEXION.value)
         self.llm = self.get_LLM(config=config)
-        if isinstance(self.llm, AnyOpenAILLM):
+        if isinstance(self.llm.unwrapped, AnyOpenAILLM):
             self.enc = tiktoken.encoding_for_model(self.llm.model_name)
         else:
             self.enc = AutoTokenizer.from_pretrained(self.llm.model_name)
@@ -68,33 +69,42 @@ class Reflector(Agent):
             scratchpad=scratchpad
         )
 
+    def _keep_reflection(self, reflection_prompt: str, reflection_response: str) -> None:
+        self.reflection_input = reflection_prompt
+        self.reflection_output = reflection_response
+        logger.trace(f'Reflection input length: {len(self.enc.encode(self.reflection_input))}')
+        logger.trace(f"Reflection input: {self.reflection_input}")
+        logger.trace(f'Reflection output length: {len(self.enc.encode(self.reflection_output))}')
+        if self.json_mode:
+            self.system.log(f"[:violet[Reflection]]:\n- `{self.reflection_output}`", agent=self, logging=False)
+        else:
+            self.system.log(f"[:violet[Reflection]]:\n- {self.reflection_output}", agent=self, logging=False)
+        logger.debug(f"Reflection output: {self.reflection_output}")
+
     def _prompt_reflection(self, input: str, scratchpad: str) -> str:
         reflection_prompt = self._build_reflector_prompt(input, scratchpad)
-        reflection_response = self.llm(reflection_prompt)
+        reflection_response = self.call_llm(self.llm, reflection_prompt)
         if self.keep_reflections:
-            self.reflection_input = reflection_prompt
-            self.reflection_output = reflection_response
-            logger.trace(f'Reflection input length: {len(self.enc.encode(self.reflection_input))}')
-            logger.trace(f"Reflection input: {self.reflection_input}")
-            logger.trace(f'Reflection output length: {len(self.enc.encode(self.reflection_output))}')
-            if self.json_mode:
-                self.system.log(f"[:violet[Reflection]]:\n- `{self.reflection_output}`", agent=self, logging=False)
-            else:
-                self.system.log(f"[:violet[Reflection]]:\n- {self.reflection_output}", agent=self, logging=False)
-            logger.debug(f"Reflection output: {self.reflection_output}")
+            self._keep_reflection(reflection_prompt, reflection_response)
         return format_step(reflection_response)
 
-    def forward(self, input: str, scratchpad: str, *args, **kwargs) -> str:
-        logger.trace('Running Reflecion strategy...')
+    async def _aprompt_reflection(self, input: str, scratchpad: str) -> str:
+        reflection_prompt = self._build_reflector_prompt(input, scratchpad)
+        reflection_response = await self.acall_llm(self.llm, reflection_prompt)
+        if self.keep_reflections:
+            self._keep_reflection(reflection_prompt, reflection_response)
+        return format_step(reflection_response)
+
+    def _update_reflections(self, input: str, scratchpad: str, reflection: Optional[str] = None) -> str:
         if self.reflection_strategy == ReflectionStrategy.LAST_ATTEMPT:
             self.reflections = [scratchpad]
             self.reflections_str = format_last_attempt(input, scratchpad, self.prompts['last_trial_header'])
         elif self.reflection_strategy == ReflectionStrategy.REFLEXION:
-            self.reflections.append(self._prompt_reflection(input=input, scratchpad=scratchpad))
+            self.reflections.append(reflection)
             self.reflections_str = format_reflections(self.reflections, header=self.prompts['reflection_header'])
         elif self.reflection_strategy == ReflectionStrategy.LAST_ATTEMPT_AND_REFLEXION:
             self.reflections_str = format_last_attempt(input, scratchpad, self.prompts['last_trial_header'])
-            self.reflections = self._prompt_reflection(input=input, scratchpad=scratchpad)
+            self.reflections = reflection
             self.reflections_str += format_reflections(self.reflections, header=self.prompts['reflection_last_trial_header'])
         elif self.reflection_strategy == ReflectionStrategy.NONE:
             self.reflections = []
@@ -103,3 +113,17 @@ class Reflector(Agent):
             raise ValueError(f'Unknown reflection strategy: {self.reflection_strategy}')
         logger.trace(self.reflections_str)
         return self.reflections_str
+
+    @property
+    def requires_llm(self) -> bool:
+        return self.reflection_strategy in [ReflectionStrategy.REFLEXION, ReflectionStrategy.LAST_ATTEMPT_AND_REFLEXION]
+
+    def forward(self, input: str, scratchpad: str, *args, **kwargs) -> str:
+        logger.trace('Running Reflecion strategy...')
+        reflection = self._prompt_reflection(input=input, scratchpad=scratchpad) if self.requires_llm else None
+        return self._update_reflections(input, scratchpad, reflection)
+
+    async def aforward(self, input: str, scratchpad: str, *args, **kwargs) -> str:
+        logger.trace('Running Reflecion strategy...')
+        reflection = await self._aprompt_reflection(input=input, scratchpad=scratchpad) if self.requires_llm else None
+        return self._update_reflections(input, scratchpad, reflection)
@@ -1,9 +1,10 @@
+import asyncio
 from typing import Any
 from loguru import logger
 from langchain.prompts import PromptTemplate
 
 from macrec.agents.base import ToolAgent
-from macrec.tools import Wikipedia
+from macrec.tools import RetrievalTool
 from macrec.utils import read_json, parse_action, get_rm
 
 class Searcher(ToolAgent):
@@ -20,11 +21,11 @@ class Searcher(ToolAgent):
     @staticmethod
     def required_tools() -> dict[str, type]:
         return {
-            'retriever': Wikipedia,
+            'retriever': RetrievalTool,
         }
 
     @property
-    def retriever(self) -> Wikipedia:
+    def retriever(self) -> RetrievalTool:
         return self.tools['retriever']
 
     @property
@@ -59,13 +60,16 @@ class Searcher(ToolAgent):
 
     def _prompt_searcher(self, **kwargs) -> str:
         searcher_prompt = self._build_searcher_prompt(**kwargs)
-        command = self.searcher(searcher_prompt)
+        command = self.call_llm(self.searcher, searcher_prompt)
         return command
 
-    def command(self, command: str) -> None:
-        logger.debug(f'Command: {command}')
+    async def _aprompt_searcher(self, **kwargs) -> str:
+        searcher_prompt = self._build_searcher_prompt(**kwargs)
+        command = await self.acall_llm(self.searcher, searcher_prompt)
+        return command
+
+    def _execute(self, action_type: str, argument: Any) -> tuple[str, str]:
         log_head = ''
-        action_type, argument = parse_action(command, json_mode=self.json_mode)
         if action_type.lower() == 'search':
             observation = self.retriever.search(query=argument)
             log_head = f':violet[Search for] :red[{argument}]:violet[...]\n- '
@@ -88,6 +92,25 @@ class Searcher(ToolAgent):
             log_head = ':violet[Finish with results]:\n- '
         else:
             observation = f'Unknown command type: {action_type}.'
+        return observation, log_head
+
+    def command(self, command: str) -> None:
+        logger.debug(f'Command: {command}')
+        action_type, argument = parse_action(command, json_mode=self.json_mode)
+        observation, log_head = self._execute(action_type, argument)
+        self._record(command, observation, log_head)
+
+    async def acommand(self, command: str) -> None:
+        logger.debug(f'Command: {command}')
+        action_type, argument = parse_action(command, json_mode=self.json_mode)
+        if action_type.lower() in ['search', 'lookup']:
+            # the retrieval may block on the network
+            observation, log_head = await asyncio.to_thread(self._execute, action_type, argument)
+        else:
+            observation, log_head = self._execute(action_type, argument)
+        self._record(command, observation, log_head)
+
+    def _record(self, command: str, observation: str, log_head: str) -> None:
         logger.debug(f'Observation: {observation}')
         self.observation(observation, log_head)
         turn = {
@@ -104,11 +127,24 @@ class Searcher(ToolAgent):
             return 'Searcher did not return any result.'
         return f'Search result: {self.results}'
 
+    async def aforward(self, requirements: str, *args, **kwargs) -> str:
+        while not self.is_finished():
+            command = await self._aprompt_searcher(requirements=requirements)
+            await self.acommand(command)
+        if not self.finished:
+            return 'Searcher did not return any result.'
+        return f'Search result: {self.results}'
+
     def invoke(self, argument: Any, json_mode: bool) -> str:
         if not isinstance(argument, str):
             return f'Invalid argument type: {type(argument)}. Must be a string.'
         return self(requirements=argument)
 
+    async def ainvoke(self, argument: Any, json_mode: bool) -> str:
+        if not isinstance(argument, str):
+            return f'Invalid argument type: {type(argument)}. Must be a string.'
+        return await self.acall(requirements=argument)
+
 if __name__ == '__main__':
     from macrec.utils import init_openai_api, read_prompts
     init_openai_api(read_json('config/api-config.json'))
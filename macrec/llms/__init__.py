@@ -1,4 +1,9 @@
 # Description: Package for large language models
-from macrec.llms.basellm import BaseLLM
+from macrec.llms.basellm import BaseLLM, LLMWrapper
+from macrec.llms.telemetry import Telemetry, get_telemetry, llm_context, estimate_cost
+from macrec.llms.hedging import HedgingPolicy, get_hedging_policy, hedging_policies
 from macrec.llms.openai import AnyOpenAILLM
+from macrec.llms.registry import get_pipeline, get_tokenizer, loaded_models, release_models
 from macrec.llms.opensource import OpenSourceLLM
+from macrec.llms.cache import CachedLLM, init_llm_cache, get_llm_cache
+from macrec.llms.singleflight import SingleFlight, SingleFlightLLM, init_single_flight, get_single_flight
@@ -1,4 +1,10 @@
+import json
+import time
+import asyncio
+import hashlib
 from abc import ABC, abstractmethod
+from loguru import logger
+from typing import Callable, Iterator, Optional
 
 class BaseLLM(ABC):
     def __init__(self) -> None:
@@ -16,6 +22,52 @@ class BaseLLM(ABC):
         """
         return self.max_context_length - 2 * self.max_tokens - 50  # single round need 2 agent prompt steps: thought and action
 
+    @property
+    def generation_params(self) -> dict:
+        """Parameters that determine the output of the LLM for a given prompt. Subclasses should extend them with their own generation settings.
+
+        Returns:
+            `dict`: The generation parameters. Must be JSON serializable.
+        """
+        return {
+            'model_name': self.model_name,
+            'max_tokens': self.max_tokens,
+            'json_mode': self.json_mode,
+        }
+
+    def cache_key(self, prompt: str) -> str:
+        """The content address of a call with the prompt, i.e., the hash of the generation parameters and the exact prompt.
+
+        Args:
+            `prompt` (`str`): The prompt to feed into the LLM.
+        Returns:
+            `str`: The cache key of the call.
+        """
+        content = json.dumps({
+            'params': self.generation_params,
+            'prompt': prompt,
+        }, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def count_tokens(self, text: str) -> int:
+        """Number of tokens of the text, used by the telemetry. By default, approximated by 4 characters per token. Subclasses with a tokenizer should override this method.
+
+        Args:
+            `text` (`str`): The text.
+        Returns:
+            `int`: The number of tokens.
+        """
+        return (len(text) + 3) // 4
+
+    @property
+    def unwrapped(self) -> 'BaseLLM':
+        """The underlying LLM, with all the `LLMWrapper`s removed.
+
+        Returns:
+            `BaseLLM`: The underlying LLM.
+        """
+        return self
+
     @abstractmethod
     def __call__(self, prompt: str, *args, **kwargs) -> str:
         """Forward pass of the LLM.
@@ -28,3 +80,80 @@ class BaseLLM(ABC):
             `str`: The LLM output.
         """
         raise NotImplementedError("BaseLLM.__call__() not implemented")
+
+    async def acall(self, prompt: str, *args, **kwargs) -> str:
+        """Asynchronous forward pass of the LLM. By default, the synchronous `__call__` is run in the default executor of the running event loop, so that other coroutines can make progress while waiting. Subclasses with native asynchronous clients should override this method.
+
+        Args:
+            `prompt` (`str`): The prompt to feed into the LLM.
+        Returns:
+            `str`: The LLM output.
+        """
+        return await asyncio.to_thread(self, prompt, *args, **kwargs)
+
+    def stream(self, prompt: str, *args, **kwargs) -> Iterator[str]:
+        """Streaming forward pass of the LLM, which yields the output in chunks as they are generated. The chunks joined together are the same as the output of `__call__`. By default, the whole output is yielded at once. Subclasses that can generate incrementally should override this method.
+
+        Args:
+            `prompt` (`str`): The prompt to feed into the LLM.
+        Returns:
+            `Iterator[str]`: The chunks of the LLM output.
+        """
+        yield self(prompt, *args, **kwargs)
+
+    def stream_call(self, prompt: str, callback: Optional[Callable[[str], None]] = None, *args, **kwargs) -> str:
+        """Forward pass of the LLM in streaming mode. Each chunk is fed to the callback as soon as it arrives. The time to the first chunk and the total latency of the call are recorded in `last_ttft` and `last_latency`.
+
+        Args:
+            `prompt` (`str`): The prompt to feed into the LLM.
+            `callback` (`Optional[Callable[[str], None]]`): The function to call with each chunk. Defaults to `None`.
+        Returns:
+            `str`: The LLM output.
+        """
+        start = time.perf_counter()
+        ttft = None
+        chunks = []
+        for chunk in self.stream(prompt, *args, **kwargs):
+            if ttft is None:
+                ttft = time.perf_counter() - start
+            chunks.append(chunk)
+            if callback is not None:
+                callback(chunk)
+        self.last_latency = time.perf_counter() - start
+        self.last_ttft = ttft if ttft is not None else self.last_latency
+        logger.debug(f'{self.model_name}: time to first token {self.last_ttft:.3f}s, latency {self.last_latency:.3f}s')
+        return ''.join(chunks)
+
+class LLMWrapper(BaseLLM):
+    """
+    The base class of wrappers that add behaviours (e.g. caching) around another LLM. Attributes not found in the wrapper are looked up in the wrapped LLM.
+    """
+    def __init__(self, llm: BaseLLM) -> None:
+        """Initialize the wrapper.
+
+        Args:
+            `llm` (`BaseLLM`): The LLM to wrap.
+        """
+        self.llm = llm
+
+    def __getattr__(self, name: str):
+        if name == 'llm':
+            raise AttributeError(name)
+        return getattr(self.llm, name)
+
+    @property
+    def generation_params(self) -> dict:
+        return self.llm.generation_params
+
+    @property
+    def unwrapped(self) -> BaseLLM:
+        return self.llm.unwrapped
+
+    def __call__(self, prompt: str, *args, **kwargs) -> str:
+        return self.llm(prompt, *args, **kwargs)
+
+    async def acall(self, prompt: str, *args, **kwargs) -> str:
+        return await self.llm.acall(prompt, *args, **kwargs)
+
+    def stream(self, prompt: str, *args, **kwargs) -> Iterator[str]:
+        yield from self.llm.stream(prompt, *args, **kwargs)
@@ -0,0 +1,69 @@
+from typing import Iterator, Optional
+
+from macrec.llms.basellm import BaseLLM, LLMWrapper
+from macrec.utils import DiskLRUStore
+
+_llm_cache: Optional[DiskLRUStore] = None
+
+def init_llm_cache(path: str, max_size: int = 1 << 30) -> DiskLRUStore:
+    """Initialize the process-wide LLM response cache. LLMs built by agents afterwards are wrapped by `CachedLLM` with this cache.
+
+    Args:
+        `path` (`str`): The path to the cache file.
+        `max_size` (`int`, optional): The maximum size of the cached responses in bytes. Defaults to `1 << 30` (1 GiB).
+    Returns:
+        `DiskLRUStore`: The LLM response cache.
+    """
+    global _llm_cache
+    _llm_cache = DiskLRUStore(path=path, max_size=max_size)
+    return _llm_cache
+
+def get_llm_cache() -> Optional[DiskLRUStore]:
+    """Get the process-wide LLM response cache.
+
+    Returns:
+        `Optional[DiskLRUStore]`: The LLM response cache. `None` if the cache is not initialized.
+    """
+    return _llm_cache
+
+class CachedLLM(LLMWrapper):
+    """
+    The LLM wrapper that stores the responses in a persistent content-addressed cache. The cache key is the hash of the model name, the generation parameters and the exact prompt (see `BaseLLM.cache_key`).
+    """
+    def __init__(self, llm: BaseLLM, cache: DiskLRUStore) -> None:
+        """Initialize the cached LLM.
+
+        Args:
+            `llm` (`BaseLLM`): The LLM to wrap.
+            `cache` (`DiskLRUStore`): The store of the cached responses.
+        """
+        super().__init__(llm)
+        self.cache = cache
+
+    def __call__(self, prompt: str, *args, **kwargs) -> str:
+        key = self.cache_key(prompt)
+        output = self.cache.get(key)
+        if output is None:
+            output = self.llm(prompt, *args, **kwargs)
+            self.cache.put(key, output)
+        return output
+
+    async def acall(self, prompt: str, *args, **kwargs) -> str:
+        key = self.cache_key(prompt)
+        output = self.cache.get(key)
+        if output is None:
+            output = await self.llm.acall(prompt, *args, **kwargs)
+            self.cache.put(key, output)
+        return output
+
+    def stream(self, prompt: str, *args, **kwargs) -> Iterator[str]:
+        key = self.cache_key(prompt)
+        output = self.cache.get(key)
+        if output is not None:
+            yield output
+            return
+        chunks = []
+        for chunk in self.llm.stream(prompt, *args, **kwargs):
+            chunks.append(chunk)
+            yield chunk
+        self.cache.put(key, ''.join(chunks))
@@ -0,0 +1,202 @@
+# Description: Hedged requests, i.e., sending a duplicate of a slow request and taking whichever returns first, to cut the tail latency of API calls.
+
+import time
+import asyncio
+import threading
+import numpy as np
+from collections import deque
+from loguru import logger
+from concurrent.futures import Future, ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Awaitable, Callable, Optional
+
+class HedgingPolicy:
+    """
+    The hedging policy of the requests to one model. A request not answered within the `percentile` of the recent latencies is duplicated, and the first answer of the two is taken. The duplicates are capped at `max_extra_rate` of the requests, and no request is duplicated before `min_samples` latencies are observed. Only deterministic calls should be hedged, since the two answers are treated as interchangeable. The hedged request should be a single attempt, without the waits of the rate limiter or the retries, which are not part of the latency.
+    """
+    def __init__(self, percentile: float = 95, max_extra_rate: float = 0.05, min_samples: int = 20, window: int = 200, min_delay: float = 0.05, max_workers: int = 32) -> None:
+        """Initialize the hedging policy.
+
+        Args:
+            `percentile` (`float`, optional): The percentile of the recent latencies to wait before sending the duplicate. Defaults to `95`.
+            `max_extra_rate` (`float`, optional): The maximum ratio of the duplicates to the requests. Defaults to `0.05`.
+            `min_samples` (`int`, optional): The number of latencies to observe before hedging. Defaults to `20`.
+            `window` (`int`, optional): The number of recent latencies to keep. Defaults to `200`.
+            `min_delay` (`float`, optional): The minimum delay in seconds before sending the duplicate. Defaults to `0.05`.
+            `max_workers` (`int`, optional): The number of threads running the synchronous requests. Defaults to `32`.
+        """
+        assert 0 < percentile < 100, 'percentile should be in (0, 100)'
+        assert 0 <= max_extra_rate <= 1, 'max_extra_rate should be in [0, 1]'
+        self.percentile = percentile
+        self.max_extra_rate = max_extra_rate
+        self.min_samples = min_samples
+        self.min_delay = min_delay
+        self.max_workers = max_workers
+        self.lock = threading.Lock()
+        self.latencies: deque[float] = deque(maxlen=window)
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self.lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='hedging')
+            return self._executor
+
+    def delay(self) -> Optional[float]:
+        """The time to wait before sending the duplicate of a new request, and count the request.
+
+        Returns:
+            `Optional[float]`: The delay in seconds. `None` if the request should not be hedged, i.e., not enough latencies are observed.
+        """
+        with self.lock:
+            self.requests += 1
+            if len(self.latencies) < self.min_samples:
+                return None
+            return max(self.min_delay, float(np.percentile(self.latencies, self.percentile)))
+
+    def try_hedge(self) -> bool:
+        """Take one duplicate from the budget.
+
+        Returns:
+            `bool`: Whether the duplicate is within the budget of `max_extra_rate`.
+        """
+        with self.lock:
+            if self.hedged + 1 > self.max_extra_rate * self.requests:
+                return False
+            self.hedged += 1
+            return True
+
+    def observe(self, latency: float, hedge_won: bool = False) -> None:
+        # only the latencies of the successful requests are observed, since the failures may return early or late
+        with self.lock:
+            self.latencies.append(latency)
+            if hedge_won:
+                self.hedge_wins += 1
+
+    def run(self, fn: Callable[[], Any]) -> Any:
+        """Run the request with hedging. The losing request keeps running in the background and its result is discarded.
+
+        Args:
+            `fn` (`Callable[[], Any]`): The request.
+        Returns:
+            `Any`: The result of the first successful request.
+        """
+        start = time.perf_counter()
+        delay = self.delay()
+        if delay is None:
+            result = fn()
+            self.observe(time.perf_counter() - start)
+            return result
+        primary = self.executor.submit(fn)
+        done, _ = wait([primary], timeout=delay)
+        if len(done) > 0 or not self.try_hedge():
+            result = primary.result()
+            self.observe(time.perf_counter() - start)
+            return result
+        logger.debug(f'Request not answered in {delay:.3f}s, sending a hedged request...')
+        backup = self.executor.submit(fn)
+        winner = self._first_success([primary, backup])
+        if winner.exception() is None:
+            self.observe(time.perf_counter() - start, hedge_won=winner is backup)
+        return winner.result()
+
+    @staticmethod
+    def _first_success(futures: list[Future]) -> Future:
+        pending = set(futures)
+        failed = None
+        while len(pending) > 0:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    return future
+                failed = failed or future
+        # both failed, raise the error of the first one
+        return failed
+
+    async def arun(self, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Asynchronously run the request with hedging. The losing request is cancelled.
+
+        Args:
+            `fn` (`Callable[[], Awaitable[Any]]`): The coroutine function of the request.
+        Returns:
+            `Any`: The result of the first successful request.
+        """
+        start = time.perf_counter()
+        delay = self.delay()
+        if delay is None:
+            result = await fn()
+            self.observe(time.perf_counter() - start)
+            return result
+        primary = asyncio.ensure_future(fn())
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if len(done) > 0 or not self.try_hedge():
+            result = await primary
+            self.observe(time.perf_counter() - start)
+            return result
+        logger.debug(f'Request not answered in {delay:.3f}s, sending a hedged request...')
+        backup = asyncio.ensure_future(fn())
+        pending = {primary, backup}
+        failed = None
+        try:
+            while len(pending) > 0:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        self.observe(time.perf_counter() - start, hedge_won=task is backup)
+                        return task.result()
+                    failed = failed or task
+            return failed.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def stats(self) -> dict[str, Any]:
+        """Statistics of the hedging policy.
+
+        Returns:
+            `dict[str, Any]`: The number of requests, hedged requests and requests answered by the duplicate, and the current hedging delay.
+        """
+        with self.lock:
+            latencies = list(self.latencies)
+            stats = {
+                'requests': self.requests,
+                'hedged': self.hedged,
+                'hedge_wins': self.hedge_wins,
+            }
+        stats['delay'] = max(self.min_delay, float(np.percentile(latencies, self.percentile))) if len(latencies) >= self.min_samples else None
+        return stats
+
+    def report(self, name: str = 'Hedging') -> None:
+        stats = self.stats()
+        delay = f'{stats["delay"]:.3f}s' if stats['delay'] is not None else 'warming up'
+        logger.success(f'{name}: {stats["requests"]} requests, {stats["hedged"]} hedged ({stats["hedge_wins"]} answered by the hedged request), current delay {delay}')
+
+_hedging_policies: dict[tuple[str, str], HedgingPolicy] = {}
+_hedging_policies_lock = threading.Lock()
+
+def get_hedging_policy(model_name: str, api_base: str, **kwargs) -> HedgingPolicy:
+    """Get the process-wide hedging policy of the model at the API base. The policy is created with the given arguments (see `HedgingPolicy`) on the first call, and shared by later calls, so the latencies of all the callers are observed together.
+
+    Args:
+        `model_name` (`str`): The name of the model.
+        `api_base` (`str`): The base URL of the API.
+    Returns:
+        `HedgingPolicy`: The shared hedging policy.
+    """
+    with _hedging_policies_lock:
+        key = (model_name, api_base)
+        if key not in _hedging_policies:
+            _hedging_policies[key] = HedgingPolicy(**kwargs)
+        return _hedging_policies[key]
+
+def hedging_policies() -> dict[tuple[str, str], HedgingPolicy]:
+    """The process-wide hedging policies.
+
+    Returns:
+        `dict[tuple[str, str], HedgingPolicy]`: The policies keyed by `(model_name, api_base)`.
+    """
+    with _hedging_policies_lock:
+        return dict(_hedging_policies)
@@ -0,0 +1,296 @@
+# Description: A JSON schema constrained decoder for HuggingFace causal language models, compiled once per schema and reused across calls.
+
+import json
+import threading
+from loguru import logger
+from typing import Any, Generator, Optional
+import torch
+from transformers import PreTrainedModel, PreTrainedTokenizerBase
+
+# A request of the decoding program of a row: `('force', token)` feeds the token, and `('sample', mask, stop)` picks a token allowed by the mask, which is fed unless it is in `stop`.
+Request = tuple
+Program = Generator[Request, Optional[int], Any]
+
+NUMBER_CHARS = set('0123456789.-')
+DIGIT_CHARS = set('0123456789.')
+
+class TokenTables:
+    """
+    Token masks and literal encodings of a tokenizer, shared by all the decoders using the tokenizer. Use `get_token_tables` to get the cached tables.
+    """
+    def __init__(self, tokenizer: PreTrainedTokenizerBase, vocab_size: int, device: torch.device) -> None:
+        """Build the token tables. Each token is decoded once, which may take a few seconds for large vocabularies.
+
+        Args:
+            `tokenizer` (`PreTrainedTokenizerBase`): The tokenizer.
+            `vocab_size` (`int`): The size of the logits, which may be larger than the vocabulary of the tokenizer.
+            `device` (`torch.device`): The device of the masks.
+        """
+        self.tokenizer = tokenizer
+        self.vocab_size = vocab_size
+        self.device = device
+        n = min(len(tokenizer), vocab_size)
+        texts = tokenizer.batch_decode([[i] for i in range(n)])
+        special = set(tokenizer.all_special_ids)
+        string_safe = torch.zeros(vocab_size, dtype=torch.bool)
+        number_first = torch.zeros(vocab_size, dtype=torch.bool)
+        number_ids = set()
+        for i, text in enumerate(texts):
+            if i in special or text == '':
+                continue
+            quotes = text.count('"')
+            # a token ending with the first quote closes the string
+            if quotes == 0 or (quotes == 1 and text.endswith('"')):
+                string_safe[i] = True
+            if text.lstrip(' ') != '' and set(text.lstrip(' ')) <= NUMBER_CHARS:
+                number_first[i] = True
+            if set(text) <= DIGIT_CHARS:
+                number_ids.add(i)
+        self.texts = texts
+        self.string_mask = string_safe.to(device)
+        self.number_first_mask = number_first.to(device)
+        self.all_mask = torch.ones(vocab_size, dtype=torch.bool, device=device)
+        self.non_number_ids = frozenset(range(vocab_size)) - number_ids
+        self.eos_ids = frozenset([tokenizer.eos_token_id] if tokenizer.eos_token_id is not None else [])
+        self.string_mask[list(self.eos_ids)] = True
+        self._literals: dict[str, list[int]] = {}
+        self._masks: dict[tuple[int, ...], torch.Tensor] = {}
+        self.lock = threading.Lock()
+
+    def encode(self, text: str) -> list[int]:
+        """The cached token ids of the literal text, without special tokens."""
+        with self.lock:
+            if text not in self._literals:
+                self._literals[text] = self.tokenizer.encode(text, add_special_tokens=False)
+            return self._literals[text]
+
+    def mask_of(self, ids: tuple[int, ...]) -> torch.Tensor:
+        """The cached mask that only allows the given tokens."""
+        with self.lock:
+            if ids not in self._masks:
+                mask = torch.zeros(self.vocab_size, dtype=torch.bool)
+                mask[list(ids)] = True
+                self._masks[ids] = mask.to(self.device)
+            return self._masks[ids]
+
+_token_tables: dict[tuple, TokenTables] = {}
+_token_tables_lock = threading.Lock()
+
+def get_token_tables(tokenizer: PreTrainedTokenizerBase, vocab_size: int, device: torch.device) -> TokenTables:
+    """Get the process-wide token tables of the tokenizer.
+
+    Args:
+        `tokenizer` (`PreTrainedTokenizerBase`): The tokenizer.
+        `vocab_size` (`int`): The size of the logits.
+        `device` (`torch.device`): The device of the masks.
+    Returns:
+        `TokenTables`: The token tables.
+    """
+    key = (tokenizer.name_or_path, len(tokenizer), vocab_size, str(device))
+    with _token_tables_lock:
+        if key not in _token_tables:
+            _token_tables[key] = TokenTables(tokenizer, vocab_size, device)
+        return _token_tables[key]
+
+class JsonSchemaDecoder:
+    """
+    Generate JSON values following a JSON schema with a causal language model. The schema is compiled once, and the keys and punctuations are forced while only the values are generated. All the rows of a batch are decoded together, one token per row in each forward pass, with the past key values reused across the whole value. Supported types are `object` (with `properties`), `array` (with `items`), `string`, `number`, `integer` and `boolean`. The prompt is framed in the same way as `Jsonformer`.
+    """
+    def __init__(self, json_schema: dict, max_string_tokens: int = 300, max_number_tokens: int = 16, max_array_length: int = 10) -> None:
+        """Compile the decoder.
+
+        Args:
+            `json_schema` (`dict`): The JSON schema of the output.
+            `max_string_tokens` (`int`, optional): Maximum number of tokens of each string. Defaults to `300`.
+            `max_number_tokens` (`int`, optional): Maximum number of tokens of each number. Defaults to `16`.
+            `max_array_length` (`int`, optional): Maximum number of items of each array. Defaults to `10`.
+        Raises:
+            `ValueError`: Unsupported schema.
+        """
+        self._check(json_schema)
+        self.json_schema = json_schema
+        self.schema_str = json.dumps(json_schema)
+        self.max_string_tokens = max_string_tokens
+        self.max_number_tokens = max_number_tokens
+        self.max_array_length = max_array_length
+
+    def _check(self, schema: dict) -> None:
+        schema_type = schema.get('type', None)
+        if schema_type == 'object':
+            for value in schema.get('properties', {}).values():
+                self._check(value)
+        elif schema_type == 'array':
+            if 'items' not in schema:
+                raise ValueError('Array schema must have items')
+            self._check(schema['items'])
+        elif schema_type not in ['string', 'number', 'integer', 'boolean']:
+            raise ValueError(f'Unsupported schema type: {schema_type}')
+
+    def frame(self, prompt: str) -> str:
+        return f'{prompt}\nOutput result in the following JSON schema format:\n{self.schema_str}\nResult: '
+
+    def _force(self, tables: TokenTables, text: str) -> Program:
+        for token in tables.encode(text):
+            yield ('force', token)
+
+    def _value(self, tables: TokenTables, schema: dict) -> Program:
+        schema_type = schema['type']
+        if schema_type == 'object':
+            yield from self._force(tables, '{')
+            value = {}
+            for i, (key, sub_schema) in enumerate(schema.get('properties', {}).items()):
+                yield from self._force(tables, f'{", " if i > 0 else ""}{json.dumps(key)}: ')
+                value[key] = yield from self._value(tables, sub_schema)
+            yield from self._force(tables, '}')
+            return value
+        elif schema_type == 'array':
+            yield from self._force(tables, '[')
+            comma, close = tables.encode(',')[0], tables.encode(']')[0]
+            value = []
+            for i in range(self.max_array_length):
+                value.append((yield from self._value(tables, schema['items'])))
+                if i == self.max_array_length - 1:
+                    break
+                token = yield ('sample', tables.mask_of((comma, close)), ())
+                if token == close:
+                    return value
+            yield from self._force(tables, ']')
+            return value
+        elif schema_type == 'string':
+            return (yield from self._string(tables))
+        elif schema_type in ['number', 'integer']:
+            return (yield from self._number(tables, integer=schema_type == 'integer'))
+        else:
+            return (yield from self._boolean(tables))
+
+    def _string(self, tables: TokenTables) -> Program:
+        yield from self._force(tables, '"')
+        ids = []
+        for _ in range(self.max_string_tokens):
+            token = yield ('sample', tables.string_mask, tables.eos_ids)
+            if token in tables.eos_ids:
+                break
+            ids.append(token)
+            if tables.texts[token].endswith('"'):
+                # the closing quote has been fed
+                return tables.tokenizer.decode(ids)[:-1]
+        yield from self._force(tables, '"')
+        return tables.tokenizer.decode(ids)
+
+    def _number(self, tables: TokenTables, integer: bool) -> Program:
+        ids = []
+        for i in range(self.max_number_tokens):
+            if i == 0:
+                token = yield ('sample', tables.number_first_mask, ())
+            else:
+                token = yield ('sample', tables.all_mask, tables.non_number_ids)
+                if token in tables.non_number_ids:
+                    break
+            ids.append(token)
+        text = tables.tokenizer.decode(ids).strip()
+        while text != '':
+            try:
+                value = float(text)
+                return int(value) if integer else value
+            except ValueError:
+                text = text[:-1]
+        logger.warning(f'Failed to decode a number from {tables.tokenizer.decode(ids)!r}, using 0')
+        return 0
+
+    def _boolean(self, tables: TokenTables) -> Program:
+        true_ids, false_ids = tables.encode('true'), tables.encode('false')
+        token = yield ('sample', tables.mask_of((true_ids[0], false_ids[0])), ())
+        ids = true_ids if token == true_ids[0] else false_ids
+        for token in ids[1:]:
+            yield ('force', token)
+        return ids is true_ids
+
+    @staticmethod
+    def _pick(logits: torch.Tensor, mask: torch.Tensor, do_sample: bool, temperature: float) -> int:
+        logits = logits.masked_fill(~mask, float('-inf'))
+        if do_sample and temperature > 0:
+            probs = torch.softmax(logits.float() / temperature, dim=-1)
+            return int(torch.multinomial(probs, 1).item())
+        return int(torch.argmax(logits).item())
+
+    @torch.no_grad()
+    def decode(self, model: PreTrainedModel, tokenizer: PreTrainedTokenizerBase, prompts: list[str], do_sample: bool = False, temperature: float = 1.0) -> list[Any]:
+        """Generate the JSON values of the prompts.
+
+        Args:
+            `model` (`PreTrainedModel`): The causal language model.
+            `tokenizer` (`PreTrainedTokenizerBase`): The tokenizer of the model.
+            `prompts` (`list[str]`): The prompts, which are decoded as one batch.
+            `do_sample` (`bool`, optional): Whether to sample the values. Use greedy decoding otherwise. Defaults to `False`.
+            `temperature` (`float`, optional): The temperature of sampling. Defaults to `1.0`.
+        Returns:
+            `list[Any]`: The decoded values, following the schema.
+        """
+        device = model.device
+        encoded = [tokenizer.encode(self.frame(prompt)) for prompt in prompts]
+        pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else tokenizer.eos_token_id
+        length = max(len(ids) for ids in encoded)
+        # left padding, so that the next tokens of all the rows are at the last position
+        input_ids = torch.tensor([[pad_id] * (length - len(ids)) + ids for ids in encoded], device=device)
+        attention_mask = torch.tensor([[0] * (length - len(ids)) + [1] * len(ids) for ids in encoded], device=device)
+        position_ids = (attention_mask.cumsum(-1) - 1).clamp(min=0)
+        outputs = model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids, use_cache=True)
+        logits = outputs.logits[:, -1, :]
+        past_key_values = outputs.past_key_values
+        tables = get_token_tables(tokenizer, vocab_size=logits.shape[-1], device=device)
+        programs = [self._value(tables, self.json_schema) for _ in prompts]
+        replies: list[Optional[int]] = [None] * len(prompts)
+        results: list[Any] = [None] * len(prompts)
+        active = [True] * len(prompts)
+        while True:
+            feeds = []
+            for row, program in enumerate(programs):
+                token = None
+                while active[row] and token is None:
+                    try:
+                        request = program.send(replies[row])
+                    except StopIteration as e:
+                        results[row] = e.value
+                        active[row] = False
+                        break
+                    replies[row] = None
+                    if request[0] == 'force':
+                        token = request[1]
+                    else:
+                        _, mask, stop = request
+                        picked = self._pick(logits[row], mask, do_sample, temperature)
+                        replies[row] = picked
+                        # a token in stop is not fed, so the logits are still valid for the next request
+                        if picked not in stop:
+                            token = picked
+                feeds.append(token)
+            if not any(active):
+                break
+            input_ids = torch.tensor([[token if token is not None else pad_id] for token in feeds], device=device)
+            step_mask = torch.tensor([[1 if token is not None else 0] for token in feeds], device=device)
+            attention_mask = torch.cat([attention_mask, step_mask], dim=-1)
+            position_ids = (attention_mask.sum(-1, keepdim=True) - 1).clamp(min=0)
+            outputs = model(input_ids=input_ids, attention_mask=attention_mask, position_ids=position_ids, past_key_values=past_key_values, use_cache=True)
+            logits = outputs.logits[:, -1, :]
+            past_key_values = outputs.past_key_values
+        return results
+
+_decoders: dict[tuple, JsonSchemaDecoder] = {}
+_decoders_lock = threading.Lock()
+
+def get_json_decoder(json_schema: dict, max_string_tokens: int = 300, max_number_tokens: int = 16, max_array_length: int = 10) -> JsonSchemaDecoder:
+    """Get the process-wide compiled decoder of the JSON schema.
+
+    Args:
+        `json_schema` (`dict`): The JSON schema of the output.
+        `max_string_tokens` (`int`, optional): Maximum number of tokens of each string. Defaults to `300`.
+        `max_number_tokens` (`int`, optional): Maximum number of tokens of each number. Defaults to `16`.
+        `max_array_length` (`int`, optional): Maximum number of items of each array. Defaults to `10`.
+    Returns:
+        `JsonSchemaDecoder`: The compiled decoder.
+    """
+    key = (json.dumps(json_schema, sort_keys=True), max_string_tokens, max_number_tokens, max_array_length)
+    with _decoders_lock:
+        if key not in _decoders:
+            _decoders[key] = JsonSchemaDecoder(json_schema, max_string_tokens=max_string_tokens, max_number_tokens=max_number_tokens, max_array_length=max_array_length)
+        return _decoders[key]
@@ -1,8 +1,17 @@
+import os
+import time
+import asyncio
+import tiktoken
 from loguru import logger
+from typing import Any, Iterator, Optional
 from langchain_openai import ChatOpenAI, OpenAI
-from langchain.schema import HumanMessage
+from langchain.schema import BaseMessage, HumanMessage
 
 from macrec.llms.basellm import BaseLLM
+from macrec.llms.telemetry import traced
+from macrec.llms.ratelimit import RateLimiter, get_rate_limiter, is_retryable, backoff_delay
+from macrec.llms.hedging import HedgingPolicy, get_hedging_policy
+from macrec.utils import get_rm
 
 class AnyOpenAILLM(BaseLLM):
     def __init__(self, model_name: str = 'gpt-3.5-turbo', json_mode: bool = False, *args, **kwargs):
@@ -11,13 +20,24 @@ class AnyOpenAILLM(BaseLLM):
         Args:
             `model_name` (`str`, optional): The name of the OpenAI model. Defaults to `gpt-3.5-turbo`.
             `json_mode` (`bool`, optional): Whether to use the JSON mode of the OpenAI API. Defaults to `False`.
+            `rate_limit` (`dict`, optional): The client-side rate limit, with optional keys `rpm` (requests per minute), `tpm` (tokens per minute) and `max_retries` (retries with jittered exponential backoff on 429/5xx, defaults to `6`). The limiter is shared by all the instances with the same model name and API base in the process. Disabled if not given.
+            `hedging` (`dict`, optional): The hedging policy of the requests, with optional keys `percentile` (the percentile of the recent latencies to wait before sending a duplicate request, defaults to `95`), `max_extra_rate` (the maximum ratio of duplicate requests, defaults to `0.05`) and `min_samples` (the number of latencies to observe before hedging, defaults to `20`). The policy is shared like the rate limiter. Only each single request to the API is hedged, after the rate limiter admits it. Only applies with `temperature` 0, and disabled if not given.
         """
+        rate_limit: Optional[dict] = get_rm(kwargs, 'rate_limit', None)
+        hedging: Optional[dict] = get_rm(kwargs, 'hedging', None)
         self.model_name = model_name
         self.json_mode = json_mode
         if json_mode and self.model_name not in ['gpt-3.5-turbo-1106', 'gpt-4-1106-preview']:
             raise ValueError("json_mode is only available for gpt-3.5-turbo-1106 and gpt-4-1106-preview")
         self.max_tokens: int = kwargs.get('max_tokens', 256)
         self.max_context_length: int = 16384 if '16k' in model_name else 32768 if '32k' in model_name else 4096
+        api_base = kwargs.get('openai_api_base', None) or os.environ.get('OPENAI_API_BASE', '')
+        self.rate_limiter: Optional[RateLimiter] = None
+        if rate_limit is not None:
+            self.rate_limiter = get_rate_limiter(model_name=model_name, api_base=api_base, rpm=rate_limit.get('rpm', None), tpm=rate_limit.get('tpm', None))
+            self.max_retries: int = rate_limit.get('max_retries', 6)
+            # retries are handled with the shared limiter instead of the client
+            kwargs.setdefault('max_retries', 0)
         if model_name.split('-')[0] == 'text' or model_name == 'gpt-3.5-turbo-instruct':
             self.model = OpenAI(model_name=model_name, *args, **kwargs)
             self.model_type = 'completion'
@@ -36,7 +56,138 @@ class AnyOpenAILLM(BaseLLM):
                     }
             self.model = ChatOpenAI(model_name=model_name, *args, **kwargs)
             self.model_type = 'chat'
+        self.hedging_policy: Optional[HedgingPolicy] = None
+        if hedging is not None:
+            if self.model.temperature != 0:
+                # the duplicate may give a different answer
+                logger.warning(f'Hedging is only available with temperature 0, but got {self.model.temperature}. Disabling hedging...')
+            else:
+                self.hedging_policy = get_hedging_policy(model_name=model_name, api_base=api_base, **hedging)
 
+    @property
+    def generation_params(self) -> dict:
+        params = super().generation_params
+        params.update({
+            'model_type': self.model_type,
+            'temperature': self.model.temperature,
+            'model_kwargs': self.model.model_kwargs,
+        })
+        return params
+
+    @property
+    def enc(self) -> tiktoken.Encoding:
+        """The tiktoken encoder of the model, loaded on first use.
+
+        Returns:
+            `tiktoken.Encoding`: The encoder.
+        """
+        if not hasattr(self, '_enc'):
+            try:
+                self._enc = tiktoken.encoding_for_model(self.model_name)
+            except KeyError:
+                self._enc = tiktoken.get_encoding('cl100k_base')
+        return self._enc
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.enc.encode(text, disallowed_special=()))
+
+    def _estimate_tokens(self, prompt: str) -> int:
+        # the completion may take up to max_tokens
+        return self.count_tokens(prompt) + self.max_tokens
+
+    def _retry_delay(self, error: Exception, attempt: int) -> Optional[float]:
+        if not is_retryable(error) or attempt >= self.max_retries:
+            return None
+        delay = backoff_delay(attempt, error=error)
+        if getattr(error, 'status_code', None) == 429:
+            # make every caller of the limiter back off, not only this one
+            self.rate_limiter.pause(delay)
+        logger.warning(f'{error.__class__.__name__} from {self.model_name}, retrying in {delay:.2f}s ({attempt + 1}/{self.max_retries})...')
+        return delay
+
+    def _attempt(self, input: str | list[HumanMessage]) -> Any:
+        # only a single request is hedged, so the waits of the limiter and the retries are neither duplicated nor observed as latencies
+        if self.hedging_policy is None:
+            return self.model.invoke(input)
+        return self.hedging_policy.run(lambda: self.model.invoke(input))
+
+    async def _aattempt(self, input: str | list[HumanMessage]) -> Any:
+        if self.hedging_policy is None:
+            return await self.model.ainvoke(input)
+        return await self.hedging_policy.arun(lambda: self.model.ainvoke(input))
+
+    def _invoke(self, prompt: str) -> Any:
+        input = self._build_input(prompt)
+        if self.rate_limiter is None:
+            return self._attempt(input)
+        tokens = self._estimate_tokens(prompt)
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(tokens)
+            try:
+                return self._attempt(input)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    async def _ainvoke(self, prompt: str) -> Any:
+        input = self._build_input(prompt)
+        if self.rate_limiter is None:
+            return await self._aattempt(input)
+        tokens = self._estimate_tokens(prompt)
+        attempt = 0
+        while True:
+            await self.rate_limiter.aacquire(tokens)
+            try:
+                return await self._aattempt(input)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+
+    def _stream(self, prompt: str) -> Iterator[str | BaseMessage]:
+        input = self._build_input(prompt)
+        if self.rate_limiter is None:
+            yield from self.model.stream(input)
+            return
+        tokens = self._estimate_tokens(prompt)
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire(tokens)
+            started = False
+            try:
+                for chunk in self.model.stream(input):
+                    started = True
+                    yield chunk
+                return
+            except Exception as e:
+                # a partially streamed output cannot be taken back, so only retry before the first chunk
+                delay = self._retry_delay(e, attempt) if not started else None
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+
+    def _build_input(self, prompt: str) -> str | list[HumanMessage]:
+        if self.model_type == 'completion':
+            return prompt
+        else:
+            return [
+                HumanMessage(
+                    content=prompt,
+                )
+            ]
+
+    def _parse_output(self, output: str | BaseMessage) -> str:
+        content = output if isinstance(output, str) else output.content
+        return content.replace('\n', ' ').strip()
+
+    @traced
     def __call__(self, prompt: str, *args, **kwargs) -> str:
         """Forward pass of the OpenAI LLM.
 
@@ -45,13 +196,40 @@ class AnyOpenAILLM(BaseLLM):
         Returns:
             `str`: The OpenAI LLM output.
         """
-        if self.model_type == 'completion':
-            return self.model.invoke(prompt).content.replace('\n', ' ').strip()
-        else:
-            return self.model.invoke(
-                [
-                    HumanMessage(
-                        content=prompt,
-                    )
-                ]
-            ).content.replace('\n', ' ').strip()
+        return self._parse_output(self._invoke(prompt))
+
+    @traced
+    async def acall(self, prompt: str, *args, **kwargs) -> str:
+        """Asynchronous forward pass of the OpenAI LLM. Uses the native asynchronous client, so many requests can be in flight in one process.
+
+        Args:
+            `prompt` (`str`): The prompt to feed into the LLM.
+        Returns:
+            `str`: The OpenAI LLM output.
+        """
+        return self._parse_output(await self._ainvoke(prompt))
+
+    @traced
+    def stream(self, prompt: str, *args, **kwargs) -> Iterator[str]:
+        """Streaming forward pass of the OpenAI LLM. Newlines are replaced chunk by chunk, and the leading and trailing whitespaces are held back, so the chunks joined together are the same as the output of `__call__`.
+
+        Args:
+            `prompt` (`str`): The prompt to feed into the LLM.
+        Returns:
+            `Iterator[str]`: The chunks of the OpenAI LLM output.
+        """
+        started = False
+        pending = ''
+        for output in self._stream(prompt):
+            text = output if isinstance(output, str) else output.content
+            text = text.replace('\n', ' ')
+            if not started:
+                text = text.lstrip()
+                if text == '':
+                    continue
+                started = True
+            text = pending + text
+            chunk = text.rstrip()
+            pending = text[len(chunk):]
+            if chunk != '':
+                yield chunk
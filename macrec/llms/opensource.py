@@ -1,17 +1,21 @@
 import json
-from jsonformer import Jsonformer
+import torch
+import threading
 from loguru import logger
-from typing import Any
-from transformers import pipeline
+from typing import Any, Iterator, Optional
+from transformers import PreTrainedTokenizerBase, TextIteratorStreamer
 from transformers.pipelines import Pipeline
 
 from macrec.llms.basellm import BaseLLM
+from macrec.llms.registry import get_pipeline, get_tokenizer
+from macrec.llms.json_decoder import get_json_decoder
+from macrec.llms.telemetry import traced
 
 class MyJsonFormer:
     """
-    The JsonFormer formatter, which formats the output of the LLM into JSON with the given JSON schema.
+    The JsonFormer formatter, which formats the output of the LLM into JSON with the given JSON schema. The schema is compiled once into a `JsonSchemaDecoder`, which reuses the model and tokenizer of the pipeline and decodes batches of prompts together.
     """
-    def __init__(self, json_schema: dict, pipeline: Pipeline, max_new_tokens: int = 300, temperature: float = 0.9, debug: bool = False):
+    def __init__(self, json_schema: dict, pipeline: Pipeline, max_new_tokens: int = 300, temperature: float = 0.9, do_sample: bool = True, debug: bool = False):
         """Initialize the JsonFormer formatter.
 
         Args:
@@ -19,13 +23,16 @@ class MyJsonFormer:
             `pipeline` (`Pipeline`): The pipeline of the LLM. Must be a `pipeline("text-generation")` pipeline here.
             `max_new_tokens` (`int`, optional): Maximum number of new tokens to generate for each string and number field. Defaults to `300`.
             `temperature` (`float`, optional): The temperature of the generation. Defaults to `0.9`.
+            `do_sample` (`bool`, optional): Whether to use sampling. Defaults to `True`.
             `debug` (`bool`, optional): Whether to enable debug mode. Defaults to `False`.
         """
         self.json_schema = json_schema
         self.pipeline = pipeline
         self.max_new_tokens = max_new_tokens
         self.temperature = temperature
+        self.do_sample = do_sample
         self.debug = debug
+        self.decoder = get_json_decoder(json_schema, max_string_tokens=max_new_tokens, max_number_tokens=min(max_new_tokens, 16))
 
     def invoke(self, prompt: str, **kwargs: Any) -> str:
         """Invoke the JsonFormer formatter.
@@ -35,22 +42,25 @@ class MyJsonFormer:
         Returns:
             `str`: The formatted output. Must be a valid JSON string.
         """
-        model = Jsonformer(
-            model=self.pipeline.model,
-            tokenizer=self.pipeline.tokenizer,
-            json_schema=self.json_schema,
-            prompt=prompt,
-            max_number_tokens=self.max_new_tokens,
-            max_string_token_length=self.max_new_tokens,
-            debug=self.debug,
-            temperature=self.temperature,
-        )
-        text = model()
-        return json.dumps(text, ensure_ascii=False)
+        return self.invoke_batch([prompt], **kwargs)[0]
+
+    def invoke_batch(self, prompts: list[str], **kwargs: Any) -> list[str]:
+        """Invoke the JsonFormer formatter on a batch of prompts, which are decoded together.
+
+        Args:
+            `prompts` (`list[str]`): The prompts to feed into the LLM.
+        Returns:
+            `list[str]`: The formatted outputs. Must be valid JSON strings.
+        """
+        values = self.decoder.decode(self.pipeline.model, self.pipeline.tokenizer, prompts, do_sample=self.do_sample, temperature=self.temperature)
+        if self.debug:
+            for value in values:
+                logger.debug(f'JsonFormer output: {value}')
+        return [json.dumps(value, ensure_ascii=False) for value in values]
 
 class OpenSourceLLM(BaseLLM):
-    def __init__(self, model_path: str = 'lmsys/vicuna-7b-v1.5-16k', device: int = 0, json_mode: bool = False, prefix: str = 'react', max_new_tokens: int = 300, do_sample: bool = True, temperature: float = 0.9, top_p: float = 1.0, *args, **kwargs):
-        """Initialize the OpenSource LLM. The OpenSource LLM is a wrapper of the HuggingFace pipeline.
+    def __init__(self, model_path: str = 'lmsys/vicuna-7b-v1.5-16k', device: int = 0, json_mode: bool = False, prefix: str = 'react', max_new_tokens: int = 300, do_sample: bool = True, temperature: float = 0.9, top_p: float = 1.0, max_batch_size: int = 8, max_batch_tokens: int = 16384, torch_dtype: Optional[str] = None, prefix_cache: bool = False, quantize: Optional[str] = None, low_cpu_mem_usage: bool = False, use_safetensors: Optional[bool] = None, num_threads: Optional[int] = None, lazy: bool = False, *args, **kwargs):
+        """Initialize the OpenSource LLM. The OpenSource LLM is a wrapper of the HuggingFace pipeline. The pipeline is shared by all the OpenSource LLMs with the same `model_path`, `device` and loading options (see `get_pipeline`), while the generation settings are kept per LLM.
 
         Args:
             `model_path` (`str`, optional): The path or name to the model. Defaults to `'lmsys/vicuna-7b-v1.5-16k'`.
@@ -61,25 +71,114 @@ class OpenSourceLLM(BaseLLM):
             `do_sample` (`bool`, optional): Whether to use sampling. Defaults to `True`.
             `temperature` (`float`, optional): The temperature of the generation. Defaults to `0.9`.
             `top_p` (`float`, optional): The top-p of the generation. Defaults to `1.0`.
+            `max_batch_size` (`int`, optional): Maximum number of prompts in one forward pass of `generate_batch`. Defaults to `8`.
+            `max_batch_tokens` (`int`, optional): Token budget of one forward pass of `generate_batch`, i.e., the number of prompts times the padded length plus `max_new_tokens`. Defaults to `16384`.
+            `torch_dtype` (`Optional[str]`): The dtype to load the model in, e.g., `'bfloat16'` or `'auto'`. Defaults to `None`.
+            `prefix_cache` (`bool`, optional): Whether to keep the past key values of the last call, and only prefill the tokens after the longest common prefix with the last call. Useful when consecutive prompts extend each other, e.g., the ReAct prompts of the Manager. Ignored in json mode. Defaults to `False`.
+            `quantize` (`Optional[str]`): Set to `'int8'` to apply dynamic int8 quantization to the linear layers. Only available for float32 models on CPU. Defaults to `None`.
+            `low_cpu_mem_usage` (`bool`, optional): Whether to load the weights without materializing a randomly initialized model first. Defaults to `False`.
+            `use_safetensors` (`Optional[bool]`): Whether to load the memory-mapped safetensors weights. Use them if available when `None`. Defaults to `None`.
+            `num_threads` (`Optional[int]`): The number of threads of PyTorch on CPU. Note that it is a process-wide setting. Use the default of PyTorch if `None`. Defaults to `None`.
+            `lazy` (`bool`, optional): Whether to load the model on the first call instead of in `__init__`, so that an LLM never called costs nothing but its tokenizer. Defaults to `False`.
         """
         self.json_mode = json_mode
-        if device == 'auto':
-            self.pipe = pipeline("text-generation", model=model_path, device_map='auto')
-        else:
-            self.pipe = pipeline("text-generation", model=model_path, device=device)
-        self.pipe.model.generation_config.do_sample = do_sample
-        self.pipe.model.generation_config.top_p = top_p
-        self.pipe.model.generation_config.temperature = temperature
-        self.pipe.model.generation_config.max_new_tokens = max_new_tokens
+        self.do_sample = do_sample
+        self.temperature = temperature
+        self.top_p = top_p
+        self.torch_dtype = torch_dtype
+        self.json_schema = kwargs.get(f'{prefix}_json_schema', None)
+        if num_threads is not None:
+            torch.set_num_threads(num_threads)
+        self.load_kwargs = {
+            'model_path': model_path,
+            'device': device,
+            'torch_dtype': torch_dtype,
+            'quantize': quantize,
+            'low_cpu_mem_usage': low_cpu_mem_usage,
+            'use_safetensors': use_safetensors,
+        }
+        self.generate_kwargs = {
+            'max_new_tokens': max_new_tokens,
+            'do_sample': do_sample,
+        }
+        if do_sample:
+            self.generate_kwargs.update({
+                'temperature': temperature,
+                'top_p': top_p,
+            })
+        self.max_batch_size = max_batch_size
+        self.max_batch_tokens = max_batch_tokens
+        self.prefix_cache = prefix_cache
+        self._prefix_cache_entry = None
+        self._prefix_cache_lock = threading.Lock()
+        self.reused_tokens = 0
+        self.prefilled_tokens = 0
         if self.json_mode:
             logger.info('Enabling json mode...')
-            json_schema = kwargs.get(f'{prefix}_json_schema', None)
-            assert json_schema is not None, "json_schema must be provided if json_mode is True"
-            self.pipe = MyJsonFormer(json_schema=json_schema, pipeline=self.pipe, max_new_tokens=max_new_tokens, temperature=temperature, debug=kwargs.get('debug', False))
+            assert self.json_schema is not None, "json_schema must be provided if json_mode is True"
+        self.debug = kwargs.get('debug', False)
         self.model_name = model_path
         self.max_tokens = max_new_tokens
         self.max_context_length: int = 16384 if '16k' in model_path else 32768 if '32k' in model_path else 4096
+        self._pipe: Optional[Pipeline | MyJsonFormer] = None
+        self._load_lock = threading.Lock()
+        if not lazy:
+            self.load()
+
+    def load(self) -> None:
+        """Load the model from the registry, if not loaded yet. Called in `__init__` unless `lazy` is set, and otherwise on the first call."""
+        if self._pipe is not None:
+            return
+        with self._load_lock:
+            if self._pipe is not None:
+                return
+            pipe = get_pipeline(**self.load_kwargs)
+            if self.prefix_cache:
+                self.prefix_cache = self._supports_prefix_cache(pipe.model)
+            if self.json_mode:
+                pipe = MyJsonFormer(json_schema=self.json_schema, pipeline=pipe, max_new_tokens=self.max_tokens, temperature=self.temperature, do_sample=self.do_sample, debug=self.debug)
+            self._pipe = pipe
+
+    @property
+    def loaded(self) -> bool:
+        return self._pipe is not None
+
+    @property
+    def pipe(self) -> Pipeline | MyJsonFormer:
+        """The pipeline of the LLM, i.e., the text generation pipeline, or the `MyJsonFormer` formatter in json mode. The model is loaded on first access if the LLM is lazy.
+
+        Returns:
+            `Pipeline | MyJsonFormer`: The pipeline.
+        """
+        if self._pipe is None:
+            self.load()
+        return self._pipe
+
+    @property
+    def model(self) -> torch.nn.Module:
+        return self.pipe.pipeline.model if self.json_mode else self.pipe.model
+
+    @property
+    def tokenizer(self) -> PreTrainedTokenizerBase:
+        # the tokenizer is shared with the pipeline, and does not load the model
+        return get_tokenizer(self.model_name)
+
+    @property
+    def generation_params(self) -> dict:
+        params = super().generation_params
+        params.update({
+            'do_sample': self.do_sample,
+            'temperature': self.temperature,
+            'top_p': self.top_p,
+            'torch_dtype': self.torch_dtype,
+            'json_schema': self.json_schema if self.json_mode else None,
+        })
+        return params
+
+    def count_tokens(self, text: str) -> int:
+        return len(self.tokenizer.encode(text, add_special_tokens=False))
 
+    @traced
     def __call__(self, prompt: str, *args, **kwargs) -> str:
         """Forward pass of the OpenSource LLM. If json_mode is enabled, the output of the LLM will be formatted into JSON by `MyJsonFormer`.
 
@@ -88,7 +187,127 @@ class OpenSourceLLM(BaseLLM):
         Returns:
             `str`: The OpenSource LLM output.
         """
+        # whether the prefix cache is supported is known after loading
+        self.load()
         if self.json_mode:
             return self.pipe.invoke(prompt)
+        elif self.prefix_cache:
+            return self._generate_with_prefix_cache(prompt)
         else:
-            return self.pipe.invoke(prompt, return_full_text=False)[0]['generated_text']
+            return self.pipe(prompt, return_full_text=False, pad_token_id=self.tokenizer.pad_token_id, **self.generate_kwargs)[0]['generated_text']
+
+    def _supports_prefix_cache(self, model: torch.nn.Module) -> bool:
+        try:
+            from transformers import DynamicCache  # noqa: F401
+        except ImportError:
+            logger.warning('Prefix cache requires a newer version of transformers, disabling prefix cache...')
+            return False
+        if not getattr(model, '_supports_cache_class', False):
+            logger.warning(f'Model {model.__class__.__name__} does not support cache classes, disabling prefix cache...')
+            return False
+        return True
+
+    @torch.no_grad()
+    def _generate_with_prefix_cache(self, prompt: str, streamer: Optional[TextIteratorStreamer] = None) -> str:
+        from transformers import DynamicCache
+        input_ids = self.tokenizer(prompt, return_tensors='pt', return_token_type_ids=False)['input_ids'].to(self.model.device)
+        ids = input_ids[0].tolist()
+        # take the cache exclusively, so that concurrent calls never share a cache being extended
+        with self._prefix_cache_lock:
+            entry, self._prefix_cache_entry = self._prefix_cache_entry, None
+        past_key_values = DynamicCache()
+        if entry is not None:
+            cached_ids, cache = entry
+            # at least the last prompt token must be prefilled to get the logits of the next token
+            limit = min(len(cached_ids), len(ids) - 1)
+            common = 0
+            while common < limit and cached_ids[common] == ids[common]:
+                common += 1
+            if common > 0:
+                cache.crop(common)
+                past_key_values = cache
+        reused = past_key_values.get_seq_length()
+        self.reused_tokens += reused
+        self.prefilled_tokens += len(ids) - reused
+        logger.debug(f'Prefix cache: {reused} tokens reused, {len(ids) - reused} tokens prefilled')
+        outputs = self.model.generate(input_ids, attention_mask=torch.ones_like(input_ids), past_key_values=past_key_values, return_dict_in_generate=True, pad_token_id=self.tokenizer.pad_token_id, streamer=streamer, **self.generate_kwargs)
+        sequence = outputs.sequences[0]
+        cache = outputs.past_key_values
+        with self._prefix_cache_lock:
+            self._prefix_cache_entry = (sequence[:cache.get_seq_length()].tolist(), cache)
+        return self.tokenizer.decode(sequence[len(ids):], skip_special_tokens=True)
+
+    @torch.no_grad()
+    def _generate_with_streamer(self, prompt: str, streamer: TextIteratorStreamer) -> None:
+        try:
+            if self.prefix_cache:
+                self._generate_with_prefix_cache(prompt, streamer=streamer)
+            else:
+                inputs = self.tokenizer(prompt, return_tensors='pt', return_token_type_ids=False).to(self.model.device)
+                self.model.generate(**inputs, pad_token_id=self.tokenizer.pad_token_id, streamer=streamer, **self.generate_kwargs)
+        except Exception as e:
+            streamer.error = e
+            # unblock the consumer
+            streamer.end()
+
+    @traced
+    def stream(self, prompt: str, *args, **kwargs) -> Iterator[str]:
+        """Streaming forward pass of the OpenSource LLM. The generation runs in a background thread, and the decoded text is yielded as the tokens are generated. In json mode, the formatted output is yielded at once.
+
+        Args:
+            `prompt` (`str`): The prompt to feed into the LLM.
+        Returns:
+            `Iterator[str]`: The chunks of the OpenSource LLM output.
+        """
+        self.load()
+        if self.json_mode:
+            yield self.pipe.invoke(prompt)
+            return
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        streamer.error = None
+        thread = threading.Thread(target=self._generate_with_streamer, args=(prompt, streamer), daemon=True)
+        thread.start()
+        for chunk in streamer:
+            if chunk != '':
+                yield chunk
+        thread.join()
+        if streamer.error is not None:
+            raise streamer.error
+
+    def _make_batches(self, prompts: list[str]) -> list[list[int]]:
+        # group prompts of similar lengths to reduce padding, under the batch size and token budget
+        lengths = [len(self.tokenizer.encode(prompt)) for prompt in prompts]
+        order = sorted(range(len(prompts)), key=lambda i: lengths[i])
+        batches = []
+        batch = []
+        for i in order:
+            # prompts are in ascending order of length, so the new prompt is the longest
+            if len(batch) > 0 and (len(batch) >= self.max_batch_size or (len(batch) + 1) * (lengths[i] + self.max_tokens) > self.max_batch_tokens):
+                batches.append(batch)
+                batch = []
+            batch.append(i)
+        if len(batch) > 0:
+            batches.append(batch)
+        return batches
+
+    @torch.no_grad()
+    def _generate_padded(self, prompts: list[str]) -> list[str]:
+        inputs = self.tokenizer(prompts, return_tensors='pt', padding=True, return_token_type_ids=False).to(self.model.device)
+        outputs = self.model.generate(**inputs, pad_token_id=self.tokenizer.pad_token_id, **self.generate_kwargs)
+        return self.tokenizer.batch_decode(outputs[:, inputs['input_ids'].shape[1]:], skip_special_tokens=True)
+
+    def generate_batch(self, prompts: list[str]) -> list[str]:
+        """Generate the outputs of many prompts with dynamic batching. Prompts are sorted by length and grouped into left-padded batches under `max_batch_size` and `max_batch_tokens`, and each batch goes through one `generate` call. If json_mode is enabled, the outputs are formatted by `MyJsonFormer`.
+
+        Args:
+            `prompts` (`list[str]`): The prompts to feed into the LLM.
+        Returns:
+            `list[str]`: The outputs of the prompts, in the same order as the prompts.
+        """
+        outputs = [''] * len(prompts)
+        for batch in self._make_batches(prompts):
+            batch_prompts = [prompts[i] for i in batch]
+            batch_outputs = self.pipe.invoke_batch(batch_prompts) if self.json_mode else self._generate_padded(batch_prompts)
+            for i, output in zip(batch, batch_outputs):
+                outputs[i] = output
+        return outputs
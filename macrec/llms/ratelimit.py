@@ -0,0 +1,141 @@
+import time
+import random
+import asyncio
+import threading
+from typing import Optional
+from openai import APIConnectionError, APIStatusError, APITimeoutError, RateLimitError
+
+class TokenBucket:
+    """
+    A token bucket with reservations. Reserving more tokens than available drives the bucket negative, and the caller should wait until the bucket is refilled to zero. So concurrent callers are queued in the order of their reservations.
+    """
+    def __init__(self, capacity: float, rate: float) -> None:
+        """Initialize the token bucket. The bucket starts full.
+
+        Args:
+            `capacity` (`float`): The capacity of the bucket.
+            `rate` (`float`): The refill rate of the bucket in tokens per second.
+        """
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, amount: float, now: float) -> float:
+        """Reserve tokens from the bucket. Not thread-safe, the caller should hold a lock.
+
+        Args:
+            `amount` (`float`): The number of tokens to reserve. Clipped to the capacity of the bucket.
+            `now` (`float`): The current monotonic time.
+        Returns:
+            `float`: The time to wait in seconds before the reserved tokens are available.
+        """
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= min(amount, self.capacity)
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+class RateLimiter:
+    """
+    A client-side rate limiter with token buckets for requests per minute (RPM) and tokens per minute (TPM). All the callers sharing a limiter are throttled together, and a rate limit error seen by one of them pauses all of them.
+    """
+    def __init__(self, rpm: Optional[int] = None, tpm: Optional[int] = None) -> None:
+        """Initialize the rate limiter.
+
+        Args:
+            `rpm` (`Optional[int]`): The requests per minute limit. No limit if `None`. Defaults to `None`.
+            `tpm` (`Optional[int]`): The tokens per minute limit. No limit if `None`. Defaults to `None`.
+        """
+        self.lock = threading.Lock()
+        self.request_bucket = TokenBucket(capacity=rpm, rate=rpm / 60) if rpm is not None else None
+        self.token_bucket = TokenBucket(capacity=tpm, rate=tpm / 60) if tpm is not None else None
+        self.paused_until = 0.0
+
+    def reserve(self, tokens: int) -> float:
+        """Reserve one request with the estimated tokens.
+
+        Args:
+            `tokens` (`int`): The estimated number of tokens of the request, including the completion.
+        Returns:
+            `float`: The time to wait in seconds before sending the request.
+        """
+        with self.lock:
+            now = time.monotonic()
+            delay = max(0.0, self.paused_until - now)
+            if self.request_bucket is not None:
+                delay = max(delay, self.request_bucket.reserve(1, now))
+            if self.token_bucket is not None:
+                delay = max(delay, self.token_bucket.reserve(tokens, now))
+            return delay
+
+    def acquire(self, tokens: int) -> None:
+        delay = self.reserve(tokens)
+        if delay > 0:
+            time.sleep(delay)
+
+    async def aacquire(self, tokens: int) -> None:
+        delay = self.reserve(tokens)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def pause(self, seconds: float) -> None:
+        """Pause all the callers of the limiter, e.g., after the provider reports a rate limit error.
+
+        Args:
+            `seconds` (`float`): The time to pause in seconds.
+        """
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+_rate_limiters: dict[tuple[str, str], RateLimiter] = {}
+_rate_limiters_lock = threading.Lock()
+
+def get_rate_limiter(model_name: str, api_base: str, rpm: Optional[int] = None, tpm: Optional[int] = None) -> RateLimiter:
+    """Get the process-wide rate limiter of the model at the API base. The limiter is created with the given limits on the first call, and shared by later calls.
+
+    Args:
+        `model_name` (`str`): The name of the model.
+        `api_base` (`str`): The base URL of the API.
+        `rpm` (`Optional[int]`): The requests per minute limit. Defaults to `None`.
+        `tpm` (`Optional[int]`): The tokens per minute limit. Defaults to `None`.
+    Returns:
+        `RateLimiter`: The shared rate limiter.
+    """
+    with _rate_limiters_lock:
+        key = (model_name, api_base)
+        if key not in _rate_limiters:
+            _rate_limiters[key] = RateLimiter(rpm=rpm, tpm=tpm)
+        return _rate_limiters[key]
+
+def is_retryable(error: Exception) -> bool:
+    """Whether the API error is worth retrying, i.e., rate limit errors (429), server errors (5xx), connection errors and timeouts.
+
+    Args:
+        `error` (`Exception`): The error raised by the API call.
+    Returns:
+        `bool`: Whether the error is retryable.
+    """
+    if isinstance(error, (RateLimitError, APIConnectionError, APITimeoutError)):
+        return True
+    return isinstance(error, APIStatusError) and error.status_code >= 500
+
+def backoff_delay(attempt: int, base: float = 1.0, max_delay: float = 60.0, error: Optional[Exception] = None) -> float:
+    """Exponential backoff with full jitter. The `Retry-After` header of the error response is respected if present.
+
+    Args:
+        `attempt` (`int`): The number of failed attempts before, starting from 0.
+        `base` (`float`, optional): The base delay in seconds. Defaults to `1.0`.
+        `max_delay` (`float`, optional): The maximum delay in seconds. Defaults to `60.0`.
+        `error` (`Optional[Exception]`): The error raised by the last attempt. Defaults to `None`.
+    Returns:
+        `float`: The time to wait in seconds before the next attempt.
+    """
+    delay = random.uniform(0, min(max_delay, base * 2 ** attempt))
+    if isinstance(error, APIStatusError):
+        try:
+            delay = max(delay, float(error.response.headers.get('retry-after', 0)))
+        except ValueError:
+            pass
+    return delay
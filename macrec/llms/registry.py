@@ -0,0 +1,94 @@
+# Description: A process-wide registry of loaded HuggingFace models, so that LLMs with the same model share the weights.
+
+import torch
+import threading
+from loguru import logger
+from typing import Any, Optional
+from transformers import AutoTokenizer, PreTrainedTokenizerBase, pipeline
+from transformers.pipelines import Pipeline
+
+_pipelines: dict[tuple[str, ...], Pipeline] = {}
+_tokenizers: dict[str, PreTrainedTokenizerBase] = {}
+_pipelines_lock = threading.RLock()
+
+def get_tokenizer(model_path: str) -> PreTrainedTokenizerBase:
+    """Get the process-wide tokenizer of the model, without loading the model. The tokenizer is padded on the left for batched generation of decoder-only models, and shared by the pipelines of the model.
+
+    Args:
+        `model_path` (`str`): The path or name to the model.
+    Returns:
+        `PreTrainedTokenizerBase`: The shared tokenizer.
+    """
+    with _pipelines_lock:
+        if model_path not in _tokenizers:
+            tokenizer = AutoTokenizer.from_pretrained(model_path)
+            tokenizer.padding_side = 'left'
+            if tokenizer.pad_token is None:
+                tokenizer.pad_token = tokenizer.eos_token
+            _tokenizers[model_path] = tokenizer
+        return _tokenizers[model_path]
+
+def _parse_dtype(torch_dtype: Optional[str]) -> Optional[str | torch.dtype]:
+    if torch_dtype is None or torch_dtype == 'auto':
+        return torch_dtype
+    dtype = getattr(torch, torch_dtype, None)
+    if not isinstance(dtype, torch.dtype):
+        raise ValueError(f'Unknown torch_dtype: {torch_dtype}')
+    return dtype
+
+def get_pipeline(model_path: str, device: Any = 0, torch_dtype: Optional[str] = None, quantize: Optional[str] = None, low_cpu_mem_usage: bool = False, use_safetensors: Optional[bool] = None) -> Pipeline:
+    """Get the process-wide text generation pipeline of the model. The model is loaded on the first call, and shared by later calls with the same `model_path`, device and loading options. The shared model must not be mutated, so callers should pass their generation settings to each call instead of changing `generation_config`.
+
+    Args:
+        `model_path` (`str`): The path or name to the model.
+        `device` (`Any`, optional): The device to use. Set to `auto` to automatically select the device. Defaults to `0`.
+        `torch_dtype` (`Optional[str]`): The dtype to load the model in, e.g., `'bfloat16'` or `'auto'`. Use the default dtype of `transformers` if `None`. Defaults to `None`.
+        `quantize` (`Optional[str]`): Set to `'int8'` to apply dynamic int8 quantization to the linear layers after loading. Only available for float32 models on CPU. Defaults to `None`.
+        `low_cpu_mem_usage` (`bool`, optional): Whether to load the weights without materializing a randomly initialized model first, which halves the peak memory of loading. Defaults to `False`.
+        `use_safetensors` (`Optional[bool]`): Whether to load the safetensors weights, which are memory-mapped instead of read into memory. Use the safetensors weights if available when `None`. Defaults to `None`.
+    Raises:
+        `ValueError`: If `torch_dtype` or `quantize` is not supported.
+    Returns:
+        `Pipeline`: The shared `pipeline("text-generation")` pipeline.
+    """
+    if quantize not in [None, 'int8']:
+        raise ValueError(f'Unsupported quantization: {quantize}')
+    if quantize is not None and torch_dtype not in [None, 'float32']:
+        raise ValueError(f'Dynamic int8 quantization is only available for float32 models, but got torch_dtype {torch_dtype}')
+    key = (model_path, str(device), str(torch_dtype), str(quantize), str(low_cpu_mem_usage), str(use_safetensors))
+    with _pipelines_lock:
+        if key in _pipelines:
+            logger.debug(f'Reusing loaded model {model_path} on device {device}')
+            return _pipelines[key]
+        logger.info(f'Loading model {model_path} on device {device}...')
+        model_kwargs = {}
+        if low_cpu_mem_usage:
+            model_kwargs['low_cpu_mem_usage'] = True
+        if use_safetensors is not None:
+            model_kwargs['use_safetensors'] = use_safetensors
+        pipeline_kwargs = {'device_map': 'auto'} if device == 'auto' else {'device': device}
+        if torch_dtype is not None:
+            pipeline_kwargs['torch_dtype'] = _parse_dtype(torch_dtype)
+        pipe = pipeline("text-generation", model=model_path, tokenizer=get_tokenizer(model_path), model_kwargs=model_kwargs, **pipeline_kwargs)
+        if quantize == 'int8':
+            if pipe.model.device.type != 'cpu' or pipe.model.dtype != torch.float32:
+                raise ValueError(f'Dynamic int8 quantization is only available for float32 models on CPU, but got {pipe.model.dtype} on {pipe.model.device}')
+            logger.info(f'Quantizing the linear layers of {model_path} to int8...')
+            torch.ao.quantization.quantize_dynamic(pipe.model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+        _pipelines[key] = pipe
+        return pipe
+
+def loaded_models() -> list[tuple[str, ...]]:
+    """The keys of the loaded models in the registry.
+
+    Returns:
+        `list[tuple[str, ...]]`: The `(model_path, device, torch_dtype, quantize, low_cpu_mem_usage, use_safetensors)` of the loaded models.
+    """
+    with _pipelines_lock:
+        return list(_pipelines.keys())
+
+def release_models() -> None:
+    """Drop the references of the registry to the loaded models and tokenizers. The memory is freed once no LLM refers to them."""
+    with _pipelines_lock:
+        _pipelines.clear()
+        _tokenizers.clear()
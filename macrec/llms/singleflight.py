@@ -0,0 +1,133 @@
+import asyncio
+import threading
+from concurrent.futures import Future
+from loguru import logger
+from typing import Any, Awaitable, Callable, Optional
+
+from macrec.llms.basellm import BaseLLM, LLMWrapper
+
+class SingleFlight:
+    """
+    Collapse concurrent calls with the same key into one call. The first caller of a key runs the call, and the callers arriving while it is in flight wait for its result (or exception). Synchronous and asynchronous callers share the in-flight calls.
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.flights: dict[str, Future] = {}
+        self.calls = 0
+        self.collapsed = 0
+
+    def _join(self, key: str) -> tuple[Future, bool]:
+        with self.lock:
+            if key in self.flights:
+                self.collapsed += 1
+                return self.flights[key], False
+            future = Future()
+            self.flights[key] = future
+            self.calls += 1
+            return future, True
+
+    def _land(self, key: str, future: Future, result: Any = None, error: Optional[BaseException] = None) -> None:
+        with self.lock:
+            del self.flights[key]
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Run the call, or wait for the in-flight call with the same key.
+
+        Args:
+            `key` (`str`): The key of the call.
+            `fn` (`Callable[[], Any]`): The call.
+        Returns:
+            `Any`: The result of the call.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+        except BaseException as e:
+            self._land(key, future, error=e)
+            raise
+        self._land(key, future, result=result)
+        return result
+
+    async def ado(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Asynchronously run the call, or wait for the in-flight call with the same key.
+
+        Args:
+            `key` (`str`): The key of the call.
+            `fn` (`Callable[[], Awaitable[Any]]`): The coroutine function of the call.
+        Returns:
+            `Any`: The result of the call.
+        """
+        future, leader = self._join(key)
+        if not leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await fn()
+        except BaseException as e:
+            self._land(key, future, error=e)
+            raise
+        self._land(key, future, result=result)
+        return result
+
+    def stats(self) -> dict[str, int]:
+        """Statistics of the single-flight group.
+
+        Returns:
+            `dict[str, int]`: The number of calls run upstream, the number of collapsed calls, and the number of calls in flight.
+        """
+        with self.lock:
+            return {
+                'calls': self.calls,
+                'collapsed': self.collapsed,
+                'in_flight': len(self.flights),
+            }
+
+    def report(self, name: str = 'Single flight') -> None:
+        stats = self.stats()
+        total = stats['calls'] + stats['collapsed']
+        logger.success(f'{name}: {stats["calls"]} upstream calls, {stats["collapsed"]} collapsed calls, saved rate {stats["collapsed"] / total if total > 0 else 0.0:.4f}')
+
+_single_flight: Optional[SingleFlight] = None
+
+def init_single_flight() -> SingleFlight:
+    """Initialize the process-wide single-flight group. LLMs built by agents afterwards are wrapped by `SingleFlightLLM` with this group.
+
+    Returns:
+        `SingleFlight`: The single-flight group.
+    """
+    global _single_flight
+    _single_flight = SingleFlight()
+    return _single_flight
+
+def get_single_flight() -> Optional[SingleFlight]:
+    """Get the process-wide single-flight group.
+
+    Returns:
+        `Optional[SingleFlight]`: The single-flight group. `None` if not initialized.
+    """
+    return _single_flight
+
+class SingleFlightLLM(LLMWrapper):
+    """
+    The LLM wrapper that collapses concurrent calls with the same cache key (see `BaseLLM.cache_key`) into one upstream call, and fans out the output to all the callers.
+    """
+    def __init__(self, llm: BaseLLM, group: SingleFlight) -> None:
+        """Initialize the single-flight LLM.
+
+        Args:
+            `llm` (`BaseLLM`): The LLM to wrap.
+            `group` (`SingleFlight`): The single-flight group, shared by the LLMs whose calls should be collapsed together.
+        """
+        super().__init__(llm)
+        self.group = group
+
+    def __call__(self, prompt: str, *args, **kwargs) -> str:
+        return self.group.do(self.cache_key(prompt), lambda: self.llm(prompt, *args, **kwargs))
+
+    async def acall(self, prompt: str, *args, **kwargs) -> str:
+        return await self.group.ado(self.cache_key(prompt), lambda: self.llm.acall(prompt, *args, **kwargs))
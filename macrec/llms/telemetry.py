@@ -0,0 +1,251 @@
+# Description: Per-call telemetry of the LLMs, i.e., latency, tokens and estimated cost attributed to the calling agent and stage.
+
+import json
+import time
+import asyncio
+import inspect
+import functools
+import threading
+import numpy as np
+from loguru import logger
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Iterator, Optional, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from macrec.llms.basellm import BaseLLM
+
+# USD per 1K prompt tokens and per 1K completion tokens. Models are matched by the longest prefix, and unknown models (e.g., local models) cost nothing.
+PRICES: dict[str, tuple[float, float]] = {
+    'gpt-3.5-turbo': (0.0005, 0.0015),
+    'gpt-3.5-turbo-16k': (0.003, 0.004),
+    'gpt-3.5-turbo-1106': (0.001, 0.002),
+    'gpt-3.5-turbo-instruct': (0.0015, 0.002),
+    'gpt-4': (0.03, 0.06),
+    'gpt-4-32k': (0.06, 0.12),
+    'gpt-4-1106-preview': (0.01, 0.03),
+    'gpt-4-turbo': (0.01, 0.03),
+    'gpt-4o': (0.005, 0.015),
+    'gpt-4o-mini': (0.00015, 0.0006),
+}
+
+_llm_context: ContextVar[tuple[str, str]] = ContextVar('macrec_llm_context', default=('unknown', 'unknown'))
+
+@contextmanager
+def llm_context(agent: str, stage: str) -> Iterator[None]:
+    """Attribute the LLM calls in the context to the agent and stage. The context follows asynchronous tasks and `asyncio.to_thread`.
+
+    Args:
+        `agent` (`str`): The name of the calling agent.
+        `stage` (`str`): The stage of the agent, e.g., `thought` or `action` of the manager.
+    """
+    token = _llm_context.set((agent, stage))
+    try:
+        yield
+    finally:
+        _llm_context.reset(token)
+
+def estimate_cost(model_name: str, prompt_tokens: int, completion_tokens: int) -> Optional[float]:
+    """Estimate the cost of a call in USD with `PRICES`.
+
+    Args:
+        `model_name` (`str`): The name of the model.
+        `prompt_tokens` (`int`): The number of prompt tokens.
+        `completion_tokens` (`int`): The number of completion tokens.
+    Returns:
+        `Optional[float]`: The estimated cost. `None` if the model is not in the price table.
+    """
+    matches = [name for name in PRICES if model_name.startswith(name)]
+    if len(matches) == 0:
+        return None
+    prompt_price, completion_price = PRICES[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+class Telemetry:
+    """
+    The recorder of the LLM calls in the process. Each call is recorded with the model, the calling agent and stage, the wall time, the time to first token (for streaming calls), and the prompt and completion tokens (`None` if the tokenizer of the model fails).
+    """
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.records: list[dict[str, Any]] = []
+        # the models whose tokenizer failed, to warn only once
+        self.uncounted_models: set[str] = set()
+
+    def _count_tokens(self, llm: 'BaseLLM', prompt: str, output: str) -> tuple[Optional[int], Optional[int]]:
+        # the telemetry must never change the result of a call, so a failing tokenizer (e.g., tiktoken offline) only leaves the tokens unknown
+        try:
+            return llm.count_tokens(prompt), llm.count_tokens(output) if output else 0
+        except Exception as e:
+            with self.lock:
+                warn = llm.model_name not in self.uncounted_models
+                self.uncounted_models.add(llm.model_name)
+            if warn:
+                logger.warning(f'Failed to count the tokens of {llm.model_name} for telemetry: {e.__class__.__name__}: {e}. Recording the calls without tokens...')
+            return None, None
+
+    def record(self, llm: 'BaseLLM', prompt: str, output: str, latency: float, ttft: Optional[float] = None, error: bool = False) -> None:
+        agent, stage = _llm_context.get()
+        prompt_tokens, completion_tokens = self._count_tokens(llm, prompt, output)
+        record = {
+            'model': llm.model_name,
+            'agent': agent,
+            'stage': stage,
+            'latency': latency,
+            'ttft': ttft,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'cost': estimate_cost(llm.model_name, prompt_tokens, completion_tokens) if prompt_tokens is not None else None,
+            'error': error,
+        }
+        with self.lock:
+            self.records.append(record)
+
+    def clear(self) -> None:
+        with self.lock:
+            self.records = []
+
+    @staticmethod
+    def _aggregate(records: list[dict[str, Any]]) -> dict[str, Any]:
+        latencies = np.array([record['latency'] for record in records])
+        ttfts = np.array([record['ttft'] for record in records if record['ttft'] is not None])
+        summary = {
+            'calls': len(records),
+            'errors': sum(record['error'] for record in records),
+            'uncounted': sum(record['prompt_tokens'] is None for record in records),
+            'total_time': float(latencies.sum()),
+            'latency_mean': float(latencies.mean()),
+            'latency_p50': float(np.percentile(latencies, 50)),
+            'latency_p95': float(np.percentile(latencies, 95)),
+            'latency_p99': float(np.percentile(latencies, 99)),
+            'prompt_tokens': sum(record['prompt_tokens'] for record in records if record['prompt_tokens'] is not None),
+            'completion_tokens': sum(record['completion_tokens'] for record in records if record['completion_tokens'] is not None),
+            'cost': sum(record['cost'] for record in records if record['cost'] is not None),
+        }
+        if len(ttfts) > 0:
+            summary['ttft_p50'] = float(np.percentile(ttfts, 50))
+            summary['ttft_p95'] = float(np.percentile(ttfts, 95))
+        return summary
+
+    def summary(self, n_samples: Optional[int] = None) -> dict[str, Any]:
+        """Summarize the recorded calls, overall, per agent and stage, and per model.
+
+        Args:
+            `n_samples` (`Optional[int]`): The number of data samples of the run, used for the per-sample averages. Defaults to `None`.
+        Returns:
+            `dict[str, Any]`: The summary. Empty if no call is recorded.
+        """
+        with self.lock:
+            records = list(self.records)
+        if len(records) == 0:
+            return {}
+        summary = self._aggregate(records)
+        if n_samples:
+            summary['samples'] = n_samples
+            summary['calls_per_sample'] = summary['calls'] / n_samples
+            summary['tokens_per_sample'] = (summary['prompt_tokens'] + summary['completion_tokens']) / n_samples
+            summary['cost_per_sample'] = summary['cost'] / n_samples
+        summary['unpriced_models'] = sorted(set(record['model'] for record in records if record['cost'] is None and record['prompt_tokens'] is not None))
+        groups: dict[str, list[dict[str, Any]]] = {}
+        models: dict[str, list[dict[str, Any]]] = {}
+        for record in records:
+            groups.setdefault(f'{record["agent"]}/{record["stage"]}', []).append(record)
+            models.setdefault(record['model'], []).append(record)
+        summary['by_agent_stage'] = {name: self._aggregate(group) for name, group in sorted(groups.items())}
+        summary['by_model'] = {name: self._aggregate(group) for name, group in sorted(models.items())}
+        return summary
+
+    def report(self, n_samples: Optional[int] = None) -> dict[str, Any]:
+        """Output the summary of the recorded calls.
+
+        Args:
+            `n_samples` (`Optional[int]`): The number of data samples of the run. Defaults to `None`.
+        Returns:
+            `dict[str, Any]`: The summary.
+        """
+        summary = self.summary(n_samples)
+        if len(summary) == 0:
+            logger.success('LLM telemetry: no calls recorded')
+            return summary
+        logger.success(f'LLM telemetry: {summary["calls"]} calls ({summary["errors"]} errors), latency p50 {summary["latency_p50"]:.3f}s, p95 {summary["latency_p95"]:.3f}s, p99 {summary["latency_p99"]:.3f}s')
+        logger.success(f'LLM telemetry: {summary["prompt_tokens"]} prompt tokens, {summary["completion_tokens"]} completion tokens, estimated cost ${summary["cost"]:.4f}')
+        if summary['uncounted'] > 0:
+            logger.warning(f'LLM telemetry: the tokens and cost of {summary["uncounted"]} calls are not counted, since their tokenizer failed')
+        if 'samples' in summary:
+            logger.success(f'LLM telemetry: {summary["calls_per_sample"]:.2f} calls, {summary["tokens_per_sample"]:.1f} tokens and ${summary["cost_per_sample"]:.5f} per sample')
+        for name, group in summary['by_agent_stage'].items():
+            logger.success(f'LLM telemetry [{name}]: {group["calls"]} calls, {group["total_time"]:.2f}s total, p50 {group["latency_p50"]:.3f}s, p95 {group["latency_p95"]:.3f}s, {group["prompt_tokens"]} + {group["completion_tokens"]} tokens, ${group["cost"]:.4f}')
+        return summary
+
+    def dump(self, path: str, n_samples: Optional[int] = None) -> None:
+        """Write the summary of the recorded calls to a JSON file.
+
+        Args:
+            `path` (`str`): The path to the JSON file.
+            `n_samples` (`Optional[int]`): The number of data samples of the run. Defaults to `None`.
+        """
+        with open(path, 'w') as f:
+            json.dump(self.summary(n_samples), f, indent=4)
+
+_telemetry = Telemetry()
+
+def get_telemetry() -> Telemetry:
+    """Get the process-wide LLM telemetry recorder.
+
+    Returns:
+        `Telemetry`: The recorder.
+    """
+    return _telemetry
+
+def traced(fn: Callable) -> Callable:
+    """Record the calls of an LLM method (`__call__`, `acall` or `stream`) to the process-wide telemetry. Apply it to the methods that call the model, so that calls served by the wrappers (e.g., cache hits) are not recorded as model calls.
+
+    Args:
+        `fn` (`Callable`): The method, whose first two arguments are the LLM and the prompt.
+    Returns:
+        `Callable`: The traced method.
+    """
+    if asyncio.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(self: 'BaseLLM', prompt: str, *args, **kwargs) -> str:
+            start = time.perf_counter()
+            output, error = '', True
+            try:
+                output = await fn(self, prompt, *args, **kwargs)
+                error = False
+                return output
+            finally:
+                _telemetry.record(self, prompt, output, time.perf_counter() - start, error=error)
+        return async_wrapper
+    elif inspect.isgeneratorfunction(fn):
+        @functools.wraps(fn)
+        def stream_wrapper(self: 'BaseLLM', prompt: str, *args, **kwargs) -> Iterator[str]:
+            start = time.perf_counter()
+            ttft = None
+            chunks = []
+            error = True
+            try:
+                for chunk in fn(self, prompt, *args, **kwargs):
+                    if ttft is None:
+                        ttft = time.perf_counter() - start
+                    chunks.append(chunk)
+                    yield chunk
+                error = False
+            except GeneratorExit:
+                # the consumer stopped early
+                error = False
+                raise
+            finally:
+                _telemetry.record(self, prompt, ''.join(chunks), time.perf_counter() - start, ttft=ttft, error=error)
+        return stream_wrapper
+    else:
+        @functools.wraps(fn)
+        def wrapper(self: 'BaseLLM', prompt: str, *args, **kwargs) -> str:
+            start = time.perf_counter()
+            output, error = '', True
+            try:
+                output = fn(self, prompt, *args, **kwargs)
+                error = False
+                return output
+            finally:
+                _telemetry.record(self, prompt, output, time.perf_counter() - start, error=error)
+        return wrapper
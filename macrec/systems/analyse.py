@@ -27,6 +27,18 @@ class AnalyseSystem(ReActSystem):
         logger.debug(f'Action {self.step_n}: {action}')
         return action_type, argument
 
+    async def aact(self) -> tuple[str, Any]:
+        # Act
+        if self.max_step == self.step_n:
+            self.scratchpad += f'\nHint: {self.manager.hint}'
+        self.scratchpad += f'\nValid action example: {self.manager.valid_action_example}:'
+        self.scratchpad += f'\nAction {self.step_n}:'
+        action = await self.manager.acall(input=self.input, scratchpad=self.scratchpad, stage='action', **self.manager_kwargs)
+        self.scratchpad += ' ' + action
+        action_type, argument = parse_action(action, json_mode=self.manager.json_mode)
+        logger.debug(f'Action {self.step_n}: {action}')
+        return action_type, argument
+
     def execute(self, action_type: str, argument: Any):
         if action_type.lower() == 'analyse':
             self.log(f':violet[Calling] :red[Analyst] :violet[with] :blue[{argument}]:violet[...]', agent=self.manager, logging=False)
@@ -38,3 +50,15 @@ class AnalyseSystem(ReActSystem):
             self.log(f'{log_head}{observation}', agent=self.manager, logging=False)
         else:
             super().execute(action_type, argument)
+
+    async def aexecute(self, action_type: str, argument: Any):
+        if action_type.lower() == 'analyse':
+            self.log(f':violet[Calling] :red[Analyst] :violet[with] :blue[{argument}]:violet[...]', agent=self.manager, logging=False)
+            observation = await self.analyst.ainvoke(argument=argument, json_mode=self.manager.json_mode)
+            log_head = f':violet[Response from] :red[Analyst] :violet[with] :blue[{argument}]:violet[:]\n- '
+            self.scratchpad += f'\nObservation: {observation}'
+
+            logger.debug(f'Observation: {observation}')
+            self.log(f'{log_head}{observation}', agent=self.manager, logging=False)
+        else:
+            await super().aexecute(action_type, argument)
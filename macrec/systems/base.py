@@ -1,12 +1,13 @@
+import asyncio
 import pandas as pd
 import streamlit as st
 from abc import ABC, abstractmethod
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 from loguru import logger
 from langchain.prompts import PromptTemplate
 
 from macrec.agents import Agent
-from macrec.utils import is_correct, init_answer, read_json, read_prompts, get_avatar, get_color
+from macrec.utils import is_correct, init_answer, read_json, read_prompts, get_avatar, get_color, StreamRenderer
 
 class System(ABC):
     """
@@ -55,7 +56,7 @@ class System(ABC):
         else:
             raise NotImplementedError
 
-    def __init__(self, task: str, config_path: str, leak: bool = False, web_demo: bool = False, dataset: Optional[str] = None, *args, **kwargs) -> None:
+    def __init__(self, task: str, config_path: str, leak: bool = False, web_demo: bool = False, dataset: Optional[str] = None, stream: bool = False, *args, **kwargs) -> None:
         """Initialize the system.
 
         Args:
@@ -64,6 +65,7 @@ class System(ABC):
             `leak` (`bool`, optional): Whether to leak the ground truth answer to the system during inference. Defaults to `False`.
             `web_demo` (`bool`, optional): Whether to run the system in web demo mode. Defaults to `False`.
             `dataset` (`str`, optional): The dataset to run in the system. Defaults to `None`.
+            `stream` (`bool`, optional): Whether the agents call their LLMs in streaming mode, which records the time to first token of each call. Always enabled in web demo mode, where the partial outputs are rendered. Defaults to `False`.
         """
         self.task = task
         assert self.task in self.supported_tasks()
@@ -86,6 +88,7 @@ class System(ABC):
         self.leak = leak
         self.web_demo = web_demo
         self.agent_kwargs['web_demo'] = web_demo
+        self.stream = stream or web_demo
         self.kwargs = kwargs
         self.init(*args, **kwargs)
         self.reset(clear=True)
@@ -113,6 +116,18 @@ class System(ABC):
             self.web_log.append(final_message)
             st.markdown(f'{final_message}')
 
+    def stream_callback(self, agent: Agent) -> Optional[Callable[[str], None]]:
+        """The callback to render the partial output of the agent while its LLM is streaming. The callback should be closed when the output is complete.
+
+        Args:
+            `agent` (`Agent`): The agent whose output is streamed.
+        Returns:
+            `Optional[Callable[[str], None]]`: The callback. `None` if the partial outputs are not rendered.
+        """
+        if self.web_demo:
+            return StreamRenderer(agent.__class__.__name__)
+        return None
+
     @abstractmethod
     def init(self, *args, **kwargs) -> None:
         """Initialize the system.
@@ -126,6 +141,10 @@ class System(ABC):
         self.clear_web_log()
         return self.forward(*args, **kwargs)
 
+    async def acall(self, *args: Any, **kwargs: Any) -> Any:
+        self.clear_web_log()
+        return await self.aforward(*args, **kwargs)
+
     def set_data(self, input: str, context: str, gt_answer: Any, data_sample: Optional[pd.Series] = None) -> None:
         self.input: str = input
         self.context: str = context
@@ -143,6 +162,14 @@ class System(ABC):
         """
         raise NotImplementedError("System.forward() not implemented")
 
+    async def aforward(self, *args, **kwargs) -> Any:
+        """Asynchronous forward pass of the system. By default, `forward` is run in the default executor of the running event loop. Subclasses should override this method to await the agents natively, so that many data samples can be in flight in one process.
+
+        Returns:
+            `Any`: The system output.
+        """
+        return await asyncio.to_thread(self.forward, *args, **kwargs)
+
     def is_finished(self) -> bool:
         return self.finished
 
@@ -102,6 +102,14 @@ class CollaborationSystem(System):
         self.scratchpad += ' ' + thought
         self.log(f'**Thought {self.step_n}**: {thought}', agent=self.manager)
 
+    async def athink(self):
+        # Think
+        logger.debug(f'Step {self.step_n}:')
+        self.scratchpad += f'\nThought {self.step_n}:'
+        thought = await self.manager.acall(scratchpad=self.scratchpad, stage='thought', **self.manager_kwargs)
+        self.scratchpad += ' ' + thought
+        self.log(f'**Thought {self.step_n}**: {thought}', agent=self.manager)
+
     def act(self) -> tuple[str, Any]:
         # Act
         if self.max_step == self.step_n:
@@ -114,6 +122,18 @@ class CollaborationSystem(System):
         logger.debug(f'Action {self.step_n}: {action}')
         return action_type, argument
 
+    async def aact(self) -> tuple[str, Any]:
+        # Act
+        if self.max_step == self.step_n:
+            self.scratchpad += f'\nHint: {self.manager.hint}'
+        self.scratchpad += f'\nValid action example: {self.manager.valid_action_example}:'
+        self.scratchpad += f'\nAction {self.step_n}:'
+        action = await self.manager.acall(scratchpad=self.scratchpad, stage='action', **self.manager_kwargs)
+        self.scratchpad += ' ' + action
+        action_type, argument = parse_action(action, json_mode=self.manager.json_mode)
+        logger.debug(f'Action {self.step_n}: {action}')
+        return action_type, argument
+
     def execute(self, action_type: str, argument: Any):
         # Execute
         log_head = ''
@@ -154,19 +174,59 @@ class CollaborationSystem(System):
         logger.debug(f'Observation: {observation}')
         self.log(f'{log_head}{observation}', agent=self.manager, logging=False)
 
+    async def aexecute(self, action_type: str, argument: Any):
+        # Execute
+        agent_name = {
+            'analyse': 'Analyst',
+            'search': 'Searcher',
+            'interpret': 'Interpreter',
+        }.get(action_type.lower(), None)
+        if agent_name is None or agent_name not in self.agents:
+            # finishing or invalid actions do not call other agents
+            self.execute(action_type, argument)
+            return
+        self.log(f':violet[Calling] :red[{agent_name}] :violet[with] :blue[{argument}]:violet[...]', agent=self.manager, logging=False)
+        observation = await self.agents[agent_name].ainvoke(argument=argument, json_mode=self.manager.json_mode)
+        log_head = f':violet[Response from] :red[{agent_name}] :violet[with] :blue[{argument}]:violet[:]\n- '
+
+        self.scratchpad += f'\nObservation: {observation}'
+
+        logger.debug(f'Observation: {observation}')
+        self.log(f'{log_head}{observation}', agent=self.manager, logging=False)
+
     def step(self):
         self.think()
         action_type, argument = self.act()
         self.execute(action_type, argument)
         self.step_n += 1
 
-    def reflect(self) -> bool:
+    async def astep(self):
+        await self.athink()
+        action_type, argument = await self.aact()
+        await self.aexecute(action_type, argument)
+        self.step_n += 1
+
+    def _need_reflection(self) -> bool:
         if (not self.is_finished() and not self.is_halted()) or self.reflector is None:
             self.reflected = False
             if self.reflector is not None:
                 self.manager_kwargs['reflections'] = ''
             return False
+        return True
+
+    def reflect(self) -> bool:
+        if not self._need_reflection():
+            return False
         self.reflector(self.input, self.scratchpad)
+        return self._after_reflection()
+
+    async def areflect(self) -> bool:
+        if not self._need_reflection():
+            return False
+        await self.reflector.acall(self.input, self.scratchpad)
+        return self._after_reflection()
+
+    def _after_reflection(self) -> bool:
         self.reflected = True
         self.manager_kwargs['reflections'] = self.reflector.reflections_str
         if self.reflector.json_mode:
@@ -186,6 +246,14 @@ class CollaborationSystem(System):
             if self.interpreter is not None:
                 self.manager_kwargs['task_prompt'] = self.interpreter(input=self.input)
 
+    async def ainterprete(self) -> None:
+        if self.task == 'chat':
+            assert self.interpreter is not None, 'Interpreter is required for chat task.'
+            self.manager_kwargs['task_prompt'] = await self.interpreter.acall(input=self.chat_history)
+        else:
+            if self.interpreter is not None:
+                self.manager_kwargs['task_prompt'] = await self.interpreter.acall(input=self.input)
+
     def forward(self, user_input: Optional[str] = None, reset: bool = True) -> Any:
         if self.task == 'chat':
             self.manager_kwargs['history'] = self.chat_history
@@ -205,6 +273,25 @@ class CollaborationSystem(System):
             self.add_chat_history(self.answer, role='system')
         return self.answer
 
+    async def aforward(self, user_input: Optional[str] = None, reset: bool = True) -> Any:
+        if self.task == 'chat':
+            self.manager_kwargs['history'] = self.chat_history
+        else:
+            self.manager_kwargs['input'] = self.input
+        if await self.areflect():
+            return self.answer
+        if reset:
+            self.reset()
+        if self.task == 'chat':
+            assert user_input is not None, 'User input is required for chat task.'
+            self.add_chat_history(user_input, role='user')
+        await self.ainterprete()
+        while not self.is_finished() and not self.is_halted():
+            await self.astep()
+        if self.task == 'chat':
+            self.add_chat_history(self.answer, role='system')
+        return self.answer
+
     def chat(self) -> None:
         assert self.task == 'chat', 'Chat task is required for chat method.'
         print("Start chatting with the system. Type 'exit' or 'quit' to end the conversation.")
@@ -41,6 +41,14 @@ class ReActSystem(System):
         self.scratchpad += ' ' + thought
         self.log(f'**Thought {self.step_n}**: {thought}', agent=self.manager)
 
+    async def athink(self):
+        # Think
+        logger.debug(f'Step {self.step_n}:')
+        self.scratchpad += f'\nThought {self.step_n}:'
+        thought = await self.manager.acall(input=self.input, scratchpad=self.scratchpad, stage='thought', **self.manager_kwargs)
+        self.scratchpad += ' ' + thought
+        self.log(f'**Thought {self.step_n}**: {thought}', agent=self.manager)
+
     def act(self) -> tuple[str, Any]:
         # Act
         if not self.manager.json_mode:
@@ -54,6 +62,19 @@ class ReActSystem(System):
         logger.debug(f'Action {self.step_n}: {action}')
         return action_type, argument
 
+    async def aact(self) -> tuple[str, Any]:
+        # Act
+        if not self.manager.json_mode:
+            # TODO: may by removed after adding more actions
+            self.scratchpad += f'\nHint: {self.manager.hint}'
+        self.scratchpad += f'\nValid action example: {self.manager.valid_action_example}:'
+        self.scratchpad += f'\nAction {self.step_n}:'
+        action = await self.manager.acall(input=self.input, scratchpad=self.scratchpad, stage='action', **self.manager_kwargs)
+        self.scratchpad += ' ' + action
+        action_type, argument = parse_action(action, json_mode=self.manager.json_mode)
+        logger.debug(f'Action {self.step_n}: {action}')
+        return action_type, argument
+
     def execute(self, action_type: str, argument: Any):
         # Execute
         log_head = ''
@@ -79,15 +100,31 @@ class ReActSystem(System):
         logger.debug(f'Observation: {observation}')
         self.log(f'{log_head}{observation}', agent=self.manager, logging=False)
 
+    async def aexecute(self, action_type: str, argument: Any):
+        self.execute(action_type, argument)
+
     def step(self):
         self.think()
         action_type, argument = self.act()
         self.execute(action_type, argument)
         self.step_n += 1
 
+    async def astep(self):
+        await self.athink()
+        action_type, argument = await self.aact()
+        await self.aexecute(action_type, argument)
+        self.step_n += 1
+
     def forward(self, reset: bool = True) -> Any:
         if reset:
             self.reset()
         while not self.is_finished() and not self.is_halted():
             self.step()
         return self.answer
+
+    async def aforward(self, reset: bool = True) -> Any:
+        if reset:
+            self.reset()
+        while not self.is_finished() and not self.is_halted():
+            await self.astep()
+        return self.answer
@@ -23,18 +23,34 @@ class ReflectionSystem(ReActSystem):
             self.reflector.reflections = []
             self.reflector.reflections_str = ''
 
+    def _is_reflection_correct(self) -> bool:
+        if self.reflector.json_mode:
+            reflection_json = json.loads(self.reflector.reflections[-1])
+            if 'correctness' in reflection_json and reflection_json['correctness']:
+                # don't forward if the last reflection is correct
+                logger.debug("Last reflection is correct, don't forward")
+                self.log(":red[**Last reflection is correct, don't forward**]", agent=self.reflector, logging=False)
+                return True
+        return False
+
     def forward(self, reset: bool = True) -> Any:
         if self.is_finished() or self.is_halted():
             self.reflector(self.input, self.scratchpad)
             self.reflected = True
-            if self.reflector.json_mode:
-                reflection_json = json.loads(self.reflector.reflections[-1])
-                if 'correctness' in reflection_json and reflection_json['correctness']:
-                    # don't forward if the last reflection is correct
-                    logger.debug("Last reflection is correct, don't forward")
-                    self.log(":red[**Last reflection is correct, don't forward**]", agent=self.reflector, logging=False)
-                    return self.answer
+            if self._is_reflection_correct():
+                return self.answer
         else:
             self.reflected = False
         self.manager_kwargs['reflections'] = self.reflector.reflections_str
         return super().forward(reset=reset)
+
+    async def aforward(self, reset: bool = True) -> Any:
+        if self.is_finished() or self.is_halted():
+            await self.reflector.acall(self.input, self.scratchpad)
+            self.reflected = True
+            if self._is_reflection_correct():
+                return self.answer
+        else:
+            self.reflected = False
+        self.manager_kwargs['reflections'] = self.reflector.reflections_str
+        return await super().aforward(reset=reset)
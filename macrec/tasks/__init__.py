@@ -3,6 +3,7 @@ from macrec.tasks.preprocess import PreprocessTask
 from macrec.tasks.sample import SampleTask
 from macrec.tasks.calculate import CalculateTask
 from macrec.tasks.reward_update import RewardUpdateTask
+from macrec.tasks.mock_server import MockServerTask
 
 from macrec.tasks.pure_generation import PureGenerationTask as GenerationTask, TestGenerationTask
 from macrec.tasks.evaluate import EvaluateTask
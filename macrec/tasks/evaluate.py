@@ -6,6 +6,7 @@ from loguru import logger
 from argparse import ArgumentParser
 
 from macrec.tasks.generation import GenerationTask
+from macrec.llms import get_telemetry
 from macrec.utils import str2list, NumpyEncoder
 from macrec.systems import ReflectionSystem
 from macrec.evaluation import MetricDict, HitRatioAt, NDCGAt, RMSE, Accuracy, MAE
@@ -70,7 +71,10 @@ class EvaluateTask(GenerationTask):
             'topk': self.topks,
         }
         output_file_name = '_'.join([f'{k}={v}' for k, v in output_args.items()]) + '.jsonl'
-        self.output_file = jsonlines.open(os.path.join(run_dir, output_file_name), mode="w", dumps=NumpyEncoder(ensure_ascii=False).encode, flush=True)
+        self.output_path = os.path.join(run_dir, output_file_name)
+        self.output_file = jsonlines.open(self.output_path, mode="w", dumps=NumpyEncoder(ensure_ascii=False).encode, flush=True)
+        self.n_samples = 0
+        get_telemetry().clear()
 
     def after_step(self, answer: Any, gt_answer: int | float | str, step: int, record: dict) -> None:
         record[f'Answer_{step}'] = answer
@@ -82,12 +86,19 @@ class EvaluateTask(GenerationTask):
     def after_iteration(self, answer: Any, gt_answer: int | float | str, record: dict, pbar: tqdm) -> None:
         record['Answer_GT'] = gt_answer
         self.output_file.write(record)
+        self.n_samples += 1
         pbar.set_description(self.update_evaluation(answer, gt_answer))
 
     def after_generate(self) -> None:
         self.output_file.close()
         logger.success("===================================Evaluation Report===================================")
         self.metrics.report()
+        logger.success("===================================Telemetry Report===================================")
+        telemetry = get_telemetry()
+        telemetry.report(n_samples=self.n_samples)
+        telemetry_path = os.path.splitext(self.output_path)[0] + '.telemetry.json'
+        telemetry.dump(telemetry_path, n_samples=self.n_samples)
+        logger.success(f'LLM telemetry written to {telemetry_path}')
 
     def run(self, steps: int, topks: list[int], *args, **kwargs):
         assert kwargs['task'] == 'rp' or kwargs['task'] == 'sr', "Only support ranking and rating tasks."
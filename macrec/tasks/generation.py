@@ -1,14 +1,18 @@
 import os
+import asyncio
 import pandas as pd
 from abc import abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 from tqdm import tqdm
 from typing import Any
 from loguru import logger
 from argparse import ArgumentParser
 
 from macrec.tasks.base import Task
+from macrec.llms import init_llm_cache, get_llm_cache, init_single_flight, get_single_flight, hedging_policies
+from macrec.tools import get_tool_memo
 from macrec.utils import init_openai_api, read_json
-from macrec.systems import ReActSystem, ReflectionSystem, AnalyseSystem, CollaborationSystem
+from macrec.systems import System, ReActSystem, ReflectionSystem, AnalyseSystem, CollaborationSystem
 
 class GenerationTask(Task):
     @staticmethod
@@ -20,6 +24,11 @@ class GenerationTask(Task):
         parser.add_argument('--system_config', type=str, required=True, help='System configuration file')
         parser.add_argument('--task', type=str, default='rp', choices=['rp', 'sr', 'gen'], help='Task name')
         parser.add_argument('--max_his', type=int, default=10, help='Max history length')
+        parser.add_argument('--concurrency', type=int, default=1, help='Number of data samples in flight at the same time, each served by its own system')
+        parser.add_argument('--stream', action='store_true', help='Call the LLMs in streaming mode and record the time to first token of each call')
+        parser.add_argument('--single_flight', action='store_true', help='Collapse concurrent identical LLM calls into one upstream call')
+        parser.add_argument('--llm_cache', type=str, default=None, help='Path to the persistent LLM response cache file. Disable the cache if not given')
+        parser.add_argument('--llm_cache_size', type=int, default=1024, help='Maximum size of the LLM response cache in MiB')
         return parser
 
     def get_data(self, data_file: str, max_his: int) -> pd.DataFrame:
@@ -63,15 +72,15 @@ class GenerationTask(Task):
         else:
             raise NotImplementedError
 
-    def get_system(self, system: str, system_config: str):
+    def get_system(self, system: str, system_config: str) -> System:
         if system == 'react':
-            self.system = ReActSystem(config_path=system_config, **self.system_kwargs)
+            return ReActSystem(config_path=system_config, **self.system_kwargs)
         elif system == 'reflection':
-            self.system = ReflectionSystem(config_path=system_config, **self.system_kwargs)
+            return ReflectionSystem(config_path=system_config, **self.system_kwargs)
         elif system == 'analyse':
-            self.system = AnalyseSystem(config_path=system_config, **self.system_kwargs)
+            return AnalyseSystem(config_path=system_config, **self.system_kwargs)
         elif system == 'collaboration':
-            self.system = CollaborationSystem(config_path=system_config, **self.system_kwargs)
+            return CollaborationSystem(config_path=system_config, **self.system_kwargs)
         else:
             raise NotImplementedError
 
@@ -147,19 +156,72 @@ class GenerationTask(Task):
                 pbar.update(1)
         self.after_generate()
 
-    def run(self, api_config: str, dataset: str, data_file: str, system: str, system_config: str, task: str, max_his: int):
+    async def agenerate(self, data: list[tuple[str, int | float | str, pd.Series]], steps: int = 2):
+        """Generate with at most `self.concurrency` data samples in flight. Each in-flight sample is served by its own system, so the hooks are called with `self.system` pointing to the system that produced the answer.
+
+        Args:
+            `data` (`list[tuple[str, int | float | str, pd.Series]]`): The data samples.
+            `steps` (`int`, optional): The steps to run for each trial. Defaults to `2`.
+        """
+        self.before_generate()
+        n_systems = max(1, min(self.concurrency, len(data)))
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=n_systems))
+        systems: asyncio.Queue[System] = asyncio.Queue()
+        systems.put_nowait(self.system)
+        for _ in range(n_systems - 1):
+            systems.put_nowait(self.get_system(self.args.system, self.args.system_config))
+        with tqdm(total=len(data)) as pbar:
+            async def generate_one(test_data: str, gt_answer: int | float | str, data_sample: pd.Series):
+                system = await systems.get()
+                try:
+                    record = dict()
+                    system.set_data(input=test_data, context="", gt_answer=gt_answer, data_sample=data_sample)
+                    system.reset(clear=True)
+                    for i in range(steps):
+                        logger.debug(f'===================================Running step {i}...===================================')
+                        answer = await system.acall()
+                        # no awaiting between switching the system and calling the hook
+                        self.system = system
+                        self.after_step(answer=answer, gt_answer=gt_answer, step=i, record=record)
+                    self.system = system
+                    self.after_iteration(answer=system.answer, gt_answer=gt_answer, record=record, pbar=pbar)
+                    pbar.update(1)
+                finally:
+                    systems.put_nowait(system)
+
+            await asyncio.gather(*[generate_one(test_data, gt_answer, data_sample) for test_data, gt_answer, data_sample in data])
+        self.after_generate()
+
+    def run(self, api_config: str, dataset: str, data_file: str, system: str, system_config: str, task: str, max_his: int, concurrency: int, stream: bool, single_flight: bool, llm_cache: str, llm_cache_size: int):
         if dataset == 'None':
             dataset = os.path.basename(os.path.dirname(data_file))
         self.dataset = dataset
         self.task = task
         self.max_his = max_his
+        self.concurrency = concurrency
         self.system_kwargs = {
             'task': self.task,
             'leak': False,
             'dataset': self.dataset,
+            'stream': stream,
         }
         init_openai_api(read_json(api_config))
+        if single_flight:
+            init_single_flight()
+        if llm_cache is not None:
+            init_llm_cache(path=llm_cache, max_size=llm_cache_size << 20)
         data_df = self.get_data(data_file, max_his)
-        self.get_system(system, system_config)
+        self.system = self.get_system(system, system_config)
         data = self.prompt_data(data_df)
-        self.generate(data, steps=self.running_steps)
+        if self.concurrency > 1:
+            asyncio.run(self.agenerate(data, steps=self.running_steps))
+        else:
+            self.generate(data, steps=self.running_steps)
+        for (model_name, _), policy in hedging_policies().items():
+            policy.report(f'Hedging of {model_name}')
+        if get_single_flight() is not None:
+            get_single_flight().report()
+        if get_llm_cache() is not None:
+            get_llm_cache().report('LLM cache')
+        if get_tool_memo() is not None:
+            get_tool_memo().report()
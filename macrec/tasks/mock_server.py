@@ -0,0 +1,340 @@
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from loguru import logger
+from typing import Callable, Optional
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from macrec.tasks.base import Task
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """Parse the latency distribution.
+
+    Args:
+        `spec` (`str`): The distribution in seconds, one of `constant:<value>`, `uniform:<low>,<high>`, `normal:<mean>,<std>`, `lognormal:<mu>,<sigma>` and `exponential:<mean>`. A bare number is a constant latency.
+    Raises:
+        `ValueError`: Unsupported distribution.
+    Returns:
+        `Callable[[random.Random], float]`: The sampler of latencies, given the random generator.
+    """
+    name, _, params = spec.partition(':')
+    if params == '':
+        name, params = 'constant', name
+    values = [float(value) for value in params.split(',')]
+    if name == 'constant':
+        return lambda rng: values[0]
+    elif name == 'uniform':
+        return lambda rng: rng.uniform(values[0], values[1])
+    elif name == 'normal':
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    elif name == 'lognormal':
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    elif name == 'exponential':
+        return lambda rng: rng.expovariate(1 / values[0]) if values[0] > 0 else 0.0
+    else:
+        raise ValueError(f'Unsupported latency distribution: {spec}')
+
+class MockResponder:
+    """
+    Rule-based replies for the prompt families of the agents. The scripted rules are tried first, then the built-in rules for the Manager thought and action, the Analyst, Searcher and Interpreter commands and the Reflector. Replies only depend on the prompt, so a run is reproducible.
+    """
+    def __init__(self, script: Optional[str] = None) -> None:
+        """Initialize the responder.
+
+        Args:
+            `script` (`Optional[str]`): The path to a JSON file with a list of `{"pattern": ..., "reply": ...}` rules. The first rule whose regular expression `pattern` is found in the prompt wins, and its `reply` is expanded with the groups of the match (e.g., `\\1`). Defaults to `None`.
+        """
+        self.rules: list[tuple[re.Pattern, str]] = []
+        if script is not None:
+            with open(script, 'r') as f:
+                self.rules = [(re.compile(rule['pattern'], re.DOTALL), rule['reply']) for rule in json.load(f)]
+
+    @staticmethod
+    def _seed(text: str) -> int:
+        return int(hashlib.md5(text.encode('utf-8')).hexdigest()[:8], 16)
+
+    @staticmethod
+    def _input(prompt: str) -> str:
+        # the last input section, after the few-shot examples
+        index = prompt.rfind('Input:\n')
+        return prompt[index:] if index >= 0 else prompt
+
+    @staticmethod
+    def _command(command_type: str, content, json_mode: bool) -> str:
+        if json_mode:
+            return json.dumps({'type': command_type, 'content': content}, ensure_ascii=False)
+        if isinstance(content, list):
+            content = ', '.join(str(value) for value in content)
+        return f'{command_type}[{content}]'
+
+    def _answer(self, prompt: str, json_mode: bool):
+        input = self._input(prompt)
+        rng = random.Random(self._seed(input))
+        if 'star rating' in input:
+            return float(rng.randint(1, 5))
+        candidates = [int(item_id) for item_id in re.findall(r'^(\d+):', input, re.MULTILINE)]
+        if len(candidates) > 0:
+            rng.shuffle(candidates)
+            return candidates if json_mode else ', '.join(str(item_id) for item_id in candidates)
+        return 'The user may like the item because it matches the preferences of the user.'
+
+    def _manager(self, prompt: str, stage: str, step: int, json_mode: bool) -> str:
+        if stage == 'Thought':
+            return f'I need to decide the next action for step {step}.'
+        user_id = re.search(r'user_(\d+)', self._input(prompt))
+        can_analyse = 'Analyse[' in prompt or '"Analyse"' in prompt
+        if step == 1 and can_analyse and user_id is not None and 'This is the final step' not in prompt[-500:]:
+            return self._command('Analyse', ['user', int(user_id.group(1))], json_mode)
+        return self._command('Finish', self._answer(prompt, json_mode), json_mode)
+
+    def _analyst(self, prompt: str, json_mode: bool) -> str:
+        turns = prompt.count('\nObservation: ')
+        match = re.search(r'Remember the (user|item) id is (\d+)', prompt)
+        analyse_type, id = (match.group(1), int(match.group(2))) if match is not None else ('user', 0)
+        if turns == 0:
+            return self._command(f'{analyse_type.capitalize()}Info', id, json_mode)
+        elif turns == 1:
+            return self._command(f'{analyse_type.capitalize()}History', [id, 3], json_mode)
+        return self._command('Finish', f'The {analyse_type} {id} shows consistent preferences in the history.', json_mode)
+
+    def reply(self, prompt: str, json_mode: bool = False) -> str:
+        """Reply to the prompt.
+
+        Args:
+            `prompt` (`str`): The prompt. For chat requests, the contents of the messages joined by newlines.
+            `json_mode` (`bool`, optional): Whether the JSON response format is requested. Defaults to `False`.
+        Returns:
+            `str`: The reply.
+        """
+        for pattern, reply in self.rules:
+            match = pattern.search(prompt)
+            if match is not None:
+                return match.expand(reply)
+        json_mode = json_mode or 'in JSON format' in prompt
+        tail = prompt.rstrip()
+        if tail.endswith('Reflection:'):
+            reason = 'The previous trial did not analyse the user and item before giving the answer. I should analyse both of them first.'
+            return json.dumps({'correctness': False, 'reason': reason}) if json_mode else reason
+        step = re.search(r'(Thought|Action) (\d+):$', tail)
+        if step is not None:
+            return self._manager(prompt, step.group(1), int(step.group(2)), json_mode)
+        if tail.endswith('Command:'):
+            if 'act as an analyst' in prompt:
+                return self._analyst(prompt, json_mode)
+            elif 'search the wikipedia' in prompt:
+                if prompt.count('\nObservation: ') == 0:
+                    requirements = re.search(r'Requirements: (.*)', prompt)
+                    return self._command('Search', requirements.group(1) if requirements is not None else 'recommendation', json_mode)
+                return self._command('Finish', 'No more relevant information is found.', json_mode)
+            elif 'prompt interpreter' in prompt:
+                return self._command('Finish', 'Please recommend items according to the preferences of the user.', json_mode)
+        return 'OK.'
+
+class MockOpenAIServer:
+    """
+    A local stand-in of the OpenAI API, serving `/v1/chat/completions` and `/v1/completions` (with streaming) by `MockResponder`. Latency and errors are injected to make it a load test target. Point `init_openai_api` at `http://<host>:<port>/v1` to use it.
+    """
+    def __init__(self, host: str = '127.0.0.1', port: int = 8000, latency: str = 'constant:0', chunk_latency: str = 'constant:0', rate_limit_error_rate: float = 0.0, server_error_rate: float = 0.0, retry_after: float = 1.0, script: Optional[str] = None, seed: int = 0) -> None:
+        """Initialize the server.
+
+        Args:
+            `host` (`str`, optional): The host to bind. Defaults to `'127.0.0.1'`.
+            `port` (`int`, optional): The port to bind. Use `0` for a free port. Defaults to `8000`.
+            `latency` (`str`, optional): The distribution of the latency before the response (or the first chunk). See `parse_latency`. Defaults to `'constant:0'`.
+            `chunk_latency` (`str`, optional): The distribution of the latency between streamed chunks. Defaults to `'constant:0'`.
+            `rate_limit_error_rate` (`float`, optional): The probability of answering a request with 429. Defaults to `0.0`.
+            `server_error_rate` (`float`, optional): The probability of answering a request with 500. Defaults to `0.0`.
+            `retry_after` (`float`, optional): The `Retry-After` header of 429 responses in seconds. Defaults to `1.0`.
+            `script` (`Optional[str]`): The path to the scripted rules of `MockResponder`. Defaults to `None`.
+            `seed` (`int`, optional): The seed of the latencies and errors. Defaults to `0`.
+        """
+        self.responder = MockResponder(script=script)
+        self.latency = parse_latency(latency)
+        self.chunk_latency = parse_latency(chunk_latency)
+        self.rate_limit_error_rate = rate_limit_error_rate
+        self.server_error_rate = server_error_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'rate_limit_errors': 0, 'server_errors': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+        self.httpd = ThreadingHTTPServer((host, port), self._handler())
+        self.httpd.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/v1'
+
+    def _sample(self) -> tuple[Optional[int], float]:
+        # the error status (if any) and the latency of a request
+        with self.lock:
+            self.stats['requests'] += 1
+            p = self.rng.random()
+            latency = self.latency(self.rng)
+            if p < self.rate_limit_error_rate:
+                self.stats['rate_limit_errors'] += 1
+                return 429, latency
+            if p < self.rate_limit_error_rate + self.server_error_rate:
+                self.stats['server_errors'] += 1
+                return 500, latency
+            return None, latency
+
+    def _next_chunk_latency(self) -> float:
+        with self.lock:
+            return self.chunk_latency(self.rng)
+
+    def _count(self, prompt: str, completion: str) -> dict[str, int]:
+        usage = {
+            'prompt_tokens': len(prompt.split()),
+            'completion_tokens': len(completion.split()),
+        }
+        usage['total_tokens'] = usage['prompt_tokens'] + usage['completion_tokens']
+        with self.lock:
+            self.stats['prompt_tokens'] += usage['prompt_tokens']
+            self.stats['completion_tokens'] += usage['completion_tokens']
+        return usage
+
+    def _handler(self) -> type[BaseHTTPRequestHandler]:
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format: str, *args) -> None:
+                logger.trace(format % args)
+
+            def handle(self) -> None:
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    # the client gave up the request, e.g., the losing request of hedging
+                    logger.trace('Client disconnected')
+
+            def _send_json(self, status: int, body: dict, headers: dict[str, str] = {}) -> None:
+                data = json.dumps(body).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for key, value in headers.items():
+                    self.send_header(key, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def _send_error(self, status: int) -> None:
+                if status == 429:
+                    self._send_json(429, {'error': {'message': 'Rate limit reached (mock).', 'type': 'requests', 'code': 'rate_limit_exceeded'}}, {'Retry-After': str(server.retry_after)})
+                else:
+                    self._send_json(status, {'error': {'message': 'The server had an error (mock).', 'type': 'server_error', 'code': None}})
+
+            def do_GET(self) -> None:
+                if self.path.rstrip('/').endswith('/models'):
+                    self._send_json(200, {'object': 'list', 'data': [{'id': 'mock', 'object': 'model', 'owned_by': 'macrec'}]})
+                else:
+                    self._send_json(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}})
+
+            def do_POST(self) -> None:
+                request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+                if self.path.endswith('/chat/completions'):
+                    chat = True
+                    prompt = '\n'.join(message.get('content') or '' for message in request.get('messages', []))
+                elif self.path.endswith('/completions'):
+                    chat = False
+                    prompt = request.get('prompt', '')
+                    prompt = prompt[0] if isinstance(prompt, list) else prompt
+                else:
+                    self._send_json(404, {'error': {'message': f'Unknown path {self.path}', 'type': 'invalid_request_error'}})
+                    return
+                status, latency = server._sample()
+                time.sleep(latency)
+                if status is not None:
+                    self._send_error(status)
+                    return
+                json_mode = (request.get('response_format') or {}).get('type') == 'json_object'
+                text = server.responder.reply(prompt, json_mode=json_mode)
+                usage = server._count(prompt, text)
+                model = request.get('model', 'mock')
+                id = f'{"chatcmpl" if chat else "cmpl"}-mock-{server.stats["requests"]}'
+                created = int(time.time())
+                if not request.get('stream', False):
+                    if chat:
+                        choice = {'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop', 'logprobs': None}
+                    else:
+                        choice = {'index': 0, 'text': text, 'finish_reason': 'stop', 'logprobs': None}
+                    self._send_json(200, {'id': id, 'object': 'chat.completion' if chat else 'text_completion', 'created': created, 'model': model, 'choices': [choice], 'usage': usage})
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Cache-Control', 'no-cache')
+                self.send_header('Connection', 'close')
+                self.end_headers()
+                self.close_connection = True
+                pieces = re.findall(r'\s*\S+', text) + [None]
+                for i, piece in enumerate(pieces):
+                    if i > 0:
+                        time.sleep(server._next_chunk_latency())
+                    finish_reason = 'stop' if piece is None else None
+                    if chat:
+                        delta = {} if piece is None else {'role': 'assistant', 'content': piece} if i == 0 else {'content': piece}
+                        choice = {'index': 0, 'delta': delta, 'finish_reason': finish_reason, 'logprobs': None}
+                    else:
+                        choice = {'index': 0, 'text': piece or '', 'finish_reason': finish_reason, 'logprobs': None}
+                    chunk = {'id': id, 'object': 'chat.completion.chunk' if chat else 'text_completion', 'created': created, 'model': model, 'choices': [choice]}
+                    self.wfile.write(f'data: {json.dumps(chunk)}\n\n'.encode('utf-8'))
+                    self.wfile.flush()
+                self.wfile.write(b'data: [DONE]\n\n')
+                self.wfile.flush()
+
+        return Handler
+
+    def start(self) -> str:
+        """Serve in a background thread.
+
+        Returns:
+            `str`: The base URL of the API.
+        """
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.base_url
+
+    def shutdown(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.thread is not None:
+            self.thread.join()
+
+    def report(self) -> None:
+        logger.success(f'Mock server: {self.stats["requests"]} requests, {self.stats["rate_limit_errors"]} rate limit errors, {self.stats["server_errors"]} server errors')
+        logger.success(f'Mock server: {self.stats["prompt_tokens"]} prompt tokens, {self.stats["completion_tokens"]} completion tokens (whitespace tokens)')
+
+class MockServerTask(Task):
+    @staticmethod
+    def parse_task_args(parser: ArgumentParser) -> ArgumentParser:
+        parser.add_argument('--host', type=str, default='127.0.0.1', help='Host to bind')
+        parser.add_argument('--port', type=int, default=8000, help='Port to bind')
+        parser.add_argument('--latency', type=str, default='constant:0', help='Latency distribution in seconds before the response, e.g., constant:0.5, uniform:0.2,1.0, normal:0.8,0.2, lognormal:-0.5,0.4, exponential:0.5')
+        parser.add_argument('--chunk_latency', type=str, default='constant:0', help='Latency distribution in seconds between streamed chunks')
+        parser.add_argument('--rate_limit_error_rate', type=float, default=0.0, help='Probability of answering a request with 429')
+        parser.add_argument('--server_error_rate', type=float, default=0.0, help='Probability of answering a request with 500')
+        parser.add_argument('--retry_after', type=float, default=1.0, help='Retry-After header of 429 responses in seconds')
+        parser.add_argument('--script', type=str, default=None, help='JSON file of scripted replies, a list of {"pattern": regex, "reply": text}')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed of the latencies and errors')
+        return parser
+
+    def run(self, host: str, port: int, latency: str, chunk_latency: str, rate_limit_error_rate: float, server_error_rate: float, retry_after: float, script: Optional[str], seed: int) -> None:
+        server = MockOpenAIServer(host=host, port=port, latency=latency, chunk_latency=chunk_latency, rate_limit_error_rate=rate_limit_error_rate, server_error_rate=server_error_rate, retry_after=retry_after, script=script, seed=seed)
+        logger.success(f'Mock OpenAI API serving at {server.base_url}')
+        try:
+            server.httpd.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.httpd.server_close()
+            server.report()
+
+if __name__ == '__main__':
+    MockServerTask().launch()
@@ -1,12 +1,17 @@
-from macrec.tools.base import Tool
+from macrec.tools.registry import get_shared_state, shared_states, release_shared_states
+from macrec.tools.base import Tool, RetrievalTool, ToolMemo, init_tool_memo, get_tool_memo, memoized
 from macrec.tools.summarize import TextSummarizer
 from macrec.tools.wikipedia import Wikipedia
+from macrec.tools.bm25 import BM25
 from macrec.tools.info_database import InfoDatabase
 from macrec.tools.interaction import InteractionRetriever
+from macrec.tools.similar_item import SimilarItemRetriever
 
 TOOL_MAP: dict[str, type] = {
     'summarize': TextSummarizer,
     'wikipedia': Wikipedia,
+    'bm25': BM25,
     'info': InfoDatabase,
     'interaction': InteractionRetriever,
+    'similar': SimilarItemRetriever,
 }
@@ -1,23 +1,228 @@
+import os
+import json
+import functools
+import threading
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from loguru import logger
+from typing import Any, Callable, Hashable, Optional, TypeVar
+from langchain_core.documents import Document
 
-from macrec.utils import read_json
+from macrec.tools.registry import get_shared_state
+from macrec.utils import read_json, get_rm
+
+T = TypeVar('T')
+
+class ToolMemo:
+    """
+    A bounded in-memory LRU memo of the results of tool calls, shared by the tools in the process so that the samples touching the same user or item reuse the results. The hits and misses are counted per tool method.
+    """
+    def __init__(self, max_size: int = 65536) -> None:
+        """Initialize the memo.
+
+        Args:
+            `max_size` (`int`, optional): The maximum number of memoized results. Defaults to `65536`.
+        """
+        self.max_size = max_size
+        self.entries: OrderedDict[Hashable, Any] = OrderedDict()
+        self.hits: dict[str, int] = {}
+        self.misses: dict[str, int] = {}
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get(self, name: str, key: Hashable) -> tuple[bool, Any]:
+        """Get the memoized result.
+
+        Args:
+            `name` (`str`): The name of the tool method, e.g., `InfoDatabase.user_info`, used in the statistics.
+            `key` (`Hashable`): The key of the call.
+        Returns:
+            `tuple[bool, Any]`: Whether the result is found, and the result.
+        """
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits[name] = self.hits.get(name, 0) + 1
+                return True, self.entries[key]
+            self.misses[name] = self.misses.get(name, 0) + 1
+            return False, None
+
+    def put(self, key: Hashable, result: Any) -> None:
+        with self.lock:
+            self.entries[key] = result
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.hits.clear()
+            self.misses.clear()
+            self.evictions = 0
+
+    def stats(self) -> dict[str, Any]:
+        """Statistics of the memo.
+
+        Returns:
+            `dict[str, Any]`: The number of entries and evictions, and the hits, misses and hit rate of each tool method.
+        """
+        with self.lock:
+            methods = {}
+            for name in sorted(set(self.hits) | set(self.misses)):
+                hits, misses = self.hits.get(name, 0), self.misses.get(name, 0)
+                methods[name] = {'hits': hits, 'misses': misses, 'hit_rate': hits / (hits + misses)}
+            return {'entries': len(self.entries), 'evictions': self.evictions, 'methods': methods}
+
+    def report(self, name: str = 'Tool memo') -> None:
+        stats = self.stats()
+        for method, method_stats in stats['methods'].items():
+            logger.success(f'{name} of {method}: {method_stats["hits"]} hits, {method_stats["misses"]} misses, hit rate {method_stats["hit_rate"]:.4f}')
+        logger.success(f'{name}: {stats["entries"]} entries, {stats["evictions"]} evictions')
+
+_tool_memo: Optional[ToolMemo] = None
+_tool_memo_lock = threading.Lock()
+
+def init_tool_memo(max_size: int = 65536) -> ToolMemo:
+    """Initialize the process-wide tool memo, shared by the tools configured with `"memoize": true`. The memo is created with `max_size` on the first call, and returned by later calls.
+
+    Args:
+        `max_size` (`int`, optional): The maximum number of memoized results. Defaults to `65536`.
+    Returns:
+        `ToolMemo`: The shared tool memo.
+    """
+    global _tool_memo
+    with _tool_memo_lock:
+        if _tool_memo is None:
+            _tool_memo = ToolMemo(max_size=max_size)
+        return _tool_memo
+
+def get_tool_memo() -> Optional[ToolMemo]:
+    """Get the process-wide tool memo.
+
+    Returns:
+        `Optional[ToolMemo]`: The tool memo. `None` if no tool is memoized.
+    """
+    return _tool_memo
+
+def memoized(func: Callable) -> Callable:
+    """A decorator to memoize a tool method across samples, if the tool is configured with `"memoize": true`. The results are keyed by the tool class, its config path, the method, the arguments and the `memo_state` of the tool, so a result is only reused for the same state. State that only affects some arguments, e.g., the history cutoff of `InteractionRetriever`, is better passed as an argument of the memoized method, so the calls seeing the same data share the result. Calls that raise are not memoized.
+
+    Args:
+        `func` (`Callable`): The tool method to be decorated.
+
+    Returns:
+        `Callable`: The decorated method.
+    """
+    @functools.wraps(func)
+    def wrapper(self: 'Tool', *args, **kwargs):
+        if self.memo is None:
+            return func(self, *args, **kwargs)
+        name = f'{type(self).__name__}.{func.__name__}'
+        key = (name, self.config_path, args, tuple(sorted(kwargs.items())), self.memo_state())
+        try:
+            found, result = self.memo.get(name, key)
+        except TypeError:
+            # unhashable arguments
+            return func(self, *args, **kwargs)
+        if not found:
+            result = func(self, *args, **kwargs)
+            self.memo.put(key, result)
+        return result
+    return wrapper
 
 class Tool(ABC):
     def __init__(self, config_path: str, *args, **kwargs) -> None:
+        self.config_path = config_path
         self.config = read_json(config_path)
+        # the key of the shared state, taken before the config is consumed by the subclasses
+        self._shared_key = (type(self).__module__ + '.' + type(self).__qualname__, os.path.abspath(config_path), json.dumps(self.config, sort_keys=True, default=str))
+        memoize: bool = get_rm(self.config, 'memoize', False)
+        memo_size: int = get_rm(self.config, 'memo_size', 65536)
+        self.memo: Optional[ToolMemo] = init_tool_memo(max_size=memo_size) if memoize else None
 
     @abstractmethod
     def reset(self) -> None:
         raise NotImplementedError("reset method not implemented")
 
+    def shared(self, build: Callable[[], T], name: str = '') -> T:
+        """Get the immutable state shared by the tools of the same class and config in the process (see `macrec.tools.registry`), e.g., the loaded tables, indexes and models. The state is built on the first call.
+
+        Args:
+            `build` (`Callable[[], T]`): Build the state.
+            `name` (`str`, optional): The name of the state, for tools with multiple shared states. Defaults to `''`.
+        Returns:
+            `T`: The shared state.
+        """
+        return get_shared_state(self._shared_key + (name,), build)
+
+    def memo_state(self) -> Hashable:
+        """The state of the tool that the results of the `memoized` methods depend on, besides the arguments. Tools whose results depend on the current data sample should override this method.
+
+        Returns:
+            `Hashable`: The state. Defaults to `None`.
+        """
+        return None
+
 class RetrievalTool(Tool):
+    """
+    The base class of document retrieval tools. `search` returns the titles and summaries of the top `top_k` documents, which are remembered until `reset`, so that `lookup` can look up terms in them.
+    """
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
+        self.top_k: int = self.config.get('top_k', 3)
+        self.cache = {}
+
+    def reset(self) -> None:
+        self.cache = {}
+
+    def _format_documents(self, documents: list[Document]) -> str:
+        titles = []
+        summary = []
+        for document in documents:
+            assert 'title' in document.metadata
+            title = document.metadata['title']
+            if title not in self.cache:
+                self.cache[title] = {
+                    'document': document,
+                    'lookup_index': {},
+                }
+            titles.append(title)
+            summary_content = document.metadata['summary'] if 'summary' in document.metadata else document.page_content.split('\n\n')[0]
+            if len(summary_content.split()) > 20:
+                summary_content = ' '.join(summary_content.split()[:20]) + '...'
+            summary.append(summary_content)
+        return ', '.join([f'{title} ({summary})' for title, summary in zip(titles, summary)])
 
     @abstractmethod
     def search(self, query: str) -> str:
         raise NotImplementedError("search method not implemented")
 
-    @abstractmethod
+    def _term_positions(self, title: str, term: str) -> list[int]:
+        # the paragraphs are split and lowercased once per document, and the matched paragraphs once per term
+        entry = self.cache[title]
+        if 'paragraphs' not in entry:
+            entry['paragraphs'] = entry['document'].page_content.split("\n\n")
+            entry['lower_paragraphs'] = [p.lower() for p in entry['paragraphs']]
+            entry['term_positions'] = {}
+        key = term.lower()
+        if key not in entry['term_positions']:
+            entry['term_positions'][key] = [i for i, p in enumerate(entry['lower_paragraphs']) if key in p]
+        return entry['term_positions'][key]
+
     def lookup(self, title: str, term: str) -> str:
-        raise NotImplementedError("lookup method not implemented")
+        if title not in self.cache:
+            return 'No title found in search results.'
+        if term not in self.cache[title]['lookup_index']:
+            self.cache[title]['lookup_index'][term] = 0
+        else:
+            self.cache[title]['lookup_index'][term] += 1
+        positions = self._term_positions(title, term)
+        if len(positions) == 0:
+            return f'No results for term {term} in document {title}.'
+        elif self.cache[title]['lookup_index'][term] >= len(positions):
+            return f'No more results for term {term} in document {title}.'
+        else:
+            result_prefix = f'(Result {self.cache[title]["lookup_index"][term] + 1} / {len(positions)})'
+            return f'{result_prefix} {self.cache[title]["paragraphs"][positions[self.cache[title]["lookup_index"][term]]]}'
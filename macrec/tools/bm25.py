@@ -0,0 +1,158 @@
+import re
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from loguru import logger
+from langchain_core.documents import Document
+
+from macrec.tools.base import RetrievalTool
+from macrec.utils.columnar import encode_strings, find_sorted, load_columnar
+
+STOPWORDS = frozenset('a an and are as at be but by for from has have in is it its of on or that the this to was were will with'.split())
+MAX_TERM_LENGTH = 32
+
+def tokenize(text: str) -> list[str]:
+    """Split the text into lowercase word terms, without stopwords. Terms are truncated to `MAX_TERM_LENGTH` characters.
+
+    Args:
+        `text` (`str`): The text.
+    Returns:
+        `list[str]`: The terms.
+    """
+    return [term[:MAX_TERM_LENGTH] for term in re.findall(r'\w+', text.lower()) if term not in STOPWORDS]
+
+def read_documents(path: str, title_field: str, text_fields: list[str]) -> tuple[list[str], list[str]]:
+    """Read the documents from a CSV file or a JSON lines file.
+
+    Args:
+        `path` (`str`): The path to the documents, ending with `.csv` or `.jsonl`.
+        `title_field` (`str`): The field of the titles.
+        `text_fields` (`list[str]`): The fields of the texts, joined into paragraphs.
+    Returns:
+        `tuple[list[str], list[str]]`: The titles and texts of the documents.
+    """
+    if path.endswith('.jsonl'):
+        records = pd.read_json(path, lines=True)
+    else:
+        records = pd.read_csv(path, sep=',')
+    assert title_field in records.columns, f'{title_field} not found in documents.'
+    for field in text_fields:
+        assert field in records.columns, f'{field} not found in documents.'
+    titles = records[title_field].astype(str).tolist()
+    texts = ['\n\n'.join(str(value) for value in values if not pd.isna(value)) for values in zip(*[records[field].tolist() for field in text_fields])]
+    return titles, texts
+
+def build_bm25_index(titles: list[str], texts: list[str]) -> dict[str, np.ndarray]:
+    """Build the inverted index of the documents, with the titles indexed as part of the texts.
+
+    Args:
+        `titles` (`list[str]`): The titles of the documents.
+        `texts` (`list[str]`): The texts of the documents.
+    Returns:
+        `dict[str, np.ndarray]`: The arrays of the index, i.e., the sorted vocabulary, the postings (document ids and term frequencies) of each term in CSR style, the document lengths, and the titles and texts as UTF-8 blobs with offsets.
+    """
+    doc_ids, term_ids, tfs = [], [], []
+    vocabulary: dict[str, int] = {}
+    doc_lengths = np.zeros(len(texts), dtype=np.int32)
+    for doc_id, (title, text) in enumerate(zip(titles, texts)):
+        terms = tokenize(f'{title}\n{text}')
+        doc_lengths[doc_id] = len(terms)
+        counts: dict[str, int] = {}
+        for term in terms:
+            counts[term] = counts.get(term, 0) + 1
+        for term, count in counts.items():
+            doc_ids.append(doc_id)
+            term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+            tfs.append(count)
+    terms = np.array(sorted(vocabulary.keys()), dtype=f'<U{MAX_TERM_LENGTH}')
+    # renumber the terms in sorted order, and group the postings by term
+    rank = np.empty(len(vocabulary), dtype=np.int64)
+    rank[[vocabulary[term] for term in terms.tolist()]] = np.arange(len(vocabulary))
+    posting_terms = rank[np.array(term_ids, dtype=np.int64)]
+    order = np.argsort(posting_terms, kind='stable')
+    term_offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(posting_terms, minlength=len(vocabulary)), out=term_offsets[1:])
+    title_blob, title_offsets = encode_strings(titles)
+    text_blob, text_offsets = encode_strings(texts)
+    return {
+        'terms': terms,
+        'term_offsets': term_offsets,
+        'posting_docs': np.array(doc_ids, dtype=np.int32)[order],
+        'posting_tfs': np.array(tfs, dtype=np.int32)[order],
+        'doc_lengths': doc_lengths,
+        'title_blob': title_blob,
+        'title_offsets': title_offsets,
+        'text_blob': text_blob,
+        'text_offsets': text_offsets,
+    }
+
+class BM25(RetrievalTool):
+    """
+    The offline full-text retrieval tool with BM25 ranking over a local document dump, e.g., the item descriptions or a Wikipedia extract. The inverted index is built once next to the documents and memory-mapped (see `macrec.utils.columnar`), so it starts in milliseconds and is shared by processes. A drop-in replacement of `Wikipedia` for the `Searcher`.
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        documents: str = self.config['documents']
+        title_field: str = self.config.get('title_field', 'title')
+        text_fields: list[str] = self.config.get('text_fields', ['text'])
+        self.k1: float = self.config.get('k1', 1.5)
+        self.b: float = self.config.get('b', 0.75)
+        # rebuild the index if the fields change
+        kind = 'bm25-' + hashlib.md5(json.dumps([title_field, text_fields, MAX_TERM_LENGTH]).encode('utf-8')).hexdigest()[:8]
+        self.index = self.shared(lambda: load_columnar(documents, kind, lambda: build_bm25_index(*read_documents(documents, title_field, text_fields))))
+        self.n_docs = len(self.index['doc_lengths'])
+        self.avg_length = float(self.index['doc_lengths'].mean()) if self.n_docs > 0 else 0.0
+        logger.debug(f'BM25 index of {documents} loaded: {self.n_docs} documents, {len(self.index["terms"])} terms')
+
+    def _string(self, name: str, i: int) -> str:
+        offsets = self.index[f'{name}_offsets']
+        return self.index[f'{name}_blob'][offsets[i]:offsets[i + 1]].tobytes().decode('utf-8')
+
+    def scores(self, query: str) -> tuple[np.ndarray, np.ndarray]:
+        """The BM25 scores of the documents matching any term of the query.
+
+        Args:
+            `query` (`str`): The query.
+        Returns:
+            `tuple[np.ndarray, np.ndarray]`: The ids of the matched documents, and their scores.
+        """
+        docs, weights = [], []
+        for term in set(tokenize(query)):
+            term_id = find_sorted(self.index['terms'], term)
+            if term_id < 0:
+                continue
+            start, end = self.index['term_offsets'][term_id], self.index['term_offsets'][term_id + 1]
+            posting_docs = self.index['posting_docs'][start:end]
+            tfs = self.index['posting_tfs'][start:end].astype(np.float64)
+            idf = np.log(1 + (self.n_docs - (end - start) + 0.5) / (end - start + 0.5))
+            norms = self.k1 * (1 - self.b + self.b * self.index['doc_lengths'][posting_docs] / self.avg_length)
+            docs.append(posting_docs)
+            weights.append(idf * tfs * (self.k1 + 1) / (tfs + norms))
+        if len(docs) == 0:
+            return np.zeros(0, dtype=np.int32), np.zeros(0)
+        matched, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+        return matched, np.bincount(inverse, weights=np.concatenate(weights))
+
+    def retrieve(self, query: str) -> list[Document]:
+        """Retrieve the top `top_k` documents of the query by BM25 scores.
+
+        Args:
+            `query` (`str`): The query.
+        Returns:
+            `list[Document]`: The documents, with the titles in the metadata.
+        """
+        matched, scores = self.scores(query)
+        if len(matched) > self.top_k:
+            top = np.argpartition(-scores, self.top_k)[:self.top_k]
+            matched, scores = matched[top], scores[top]
+        # ties are broken by the document order
+        order = np.lexsort((matched, -scores))
+        return [Document(page_content=self._string('text', doc), metadata={'title': self._string('title', doc), 'score': float(score)}) for doc, score in zip(matched[order].tolist(), scores[order].tolist())]
+
+    def search(self, query: str) -> str:
+        results = self.retrieve(query)
+        if len(results) == 0:
+            return f'No documents found for query {query}.'
+        else:
+            return f'Found {len(results)} documents. Their titles and summaries are (with the format title (summary)): {self._format_documents(results)}'
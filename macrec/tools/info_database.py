@@ -1,48 +1,101 @@
+import numpy as np
 import pandas as pd
+from typing import Any, Mapping, Optional
 
-from macrec.tools.base import Tool
+from macrec.tools.base import Tool, memoized
+from macrec.utils.columnar import MappedStrings, compact, encode_strings, load_columnar
+
+def build_index(info: pd.DataFrame, id_column: str, text_column: str, title: str) -> tuple[dict[Any, str], set[Any]]:
+    """Pre-render the info string of each id in the table. The `text_column` is used if available, otherwise all the other columns are rendered as `column: value` pairs.
+
+    Args:
+        `info` (`pd.DataFrame`): The info table.
+        `id_column` (`str`): The id column, e.g., `user_id`.
+        `text_column` (`str`): The pre-rendered text column, e.g., `user_profile`.
+        `title` (`str`): The title of the rendered info, e.g., `Profile`.
+    Returns:
+        `tuple[dict[Any, str], set[Any]]`: The rendered info string of each id, and the ids with multiple entries.
+    """
+    ids = info[id_column].tolist()
+    if text_column in info.columns:
+        texts = [text.replace('\n', '; ') if isinstance(text, str) else str(text) for text in info[text_column].tolist()]
+    else:
+        columns = info.columns.drop(id_column)
+        values = [info[column].tolist() for column in columns]
+        kind = id_column.split('_')[0].capitalize()
+        texts = [
+            f'{kind} {id} {title}:\n' + '; '.join([f'{column}: {value[i]}' for column, value in zip(columns, values)])
+            for i, id in enumerate(ids)
+        ]
+    index = dict(zip(ids, texts))
+    duplicates = set(info[id_column][info[id_column].duplicated()].tolist())
+    return index, duplicates
+
+def build_arrays(info: pd.DataFrame, id_column: str, text_column: str, title: str) -> dict[str, np.ndarray]:
+    """Build the columnar arrays of the pre-rendered info strings (see `build_index`), i.e., the sorted unique ids, the UTF-8 blob of the info strings with their offsets, and the duplicated ids.
+
+    Args:
+        `info` (`pd.DataFrame`): The info table.
+        `id_column` (`str`): The id column, e.g., `user_id`.
+        `text_column` (`str`): The pre-rendered text column, e.g., `user_profile`.
+        `title` (`str`): The title of the rendered info, e.g., `Profile`.
+    Returns:
+        `dict[str, np.ndarray]`: The arrays.
+    """
+    index, duplicates = build_index(info, id_column, text_column, title)
+    ids = sorted(index.keys())
+    blob, offsets = encode_strings([index[id] for id in ids])
+    return {
+        'ids': compact(np.array(ids)),
+        'blob': blob,
+        'offsets': offsets,
+        'duplicates': compact(np.array(sorted(duplicates), dtype=np.array(ids).dtype)),
+    }
 
 class InfoDatabase(Tool):
+    """
+    The user and item info database. The info strings are rendered once at load time and indexed by id, so each lookup is a dictionary access instead of a scan over the table. With `"mmap": true` in the config, the rendered strings are built once into a binary columnar format and memory-mapped, so processes share them and start without parsing the CSV files.
+    """
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         user_info_path = self.config.get('user_info', None)
         item_info_path = self.config.get('item_info', None)
+        self._user_index: Optional[Mapping[Any, str]] = None
+        self._item_index: Optional[Mapping[Any, str]] = None
+        # the indexes are shared by the databases with the same config
         if user_info_path is not None:
-            self._user_info = pd.read_csv(user_info_path, sep=',')
-            assert 'user_id' in self._user_info.columns, 'user_id column not found in user_info.'
+            self._user_index, self._user_duplicates = self.shared(lambda: self._load(user_info_path, 'user_id', 'user_profile', 'Profile'), 'user')
         if item_info_path is not None:
-            self._item_info = pd.read_csv(item_info_path, sep=',')
-            assert 'item_id' in self._item_info.columns, 'item_id column not found in item_info.'
+            self._item_index, self._item_duplicates = self.shared(lambda: self._load(item_info_path, 'item_id', 'item_attributes', 'Attributes'), 'item')
+
+    def _load(self, path: str, id_column: str, text_column: str, title: str) -> tuple[Mapping[Any, str], set[Any]]:
+        def read_info() -> pd.DataFrame:
+            info = pd.read_csv(path, sep=',')
+            assert id_column in info.columns, f'{id_column} column not found in {id_column.split("_")[0]}_info.'
+            return info
+
+        if self.config.get('mmap', False):
+            arrays = load_columnar(path, 'info', lambda: build_arrays(read_info(), id_column, text_column, title))
+            return MappedStrings(arrays['ids'], arrays['blob'], arrays['offsets']), set(arrays['duplicates'].tolist())
+        return build_index(read_info(), id_column, text_column, title)
 
     def reset(self, *args, **kwargs) -> None:
         pass
 
+    @memoized
     def user_info(self, user_id: int) -> str:
-        if not hasattr(self, '_user_info'):
+        if self._user_index is None:
             return 'User info database not available.'
-        info = self._user_info[self._user_info['user_id'] == user_id]
-        if info.empty:
+        if user_id not in self._user_index:
             return f'User {user_id} not found in user info database.'
-        assert len(info) == 1, f'Multiple entries found for user {user_id}.'
-        if 'user_profile' in self._user_info.columns:
-            return info['user_profile'].values[0].replace('\n', '; ')
-        else:
-            columns = self._user_info.columns
-            columns = columns.drop('user_id')
-            profile = '; '.join([f'{column}: {info[column].values[0]}' for column in columns])
-            return f'User {user_id} Profile:\n{profile}'
+        assert user_id not in self._user_duplicates, f'Multiple entries found for user {user_id}.'
+        return self._user_index[user_id]
 
+    @memoized
     def item_info(self, item_id: int) -> str:
-        if not hasattr(self, '_item_info'):
+        if self._item_index is None:
             return 'Item info database not available.'
-        info = self._item_info[self._item_info['item_id'] == item_id]
-        if info.empty:
+        if item_id not in self._item_index:
             return f'Item {item_id} not found in item info database.'
-        assert len(info) == 1, f'Multiple entries found for item {item_id}.'
-        if 'item_attributes' in self._item_info.columns:
-            return info['item_attributes'].values[0].replace('\n', '; ')
-        else:
-            columns = self._item_info.columns
-            columns = columns.drop('item_id')
-            attributes = '; '.join([f'{column}: {info[column].values[0]}' for column in columns])
-            return f'Item {item_id} Attributes:\n{attributes}'
+        assert item_id not in self._item_duplicates, f'Multiple entries found for item {item_id}.'
+        return self._item_index[item_id]
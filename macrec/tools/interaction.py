@@ -1,53 +1,196 @@
+import numpy as np
 import pandas as pd
-from typing import Optional
+from typing import Any, Optional
 
-from macrec.tools.base import Tool
+from macrec.tools.base import Tool, memoized
+from macrec.utils.columnar import compact, find_sorted, load_columnar
+
+class CSRIndex:
+    """
+    The interactions grouped by a key column in CSR style. The rows of each key are stored contiguously in the order of their global positions in the data, so the rows of a key before a position are a prefix found by binary search. The arrays can be memory-mapped (see `macrec.utils.columnar`).
+    """
+    def __init__(self, keys: np.ndarray, offsets: np.ndarray, positions: np.ndarray, columns: dict[str, np.ndarray]) -> None:
+        """Initialize the index from its arrays.
+
+        Args:
+            `keys` (`np.ndarray`): The sorted unique keys.
+            `offsets` (`np.ndarray`): The offsets of the rows of each key, of length `len(keys) + 1`.
+            `positions` (`np.ndarray`): The global positions of the rows.
+            `columns` (`dict[str, np.ndarray]`): The grouped columns, e.g., the item ids and ratings.
+        """
+        self.keys = keys
+        self.offsets = offsets
+        self.positions = positions
+        self.columns = columns
+
+    @classmethod
+    def build(cls, keys: np.ndarray, columns: dict[str, np.ndarray]) -> 'CSRIndex':
+        """Group the rows by the keys.
+
+        Args:
+            `keys` (`np.ndarray`): The key of each row, e.g., the user ids.
+            `columns` (`dict[str, np.ndarray]`): The columns to group, e.g., the item ids and ratings.
+        Returns:
+            `CSRIndex`: The index.
+        """
+        # stable sort keeps the rows of each key in the order of the data
+        order = np.argsort(keys, kind='stable')
+        unique_keys, starts = np.unique(keys[order], return_index=True)
+        return cls(unique_keys, np.append(starts, len(keys)), order, {name: column[order] for name, column in columns.items()})
+
+    def arrays(self, prefix: str) -> dict[str, np.ndarray]:
+        """The arrays of the index, named with the prefix.
+
+        Args:
+            `prefix` (`str`): The prefix of the names.
+        Returns:
+            `dict[str, np.ndarray]`: The arrays, with ids and ratings downcast if lossless.
+        """
+        arrays = {
+            f'{prefix}.keys': compact(self.keys),
+            f'{prefix}.offsets': self.offsets.astype(np.int64),
+            f'{prefix}.positions': self.positions.astype(np.int64),
+        }
+        arrays.update({f'{prefix}.{name}': compact(column) for name, column in self.columns.items()})
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray], prefix: str) -> 'CSRIndex':
+        columns = {name[len(prefix) + 1:]: array for name, array in arrays.items() if name.startswith(f'{prefix}.') and name[len(prefix) + 1:] not in ['keys', 'offsets', 'positions']}
+        return cls(arrays[f'{prefix}.keys'], arrays[f'{prefix}.offsets'], arrays[f'{prefix}.positions'], columns)
+
+    def _group(self, key: Any) -> Optional[tuple[int, int]]:
+        group = find_sorted(self.keys, key)
+        if group < 0:
+            return None
+        return int(self.offsets[group]), int(self.offsets[group + 1])
+
+    def rows(self, key: Any) -> Optional[tuple[np.ndarray, dict[str, np.ndarray]]]:
+        """All the rows of the key.
+
+        Args:
+            `key` (`Any`): The key.
+        Returns:
+            `Optional[tuple[np.ndarray, dict[str, np.ndarray]]]`: The global positions and the columns of the rows (as views). `None` if the key is not found.
+        """
+        group = self._group(key)
+        if group is None:
+            return None
+        start, end = group
+        return self.positions[start:end], {name: column[start:end] for name, column in self.columns.items()}
+
+    def count_before(self, key: Any, position: int) -> int:
+        """The number of rows of the key before the global position.
+
+        Args:
+            `key` (`Any`): The key.
+            `position` (`int`): The global position, exclusive.
+        Returns:
+            `int`: The number of rows. `0` if the key is not found.
+        """
+        group = self._group(key)
+        if group is None:
+            return 0
+        start, end = group
+        return int(np.searchsorted(self.positions[start:end], position))
+
+    def prefix(self, key: Any, n: int) -> Optional[dict[str, np.ndarray]]:
+        """The first `n` rows of the key.
+
+        Args:
+            `key` (`Any`): The key.
+            `n` (`int`): The number of rows.
+        Returns:
+            `Optional[dict[str, np.ndarray]]`: The columns of the rows (as views), in the order of the data. `None` if there is no such row.
+        """
+        group = self._group(key)
+        if group is None or n <= 0:
+            return None
+        start, _ = group
+        return {name: column[start:start + n] for name, column in self.columns.items()}
+
+    def before(self, key: Any, position: int) -> Optional[dict[str, np.ndarray]]:
+        """The rows of the key before the global position.
+
+        Args:
+            `key` (`Any`): The key.
+            `position` (`int`): The global position, exclusive.
+        Returns:
+            `Optional[dict[str, np.ndarray]]`: The columns of the rows (as views), in the order of the data. `None` if there is no such row.
+        """
+        return self.prefix(key, self.count_before(key, position))
 
 class InteractionRetriever(Tool):
+    """
+    The interaction history retriever. The interactions are indexed once by user and by item, and `reset` only sets the position of the current data sample, so the retrieved histories only contain the interactions before it. The indexes are shared by the retrievers with the same config in the process.
+    """
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         data_path = self.config['data_path']
         assert data_path is not None, 'Data path not found in config.'
-        self.data = pd.read_csv(data_path, sep=',')
-        assert 'user_id' in self.data.columns, 'user_id not found in data.'
-        assert 'item_id' in self.data.columns, 'item_id not found in data.'
-        self.user_history = None
-        self.item_history = None
+        # the indexes are shared by the retrievers with the same config, while the position is kept per retriever
+        self.user_index, self.item_index = self.shared(lambda: self._load(data_path, self.config.get('mmap', False)))
+        self.position: Optional[int] = None
+
+    @classmethod
+    def _load(cls, data_path: str, mmap: bool) -> tuple[CSRIndex, CSRIndex]:
+        if mmap:
+            # the indexes are built once into a binary columnar format, and memory-mapped by all the processes
+            arrays = load_columnar(data_path, 'interaction', lambda: cls._build_indexes(cls._read_data(data_path)))
+        else:
+            arrays = cls._build_indexes(cls._read_data(data_path))
+        return CSRIndex.from_arrays(arrays, 'user'), CSRIndex.from_arrays(arrays, 'item')
+
+    @staticmethod
+    def _read_data(data_path: str) -> pd.DataFrame:
+        data = pd.read_csv(data_path, sep=',')
+        assert 'user_id' in data.columns, 'user_id not found in data.'
+        assert 'item_id' in data.columns, 'item_id not found in data.'
+        return data
+
+    @staticmethod
+    def _build_indexes(data: pd.DataFrame) -> dict[str, np.ndarray]:
+        user_ids = data['user_id'].to_numpy()
+        item_ids = data['item_id'].to_numpy()
+        ratings = data['rating'].to_numpy()
+        arrays = CSRIndex.build(user_ids, {'item_id': item_ids, 'rating': ratings}).arrays('user')
+        arrays.update(CSRIndex.build(item_ids, {'user_id': user_ids, 'rating': ratings}).arrays('item'))
+        return arrays
 
     def reset(self, user_id: Optional[int] = None, item_id: Optional[int] = None, *args, **kwargs) -> None:
         if user_id is not None and item_id is not None:
-            data_sample = self.data[(self.data['user_id'] == user_id) & (self.data['item_id'] == item_id)]
-            assert len(data_sample) == 1, f'User {user_id} and item {item_id} not found in data or not unique.'
-            # get the index
-            index = data_sample.index[0]
-            partial_data = self.data.iloc[:index]
-            self.user_history = partial_data.groupby('user_id')['item_id'].apply(list).to_dict()
-            self.user_rating = partial_data.groupby('user_id')['rating'].apply(list).to_dict()
-            self.item_history = partial_data.groupby('item_id')['user_id'].apply(list).to_dict()
-            self.item_rating = partial_data.groupby('item_id')['rating'].apply(list).to_dict()
+            rows = self.user_index.rows(user_id)
+            positions = rows[0][rows[1]['item_id'] == item_id] if rows is not None else []
+            assert len(positions) == 1, f'User {user_id} and item {item_id} not found in data or not unique.'
+            self.position = int(positions[0])
         else:
-            self.partial_data = None
-            self.user_history = None
-            self.user_rating = None
-            self.item_history = None
-            self.item_rating = None
+            self.position = None
 
     def user_retrieve(self, user_id: int, k: int, *args, **kwargs) -> str:
-        if self.user_history is None:
+        if self.position is None:
             raise ValueError('User history not found. Please reset the user_id and item_id.')
-        if user_id not in self.user_history:
+        return self._user_retrieve(user_id, k, self.user_index.count_before(user_id, self.position))
+
+    @memoized
+    def _user_retrieve(self, user_id: int, k: int, n_before: int) -> str:
+        # keyed by the length of the visible history instead of the position, so the samples seeing the same history share the memoized result
+        user_his = self.user_index.prefix(user_id, n_before)
+        if user_his is None:
             return f'No history found for user {user_id}.'
-        user_his = self.user_history[user_id]
-        retrieved = user_his[-k:]
-        retrieved_rating = self.user_rating[user_id][-k:]
+        retrieved = user_his['item_id'][-k:].tolist()
+        retrieved_rating = user_his['rating'][-k:].tolist()
         return f'Retrieved {len(retrieved)} items that user {user_id} interacted with before: {", ".join(map(str, retrieved))} with ratings: {", ".join(map(str, retrieved_rating))}'
 
     def item_retrieve(self, item_id: int, k: int, *args, **kwargs) -> str:
-        if self.item_history is None:
+        if self.position is None:
             raise ValueError('Item history not found. Please reset the user_id and item_id.')
-        if item_id not in self.item_history:
+        return self._item_retrieve(item_id, k, self.item_index.count_before(item_id, self.position))
+
+    @memoized
+    def _item_retrieve(self, item_id: int, k: int, n_before: int) -> str:
+        item_his = self.item_index.prefix(item_id, n_before)
+        if item_his is None:
             return f'No history found for item {item_id}.'
-        item_his = self.item_history[item_id]
-        retrieved = item_his[-k:]
-        retrieved_rating = self.item_rating[item_id][-k:]
+        retrieved = item_his['user_id'][-k:].tolist()
+        retrieved_rating = item_his['rating'][-k:].tolist()
         return f'Retrieved {len(retrieved)} users that interacted with item {item_id} before: {", ".join(map(str, retrieved))} with ratings: {", ".join(map(str, retrieved_rating))}'
@@ -0,0 +1,41 @@
+# Description: A process-wide registry of the immutable tool state, e.g., the loaded tables, indexes and models, so that the tools with the same config share it across agents and systems.
+
+import threading
+from loguru import logger
+from typing import Any, Callable, Hashable, TypeVar
+
+T = TypeVar('T')
+
+_states: dict[Hashable, Any] = {}
+_states_lock = threading.RLock()
+
+def get_shared_state(key: Hashable, build: Callable[[], T]) -> T:
+    """Get the process-wide shared state of the key. The state is built on the first call, and shared by later calls with the same key. The shared state must not be mutated by the tools, so the per-call state, e.g., the cutoff of `InteractionRetriever`, should be kept on the tool instances instead.
+
+    Args:
+        `key` (`Hashable`): The key of the state, e.g., the tool class, the config and the name of the state (see `Tool.shared`).
+        `build` (`Callable[[], T]`): Build the state.
+    Returns:
+        `T`: The shared state.
+    """
+    with _states_lock:
+        if key in _states:
+            logger.debug(f'Reusing shared tool state {key[:2] if isinstance(key, tuple) else key}')
+            return _states[key]
+        state = build()
+        _states[key] = state
+        return state
+
+def shared_states() -> list[Hashable]:
+    """The keys of the shared states in the registry.
+
+    Returns:
+        `list[Hashable]`: The keys of the shared states.
+    """
+    with _states_lock:
+        return list(_states.keys())
+
+def release_shared_states() -> None:
+    """Drop the references of the registry to the shared states. The memory is freed once no tool refers to them."""
+    with _states_lock:
+        _states.clear()
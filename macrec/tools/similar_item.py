@@ -0,0 +1,182 @@
+import json
+import hashlib
+import numpy as np
+import pandas as pd
+from loguru import logger
+
+from macrec.tools.base import Tool, memoized
+from macrec.tools.info_database import build_index
+from macrec.utils.columnar import compact, find_sorted, load_columnar
+
+def normalize(embeddings: np.ndarray) -> np.ndarray:
+    """L2-normalize the rows of the embeddings, so that inner products are cosine similarities. Zero rows are kept as zeros.
+
+    Args:
+        `embeddings` (`np.ndarray`): The embeddings.
+    Returns:
+        `np.ndarray`: The normalized `float32` embeddings.
+    """
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return (embeddings / np.maximum(norms, 1e-12)).astype(np.float32)
+
+def tfidf_embeddings(texts: list[str], dim: int, max_features: int, seed: int = 0) -> np.ndarray:
+    """Embed the texts by TF-IDF, reduced to `dim` dimensions by truncated SVD (i.e., LSA) if the vocabulary is larger, so that the embeddings fit in a dense matrix.
+
+    Args:
+        `texts` (`list[str]`): The texts.
+        `dim` (`int`): The maximum dimension of the embeddings.
+        `max_features` (`int`): The maximum size of the TF-IDF vocabulary.
+        `seed` (`int`, optional): The random seed of the SVD. Defaults to `0`.
+    Returns:
+        `np.ndarray`: The embeddings.
+    """
+    from sklearn.decomposition import TruncatedSVD
+    from sklearn.feature_extraction.text import TfidfVectorizer
+    tfidf = TfidfVectorizer(max_features=max_features, sublinear_tf=True, token_pattern=r'(?u)\b\w+\b').fit_transform(texts)
+    if tfidf.shape[1] <= dim:
+        return tfidf.toarray()
+    return TruncatedSVD(n_components=dim, random_state=seed).fit_transform(tfidf)
+
+def encoder_embeddings(texts: list[str], model_path: str, batch_size: int, max_length: int) -> np.ndarray:
+    """Embed the texts by the mean pooled last hidden states of a local HuggingFace encoder, e.g., a sentence embedding model.
+
+    Args:
+        `texts` (`list[str]`): The texts.
+        `model_path` (`str`): The path or name to the encoder.
+        `batch_size` (`int`): The batch size of encoding.
+        `max_length` (`int`): The maximum number of tokens of each text.
+    Returns:
+        `np.ndarray`: The embeddings.
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    if tokenizer.pad_token is None:
+        # decoder-only models, whose padded positions are masked out of the pooling anyway
+        tokenizer.pad_token = tokenizer.eos_token
+    model = AutoModel.from_pretrained(model_path).eval()
+    embeddings = []
+    with torch.no_grad():
+        for start in range(0, len(texts), batch_size):
+            inputs = tokenizer(texts[start:start + batch_size], padding=True, truncation=True, max_length=max_length, return_tensors='pt').to(model.device)
+            hidden = model(input_ids=inputs['input_ids'], attention_mask=inputs['attention_mask']).last_hidden_state
+            mask = inputs['attention_mask'].unsqueeze(-1).to(hidden.dtype)
+            embeddings.append(((hidden * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)).float().cpu().numpy())
+    return np.concatenate(embeddings, axis=0) if len(embeddings) > 0 else np.zeros((0, model.config.hidden_size), dtype=np.float32)
+
+def build_ivf(embeddings: np.ndarray, n_lists: int, seed: int = 0) -> dict[str, np.ndarray]:
+    """Build an inverted file (IVF) index of the normalized embeddings, i.e., the items are clustered by k-means and grouped by cluster in CSR style, so a query only scores the items of the clusters nearest to it.
+
+    Args:
+        `embeddings` (`np.ndarray`): The normalized embeddings.
+        `n_lists` (`int`): The number of clusters.
+        `seed` (`int`, optional): The random seed of k-means. Defaults to `0`.
+    Returns:
+        `dict[str, np.ndarray]`: The normalized centroids, the offsets of the items of each cluster, and the items grouped by cluster.
+    """
+    from sklearn.cluster import MiniBatchKMeans
+    n_lists = max(1, min(n_lists, len(embeddings)))
+    kmeans = MiniBatchKMeans(n_clusters=n_lists, random_state=seed, n_init=3).fit(embeddings)
+    labels = kmeans.labels_
+    order = np.argsort(labels, kind='stable')
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(labels, minlength=n_lists), out=offsets[1:])
+    return {
+        'centroids': normalize(kmeans.cluster_centers_),
+        'list_offsets': offsets,
+        'list_items': order.astype(np.int32),
+    }
+
+class SimilarItemRetriever(Tool):
+    """
+    The similar item retriever. The `item_attributes` (or the rendered item info, see `build_index`) of all the items are embedded once, by TF-IDF with LSA or a configurable local encoder, into a normalized matrix, and the top-k cosine queries are a matrix-vector product. With `"index": "ivf"`, the queries only score the items of the `n_probe` nearest k-means clusters. The embeddings and the index are saved next to `item.csv` (see `macrec.utils.columnar`), so later runs memory-map them instead of rebuilding.
+    """
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        item_info: str = self.config['item_info']
+        self.encoder: str = self.config.get('encoder', 'tfidf')
+        self.index_type: str = self.config.get('index', 'exact')
+        self.n_probe: int = self.config.get('n_probe', 8)
+        assert self.index_type in ['exact', 'ivf'], f'Unknown index type: {self.index_type}.'
+        build_config = {
+            'encoder': self.encoder,
+            'dim': self.config.get('dim', 256),
+            'max_features': self.config.get('max_features', 50000),
+            'batch_size': self.config.get('batch_size', 64),
+            'max_length': self.config.get('max_length', 256),
+            'index': self.index_type,
+            'n_lists': self.config.get('n_lists', 64),
+        }
+        # rebuild the embeddings if the build options change
+        kind = 'similar-' + hashlib.md5(json.dumps(build_config, sort_keys=True).encode('utf-8')).hexdigest()[:8]
+        self.arrays = self.shared(lambda: load_columnar(item_info, kind, lambda: self._build(item_info, build_config)))
+        self.ids = self.arrays['ids']
+        self.embeddings = self.arrays['embeddings']
+        logger.debug(f'Similar item index of {item_info} loaded: {len(self.ids)} items of dimension {self.embeddings.shape[1]}')
+
+    @staticmethod
+    def _build(item_info: str, build_config: dict) -> dict[str, np.ndarray]:
+        info = pd.read_csv(item_info, sep=',')
+        assert 'item_id' in info.columns, 'item_id column not found in item_info.'
+        index, _ = build_index(info, 'item_id', 'item_attributes', 'Attributes')
+        ids = sorted(index.keys())
+        texts = [index[id] for id in ids]
+        logger.info(f'Embedding {len(texts)} items by {build_config["encoder"]}...')
+        if build_config['encoder'] == 'tfidf':
+            embeddings = tfidf_embeddings(texts, dim=build_config['dim'], max_features=build_config['max_features'])
+        else:
+            embeddings = encoder_embeddings(texts, model_path=build_config['encoder'], batch_size=build_config['batch_size'], max_length=build_config['max_length'])
+        arrays = {
+            'ids': compact(np.array(ids)),
+            'embeddings': normalize(embeddings),
+        }
+        if build_config['index'] == 'ivf':
+            arrays.update(build_ivf(arrays['embeddings'], n_lists=build_config['n_lists']))
+        return arrays
+
+    def reset(self, *args, **kwargs) -> None:
+        pass
+
+    def _score(self, row: int) -> tuple[np.ndarray, np.ndarray]:
+        query = self.embeddings[row]
+        if self.index_type == 'exact':
+            candidates = np.arange(len(self.ids))
+            scores = self.embeddings @ query
+        else:
+            centroid_scores = self.arrays['centroids'] @ query
+            n_probe = min(self.n_probe, len(centroid_scores))
+            lists = np.argpartition(-centroid_scores, n_probe - 1)[:n_probe]
+            offsets, items = self.arrays['list_offsets'], self.arrays['list_items']
+            candidates = np.concatenate([items[offsets[i]:offsets[i + 1]] for i in lists.tolist()])
+            scores = self.embeddings[candidates] @ query
+        keep = candidates != row
+        return candidates[keep], scores[keep]
+
+    def similar(self, item_id: int, k: int) -> list[tuple[int, float]]:
+        """The top-k items most similar to the item by cosine similarity, excluding the item itself.
+
+        Args:
+            `item_id` (`int`): The item id.
+            `k` (`int`): The number of items.
+        Returns:
+            `list[tuple[int, float]]`: The ids and similarities of the items, in descending order of similarity. Empty if the item is not found.
+        """
+        row = find_sorted(self.ids, item_id)
+        if row < 0 or k <= 0:
+            return []
+        candidates, scores = self._score(row)
+        if len(candidates) > k:
+            top = np.argpartition(-scores, k)[:k]
+            candidates, scores = candidates[top], scores[top]
+        # ties are broken by the item order
+        order = np.lexsort((candidates, -scores))
+        return list(zip(self.ids[candidates[order]].tolist(), scores[order].tolist()))
+
+    @memoized
+    def similar_items(self, item_id: int, k: int) -> str:
+        if find_sorted(self.ids, item_id) < 0:
+            return f'Item {item_id} not found in similar item index.'
+        retrieved = self.similar(item_id, k)
+        if len(retrieved) == 0:
+            return f'No similar items found for item {item_id}.'
+        return f'Retrieved {len(retrieved)} items similar to item {item_id}: {", ".join([str(id) for id, _ in retrieved])} with similarities: {", ".join([f"{score:.2f}" for _, score in retrieved])}'
@@ -1,20 +1,106 @@
-from transformers import pipeline, AutoTokenizer
+import re
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+from transformers import pipeline, AutoTokenizer, PreTrainedTokenizerBase
 from transformers.pipelines import SummarizationPipeline
 
 from macrec.tools.base import Tool
 from macrec.utils import get_rm
 
 class TextSummarizer(Tool):
+    """
+    The text summarization tool. The summaries are kept in a bounded in-memory LRU cache keyed by the hash of the text and `generate_kwargs`, and the uncached texts of a batch are summarized in one pipeline call. With `summarize_turns`, a chat history is summarized turn by turn, so each turn is summarized only once over the conversation.
+    """
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
         self.model_path: str = get_rm(self.config, 'model_path', 't5-base')
         self.model_max_length: int = get_rm(self.config, 'model_max_length', 512)
         self.generate_kwargs: dict = get_rm(self.config, 'generate_kwargs', {})
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_path, model_max_length=self.model_max_length)
-        self.pipe: SummarizationPipeline = pipeline('summarization', model=self.model_path, tokenizer=self.tokenizer, **self.config)
+        self.batch_size: int = get_rm(self.config, 'batch_size', 8)
+        self.cache_size: int = get_rm(self.config, 'cache_size', 1024)
+        # the model and the summaries are shared by the summarizers with the same config
+        self.tokenizer, self.pipe = self.shared(self._load_pipeline, 'pipeline')
+        self._cache: OrderedDict[str, str]
+        self._cache, self._cache_lock = self.shared(lambda: (OrderedDict(), threading.Lock()), 'cache')
+
+    def _load_pipeline(self) -> tuple[PreTrainedTokenizerBase, SummarizationPipeline]:
+        tokenizer = AutoTokenizer.from_pretrained(self.model_path, model_max_length=self.model_max_length)
+        return tokenizer, pipeline('summarization', model=self.model_path, tokenizer=tokenizer, **self.config)
 
     def reset(self) -> None:
+        # the cached summaries are kept across samples, since the chat histories of the following turns overlap
         pass
 
+    def _key(self, text: str) -> str:
+        content = json.dumps({'text': text, 'generate_kwargs': self.generate_kwargs}, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _get(self, key: str) -> str | None:
+        with self._cache_lock:
+            if key not in self._cache:
+                return None
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+    def _put(self, key: str, summary: str) -> None:
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[key] = summary
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def summarize_batch(self, texts: list[str]) -> list[str]:
+        """Summarize the texts. The cached summaries are reused, and the other distinct texts are summarized in one pipeline call with batches of `batch_size`.
+
+        Args:
+            `texts` (`list[str]`): The texts to summarize.
+        Returns:
+            `list[str]`: The summary of each text.
+        """
+        keys = [self._key(text) for text in texts]
+        summaries = [self._get(key) for key in keys]
+        missing: dict[str, str] = {}
+        for key, text, summary in zip(keys, texts, summaries):
+            if summary is None:
+                missing.setdefault(key, text)
+        if len(missing) > 0:
+            outputs = self.pipe(list(missing.values()), batch_size=self.batch_size, **self.generate_kwargs)
+            generated = dict(zip(missing.keys(), [output['summary_text'] for output in outputs]))
+            for key, summary in generated.items():
+                self._put(key, summary)
+            summaries = [generated[key] if summary is None else summary for key, summary in zip(keys, summaries)]
+        return summaries
+
     def summarize(self, text: str) -> str:
-        return f"Summarized text: {self.pipe(text, **self.generate_kwargs)[0]['summary_text']}"
+        return f"Summarized text: {self.summarize_batch([text])[0]}"
+
+    def summarize_turns(self, text: str) -> str:
+        """Summarize a chat history (see `format_chat_history`) turn by turn. Only the turns not seen before are run through the model, so the cost of each chat turn does not grow with the length of the conversation.
+
+        Args:
+            `text` (`str`): The chat history, with each turn starting with its role.
+        Returns:
+            `str`: The summaries of the turns with their roles, one turn per line.
+        """
+        # a turn starts at a line with a role, e.g., `User: `, and the following lines without a role belong to the same turn
+        roles: list[str] = []
+        contents: list[str] = []
+        for line in text.strip().split('\n'):
+            match = re.match(r'^(\w+): (.*)$', line)
+            if match is not None:
+                roles.append(f'{match.group(1)}: ')
+                contents.append(match.group(2))
+            elif len(contents) > 0:
+                contents[-1] += '\n' + line
+            elif line.strip() != '':
+                roles.append('')
+                contents.append(line)
+        if len(contents) == 0:
+            return self.summarize(text)
+        # the role of each turn is kept out of the summarized text
+        summaries = self.summarize_batch([content.strip() for content in contents])
+        return 'Summarized text:\n' + '\n'.join([role + summary for role, summary in zip(roles, summaries)])
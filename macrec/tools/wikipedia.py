@@ -1,61 +1,41 @@
+import json
+from typing import Optional
 from langchain_core.documents import Document
 from langchain_community.retrievers.wikipedia import WikipediaRetriever
 
 from macrec.tools.base import RetrievalTool
+from macrec.utils import DiskLRUStore, get_store
 
 class Wikipedia(RetrievalTool):
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
-        self.top_k: int = self.config.get('top_k', 3)
         max_doc_length: int = self.config.get('max_doc_length', 4000)
         language: str = self.config.get('language', 'en')
         self.retriever = WikipediaRetriever(top_k_results=self.top_k, doc_content_chars_max=max_doc_length, lang=language)
-        self.cache = {}
+        # the persistent search cache shared by processes, keyed by the query and the retriever settings
+        self.search_cache: Optional[DiskLRUStore] = None
+        cache_path: Optional[str] = self.config.get('cache_path', None)
+        if cache_path is not None:
+            self.search_cache = get_store(path=cache_path, max_size=self.config.get('cache_max_size', 256) << 20, ttl=self.config.get('cache_ttl', 7 * 24 * 3600))
+        self.cache_prefix = json.dumps([self.top_k, max_doc_length, language])
 
-    def reset(self) -> None:
-        self.cache = {}
-
-    def _format_documents(self, documents: list[Document]) -> str:
-        titles = []
-        summary = []
-        for document in documents:
-            assert 'title' in document.metadata
-            title = document.metadata['title']
-            if title not in self.cache:
-                self.cache[title] = {
-                    'document': document,
-                    'lookup_index': {},
-                }
-            titles.append(title)
-            summary_content = document.metadata['summary'] if 'summary' in document.metadata else document.page_content.split('\n\n')[0]
-            if len(summary_content.split()) > 20:
-                summary_content = ' '.join(summary_content.split()[:20]) + '...'
-            summary.append(summary_content)
-        return ', '.join([f'{title} ({summary})' for title, summary in zip(titles, summary)])
+    def _retrieve(self, query: str) -> list[Document]:
+        if self.search_cache is None:
+            return self.retriever.get_relevant_documents(query=query)
+        key = f'{self.cache_prefix}:{query}'
+        cached = self.search_cache.get(key)
+        if cached is not None:
+            return [Document(page_content=document['page_content'], metadata=document['metadata']) for document in json.loads(cached)]
+        results = self.retriever.get_relevant_documents(query=query)
+        self.search_cache.put(key, json.dumps([{'page_content': document.page_content, 'metadata': document.metadata} for document in results], ensure_ascii=False, default=str))
+        return results
 
     def search(self, query: str) -> str:
         try:
-            results = self.retriever.get_relevant_documents(query=query)
+            results = self._retrieve(query)
             if len(results) == 0:
                 return f'No documents found for query {query}.'
             else:
                 return f'Found {len(results)} documents. Their titles and summaries are (with the format title (summary)): {self._format_documents(results)}'
         except Exception as e:
             return f'Error occurred during search: {e}'
-
-    def lookup(self, title: str, term: str) -> str:
-        if title not in self.cache:
-            return 'No title found in search results.'
-        document: Document = self.cache[title]['document']
-        if term not in self.cache[title]['lookup_index']:
-            self.cache[title]['lookup_index'][term] = 0
-        else:
-            self.cache[title]['lookup_index'][term] += 1
-        lookups = [p for p in document.page_content.split("\n\n") if term.lower() in p.lower()]
-        if len(lookups) == 0:
-            return f'No results for term {term} in document {title}.'
-        elif self.cache[title]['lookup_index'][term] >= len(lookups):
-            return f'No more results for term {term} in document {title}.'
-        else:
-            result_prefix = f'(Result {self.cache[title]["lookup_index"][term] + 1} / {len(lookups)})'
-            return f'{result_prefix} {lookups[self.cache[title]["lookup_index"][term]]}'
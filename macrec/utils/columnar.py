@@ -0,0 +1,161 @@
+# Description: A binary columnar format of the tool data, loaded by memory mapping so that processes share the page cache.
+
+import os
+import json
+import shutil
+import tempfile
+import numpy as np
+from loguru import logger
+from typing import Any, Callable, Iterator, Mapping
+
+FORMAT_VERSION = 1
+
+def compact(array: np.ndarray) -> np.ndarray:
+    """Downcast the array to a smaller dtype if lossless, i.e., int64 to int32 and float64 to float32.
+
+    Args:
+        `array` (`np.ndarray`): The array.
+    Returns:
+        `np.ndarray`: The compact array.
+    """
+    for source, target in [(np.int64, np.int32), (np.float64, np.float32)]:
+        if array.dtype == source:
+            converted = array.astype(target)
+            if np.array_equal(converted.astype(source), array):
+                return converted
+    return array
+
+def columnar_path(source: str, kind: str) -> str:
+    """The directory of the columnar data built from the source file. The path contains the size and modification time of the source, so a changed source gets a new build.
+
+    Args:
+        `source` (`str`): The path to the source file, e.g., a CSV file.
+        `kind` (`str`): The kind of the build, e.g., `interaction`.
+    Returns:
+        `str`: The directory of the columnar data.
+    """
+    stat = os.stat(source)
+    name = f'{os.path.basename(source)}.{kind}.{stat.st_size}-{stat.st_mtime_ns}'
+    return os.path.join(os.path.dirname(os.path.abspath(source)), '.columnar', name)
+
+def save_columnar(path: str, arrays: dict[str, np.ndarray]) -> None:
+    """Save the arrays to the directory atomically. The arrays are written to a temporary directory first, which is renamed to the target at once. If another process finishes first, its build is kept.
+
+    Args:
+        `path` (`str`): The directory of the columnar data.
+        `arrays` (`dict[str, np.ndarray]`): The arrays to save. Object arrays are not allowed, since they cannot be memory-mapped.
+    """
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(dir=parent, prefix='.tmp-')
+    try:
+        for name, array in arrays.items():
+            assert array.dtype != object, f'Column {name} of object dtype cannot be memory-mapped.'
+            np.save(os.path.join(tmp_path, f'{name}.npy'), array)
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'version': FORMAT_VERSION, 'columns': list(arrays.keys())}, f)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            if not os.path.exists(os.path.join(path, 'meta.json')):
+                raise
+            logger.debug(f'Columnar data {path} built by another process')
+    finally:
+        if os.path.exists(tmp_path):
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+def load_columnar(source: str, kind: str, build: Callable[[], dict[str, np.ndarray]]) -> dict[str, np.ndarray]:
+    """Load the columnar data of the source by memory mapping, and build it first if not built yet.
+
+    Args:
+        `source` (`str`): The path to the source file.
+        `kind` (`str`): The kind of the build.
+        `build` (`Callable[[], dict[str, np.ndarray]]`): Build the arrays from the source.
+    Returns:
+        `dict[str, np.ndarray]`: The read-only memory-mapped arrays.
+    """
+    path = columnar_path(source, kind)
+    meta_path = os.path.join(path, 'meta.json')
+    if os.path.exists(meta_path):
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta['version'] != FORMAT_VERSION:
+            raise ValueError(f'Columnar data {path} is of version {meta["version"]}, expected {FORMAT_VERSION}. Please remove it to rebuild.')
+    else:
+        logger.info(f'Building columnar data of {source} at {path}...')
+        save_columnar(path, build())
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+    # plain array views of the maps, avoiding the overhead of `np.memmap` on every slice
+    return {name: np.asarray(np.load(os.path.join(path, f'{name}.npy'), mmap_mode='r')) for name in meta['columns']}
+
+def find_sorted(keys: np.ndarray, key: Any) -> int:
+    """Find the key in the sorted unique keys by binary search. The key is cast to the dtype of the keys first, since searching a key of a wider dtype casts the whole array.
+
+    Args:
+        `keys` (`np.ndarray`): The sorted unique keys.
+        `key` (`Any`): The key.
+    Returns:
+        `int`: The index of the key. `-1` if the key is not found.
+    """
+    needle = np.asarray(key)
+    if needle.dtype.kind in 'iu' and keys.dtype.kind in 'iu':
+        info = np.iinfo(keys.dtype)
+        if not info.min <= key <= info.max:
+            return -1
+        needle = needle.astype(keys.dtype)
+    try:
+        i = int(np.searchsorted(keys, needle))
+    except TypeError:
+        # the key is not comparable with the keys, e.g., a string key of integer keys
+        return -1
+    if i < len(keys) and keys[i] == key:
+        return i
+    return -1
+
+def encode_strings(strings: list[str]) -> tuple[np.ndarray, np.ndarray]:
+    """Encode the strings into a UTF-8 blob and the offsets of each string.
+
+    Args:
+        `strings` (`list[str]`): The strings.
+    Returns:
+        `tuple[np.ndarray, np.ndarray]`: The `uint8` blob, and the `int64` offsets of length `len(strings) + 1`.
+    """
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+class MappedStrings(Mapping):
+    """
+    A read-only mapping from sorted keys to strings in a UTF-8 blob, e.g., memory-mapped by `load_columnar`. Lookups are binary searches.
+    """
+    def __init__(self, keys: np.ndarray, blob: np.ndarray, offsets: np.ndarray) -> None:
+        """Initialize the mapping.
+
+        Args:
+            `keys` (`np.ndarray`): The sorted unique keys.
+            `blob` (`np.ndarray`): The `uint8` blob of the strings.
+            `offsets` (`np.ndarray`): The offsets of the strings in the blob, of length `len(keys) + 1`.
+        """
+        self.index_keys = keys
+        self.blob = blob
+        self.offsets = offsets
+
+    def _find(self, key: Any) -> int:
+        return find_sorted(self.index_keys, key)
+
+    def __contains__(self, key: Any) -> bool:
+        return self._find(key) >= 0
+
+    def __getitem__(self, key: Any) -> str:
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        return self.blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode('utf-8')
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self.index_keys.tolist())
+
+    def __len__(self) -> int:
+        return len(self.index_keys)
@@ -30,6 +30,87 @@ def parse_action(action: str, json_mode: bool = False) -> tuple[str, Any]:
         else:
             return 'Invalid', None
 
+_command_start = re.compile(r'[\s,;]*(\w+)\[')
+
+def _balanced_end(command: str, start: int) -> int:
+    # the position of the `]` balancing the `[` right before `start`, or -1 if not balanced
+    depth = 1
+    for pos in range(start, len(command)):
+        if command[pos] == '[':
+            depth += 1
+        elif command[pos] == ']':
+            depth -= 1
+            if depth == 0:
+                return pos
+    return -1
+
+def _split_text_commands(command: str) -> list[tuple[str, str]] | None:
+    # commands may be separated by newlines, spaces, commas or semicolons, since the LLM outputs may be flattened into one line
+    commands = []
+    pos = 0
+    command = command.strip()
+    while pos < len(command):
+        match = _command_start.match(command, pos)
+        if match is None:
+            return None
+        action_type = match.group(1)
+        if action_type.lower() == 'finish':
+            # the argument of Finish may contain brackets, so it is closed at the `]` balancing its `[` if other commands follow, and extends to the end otherwise
+            end = _balanced_end(command, match.end())
+            if end >= 0 and _command_start.match(command, end + 1) is not None:
+                commands.append((action_type, command[match.end():end]))
+            elif command.endswith(']'):
+                commands.append((action_type, command[match.end():-1]))
+            else:
+                return None
+            break
+        end = command.find(']', match.end())
+        if end < 0:
+            return None
+        commands.append((action_type, command[match.end():end]))
+        pos = end + 1
+    return commands
+
+def parse_commands(command: str, json_mode: bool = False) -> list[tuple[str, Any]]:
+    """Parse a turn of agent commands, which may contain multiple commands. In JSON format, the turn is a single command object, a list of command objects, or an object with the command objects in `commands`. In text format, the turn is a sequence of commands like `UserInfo[123] UserHistory[123, 3]`, separated by newlines, spaces, commas or semicolons. The commands after `Finish` are dropped, since the turn finishes there.
+
+    Args:
+        `command` (`str`): Agent commands in string format.
+        `json_mode` (`bool`, optional): Whether the commands are in JSON format. Defaults to `False`.
+    Returns:
+        `list[tuple[str, Any]]`: Action type and argument of each command. Invalid commands are parsed as `('Invalid', None)`.
+
+    Examples:
+        >>> parse_commands('UserInfo[1] ItemHistory[2, 3]')
+        [('UserInfo', '1'), ('ItemHistory', '2, 3')]
+        >>> parse_commands('UserInfo[1]; Finish[[1, 2] are liked]')
+        [('UserInfo', '1'), ('Finish', '[1, 2] are liked')]
+        >>> parse_commands('UserInfo[1] Finish[ok] ItemInfo[2]')
+        [('UserInfo', '1'), ('Finish', 'ok')]
+        >>> parse_commands('[{"type": "Finish", "content": "ok"}, {"type": "UserInfo", "content": 1}]', json_mode=True)
+        [('Finish', 'ok')]
+    """
+    if json_mode:
+        try:
+            json_command = json.loads(command)
+        except Exception:
+            return [('Invalid', None)]
+        if isinstance(json_command, dict) and 'commands' in json_command:
+            json_command = json_command['commands']
+        if not isinstance(json_command, list):
+            return [parse_action(command, json_mode=True)]
+        if len(json_command) == 0:
+            return [('Invalid', None)]
+        commands = [parse_action(json.dumps(item), json_mode=True) for item in json_command]
+    else:
+        commands = _split_text_commands(command)
+        if commands is None or len(commands) <= 1:
+            return [parse_action(command, json_mode=False)]
+    for i, (action_type, _) in enumerate(commands):
+        if action_type.lower() == 'finish':
+            return commands[:i + 1]
+    return commands
+
 def parse_raw_answer(answer: str, *args, **kwargs) -> dict[str, bool | str]:
     return {
         'valid': True,
@@ -0,0 +1,181 @@
+# Description: A persistent key-value store on disk with size-bounded LRU eviction.
+
+import os
+import time
+import sqlite3
+import threading
+from typing import Optional
+from loguru import logger
+
+class DiskLRUStore:
+    """
+    A persistent string key-value store backed by a SQLite file. The store can be shared by threads and processes. When the total size of the stored values exceeds `max_size` bytes, the least recently used entries are evicted. Entries older than `ttl` seconds are treated as missing.
+    """
+    def __init__(self, path: str, max_size: int = 1 << 30, ttl: Optional[float] = None) -> None:
+        """Initialize the store.
+
+        Args:
+            `path` (`str`): The path to the SQLite file. Parent directories are created if not exist.
+            `max_size` (`int`, optional): The maximum total size of the stored values in bytes. Defaults to `1 << 30` (1 GiB).
+            `ttl` (`Optional[float]`): The time to live of the entries in seconds, counted from when they are stored. Never expire if `None`. Defaults to `None`.
+        """
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+        if os.path.dirname(path) != '':
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL, created REAL NOT NULL DEFAULT 0)')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entries_last_access ON entries (last_access)')
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(entries)')]
+        if 'created' not in columns:
+            # stores created before the TTL support, whose entries count as expired under a TTL
+            try:
+                self.conn.execute('ALTER TABLE entries ADD COLUMN created REAL NOT NULL DEFAULT 0')
+            except sqlite3.OperationalError:
+                # added by another process
+                pass
+        self.conn.execute('CREATE INDEX IF NOT EXISTS entries_created ON entries (created)')
+        # the total size is kept in a one-row table by triggers, so it is read without scanning the entries, and stays correct with other processes writing
+        self.conn.execute('BEGIN IMMEDIATE')
+        try:
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (id INTEGER PRIMARY KEY CHECK (id = 0), total_size INTEGER NOT NULL)')
+            self.conn.execute('INSERT OR IGNORE INTO meta (id, total_size) SELECT 0, COALESCE(SUM(size), 0) FROM entries')
+            self.conn.execute('CREATE TRIGGER IF NOT EXISTS entries_insert AFTER INSERT ON entries BEGIN UPDATE meta SET total_size = total_size + NEW.size WHERE id = 0; END')
+            self.conn.execute('CREATE TRIGGER IF NOT EXISTS entries_delete AFTER DELETE ON entries BEGIN UPDATE meta SET total_size = total_size - OLD.size WHERE id = 0; END')
+            self.conn.execute('CREATE TRIGGER IF NOT EXISTS entries_update AFTER UPDATE OF size ON entries BEGIN UPDATE meta SET total_size = total_size + NEW.size - OLD.size WHERE id = 0; END')
+            self.conn.execute('COMMIT')
+        except Exception:
+            self.conn.execute('ROLLBACK')
+            raise
+        self.hits = 0
+        self.misses = 0
+        self.bytes_read = 0
+        self.bytes_written = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[str]:
+        """Get the value of the key and mark the entry as recently used.
+
+        Args:
+            `key` (`str`): The key.
+        Returns:
+            `Optional[str]`: The value of the key. `None` if the key is not found.
+        """
+        with self.lock:
+            row = self.conn.execute('SELECT value, size, created FROM entries WHERE key = ?', (key, )).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            now = time.time()
+            if self.ttl is not None and row[2] < now - self.ttl:
+                self.conn.execute('DELETE FROM entries WHERE key = ?', (key, ))
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.conn.execute('UPDATE entries SET last_access = ? WHERE key = ?', (now, key))
+            self.hits += 1
+            self.bytes_read += row[1]
+            return row[0]
+
+    def put(self, key: str, value: str) -> None:
+        """Store the value of the key, and evict the least recently used entries if the store is over the size limit.
+
+        Args:
+            `key` (`str`): The key.
+            `value` (`str`): The value.
+        """
+        size = len(value.encode('utf-8'))
+        with self.lock:
+            now = time.time()
+            # an upsert instead of `INSERT OR REPLACE`, whose implicit deletes do not fire the triggers of the total size
+            self.conn.execute('INSERT INTO entries (key, value, size, last_access, created) VALUES (?, ?, ?, ?, ?) ON CONFLICT (key) DO UPDATE SET value = excluded.value, size = excluded.size, last_access = excluded.last_access, created = excluded.created', (key, value, size, now, now))
+            self.bytes_written += size
+            self._evict()
+
+    def _evict(self) -> None:
+        if self.ttl is not None:
+            expired = self.conn.execute('DELETE FROM entries WHERE created < ?', (time.time() - self.ttl, )).rowcount
+            self.expirations += max(expired, 0)
+        excess = self.total_size - self.max_size
+        if excess <= 0:
+            return
+        evicted = []
+        for key, size in self.conn.execute('SELECT key, size FROM entries ORDER BY last_access ASC'):
+            evicted.append((key, ))
+            excess -= size
+            if excess <= 0:
+                break
+        self.conn.executemany('DELETE FROM entries WHERE key = ?', evicted)
+        self.evictions += len(evicted)
+
+    @property
+    def total_size(self) -> int:
+        return self.conn.execute('SELECT total_size FROM meta WHERE id = 0').fetchone()[0]
+
+    def __len__(self) -> int:
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+
+    def clear(self) -> None:
+        with self.lock:
+            self.conn.execute('DELETE FROM entries')
+
+    def stats(self) -> dict[str, int | float]:
+        """Statistics of the store in the current process.
+
+        Returns:
+            `dict[str, int | float]`: The statistics, including hits, misses, hit rate, bytes read and written, evictions, expirations, and the number of entries and bytes in the store.
+        """
+        lookups = self.hits + self.misses
+        with self.lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM entries').fetchone()[0]
+            total_size = self.total_size
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups > 0 else 0.0,
+            'bytes_read': self.bytes_read,
+            'bytes_written': self.bytes_written,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+            'entries': entries,
+            'total_size': total_size,
+        }
+
+    def report(self, name: str = 'Store') -> None:
+        """Output the statistics of the store.
+
+        Args:
+            `name` (`str`, optional): The name of the store in the report. Defaults to `'Store'`.
+        """
+        stats = self.stats()
+        logger.success(f'{name} ({self.path}): {stats["hits"]} hits, {stats["misses"]} misses, hit rate {stats["hit_rate"]:.4f}')
+        logger.success(f'{name} ({self.path}): {stats["bytes_read"]} bytes read, {stats["bytes_written"]} bytes written, {stats["evictions"]} evictions, {stats["expirations"]} expirations')
+        logger.success(f'{name} ({self.path}): {stats["entries"]} entries, {stats["total_size"]} bytes stored')
+
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+_stores: dict[str, DiskLRUStore] = {}
+_stores_lock = threading.Lock()
+
+def get_store(path: str, max_size: int = 1 << 30, ttl: Optional[float] = None) -> DiskLRUStore:
+    """Get the process-wide store of the path. The store is opened with the given arguments on the first call, and shared by later calls, so the instances of a tool share one connection.
+
+    Args:
+        `path` (`str`): The path to the SQLite file.
+        `max_size` (`int`, optional): The maximum total size of the stored values in bytes. Defaults to `1 << 30` (1 GiB).
+        `ttl` (`Optional[float]`): The time to live of the entries in seconds. Defaults to `None`.
+    Returns:
+        `DiskLRUStore`: The shared store.
+    """
+    with _stores_lock:
+        key = os.path.abspath(path)
+        if key not in _stores:
+            _stores[key] = DiskLRUStore(path=path, max_size=max_size, ttl=ttl)
+        return _stores[key]
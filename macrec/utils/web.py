@@ -1,6 +1,8 @@
 import streamlit as st
 from typing import Optional
 
+from macrec.utils.string import get_avatar
+
 def add_chat_message(role: str, message: str, avatar: Optional[str] = None):
     """Add a chat message to the chat history.
 
@@ -37,3 +39,24 @@ def get_color(agent_type: str) -> str:
         return 'red'
     else:
         return 'gray'
+
+class StreamRenderer:
+    """
+    Render the partial output of an agent in the web demo while the LLM is streaming. Call the renderer with each chunk, and `close` it when the output is complete, so that the final message logged by the system takes its place.
+    """
+    def __init__(self, role: str) -> None:
+        """Initialize the renderer with an empty placeholder at the current position of the page.
+
+        Args:
+            `role` (`str`): The role of the agent.
+        """
+        self.head = f'{get_avatar(role)}:{get_color(role)}[**{role}**]: '
+        self.text = ''
+        self.placeholder = st.empty()
+
+    def __call__(self, chunk: str) -> None:
+        self.text += chunk
+        self.placeholder.markdown(f'{self.head}{self.text}▌')
+
+    def close(self) -> None:
+        self.placeholder.empty()
@@ -0,0 +1,63 @@
+# Description: Benchmark of the indexed and memory-mapped InfoDatabase lookups.
+# Usage: PYTHONPATH=. python scripts/bench_info_database.py
+
+import os
+import json
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+
+from macrec.tools import InfoDatabase
+
+def scan_item_info(table: pd.DataFrame, item_id: int) -> str:
+    info = table[table['item_id'] == item_id]
+    columns = table.columns.drop('item_id')
+    attributes = '; '.join([f'{column}: {info[column].values[0]}' for column in columns])
+    return f'Item {item_id} Attributes:\n{attributes}'
+
+def main() -> None:
+    """Micro-benchmark of the indexed lookups against the boolean-mask scans over the table, and of the memory-mapped loading against parsing the CSV file."""
+    rng = np.random.default_rng(0)
+    n_lookups = 200
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_items in [1000, 10000, 100000, 1000000]:
+            table = pd.DataFrame({
+                'item_id': np.arange(1, n_items + 1),
+                'title': [f'Item title {i}' for i in range(n_items)],
+                'genre': rng.choice(['Action', 'Comedy', 'Drama'], size=n_items),
+                'price': rng.uniform(1, 100, size=n_items).round(2),
+            })
+            item_info_path = os.path.join(tmp_dir, f'item{n_items}.csv')
+            table.to_csv(item_info_path, index=False)
+            config_path = os.path.join(tmp_dir, f'info_database{n_items}.json')
+            with open(config_path, 'w') as f:
+                json.dump({'item_info': item_info_path}, f)
+            start = time.perf_counter()
+            database = InfoDatabase(config_path=config_path)
+            load_time = time.perf_counter() - start
+            queries = rng.integers(1, n_items + 1, size=n_lookups).tolist()
+            start = time.perf_counter()
+            scanned = [scan_item_info(table, item_id) for item_id in queries]
+            scan_time = (time.perf_counter() - start) / n_lookups
+            start = time.perf_counter()
+            indexed = [database.item_info(item_id) for item_id in queries]
+            index_time = (time.perf_counter() - start) / n_lookups
+            assert scanned == indexed
+            with open(config_path, 'w') as f:
+                json.dump({'item_info': item_info_path, 'mmap': True}, f)
+            start = time.perf_counter()
+            InfoDatabase(config_path=config_path)
+            build_time = time.perf_counter() - start
+            start = time.perf_counter()
+            database = InfoDatabase(config_path=config_path)
+            mmap_load_time = time.perf_counter() - start
+            start = time.perf_counter()
+            mapped = [database.item_info(item_id) for item_id in queries]
+            mmap_time = (time.perf_counter() - start) / n_lookups
+            assert scanned == mapped
+            print(f'{n_items:>8} items: load {load_time:.2f}s, scan {scan_time * 1e6:10.1f}us/lookup, index {index_time * 1e6:6.2f}us/lookup, speedup {scan_time / index_time:10.0f}x')
+            print(f'{"":>8}        mmap: build {build_time:.2f}s, load {mmap_load_time * 1e3:.2f}ms, {mmap_time * 1e6:6.2f}us/lookup')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,54 @@
+# Description: Benchmark of the repeated RetrievalTool lookups in long documents.
+# Usage: PYTHONPATH=. python scripts/bench_lookup.py
+
+import json
+import time
+import random
+import tempfile
+from langchain_core.documents import Document
+
+from macrec.tools import RetrievalTool
+
+def scan_lookup(document: Document, term: str, index: int) -> str:
+    lookups = [p for p in document.page_content.split("\n\n") if term.lower() in p.lower()]
+    return lookups[index] if index < len(lookups) else ''
+
+class StaticRetrieval(RetrievalTool):
+    # the fixture documents are returned by every search, regardless of the query
+    def __init__(self, documents: list[Document], *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self.documents = documents
+
+    def search(self, query: str) -> str:
+        return self._format_documents(self.documents[:self.top_k])
+
+def main() -> None:
+    """Benchmark of the repeated lookups in long documents, against splitting and lowercasing the document on every call."""
+    rng = random.Random(0)
+    words = [f'word{i}' for i in range(2000)]
+    with tempfile.NamedTemporaryFile('w', suffix='.json') as f:
+        json.dump({}, f)
+        f.flush()
+        config_path = f.name
+        for n_paragraphs in [10, 100, 1000]:
+            paragraphs = [' '.join(rng.choices(words, k=80)) for _ in range(n_paragraphs)]
+            document = Document(page_content='\n\n'.join(paragraphs), metadata={'title': 'Long Document'})
+            terms = [rng.choice(words) for _ in range(20)]
+            n_rounds = 10
+            start = time.perf_counter()
+            for _ in range(n_rounds):
+                for term in terms:
+                    scan_lookup(document, term, 0)
+            scan_time = (time.perf_counter() - start) / (n_rounds * len(terms))
+            tool = StaticRetrieval(documents=[document], config_path=config_path)
+            tool.search('Long Document')
+            start = time.perf_counter()
+            for _ in range(n_rounds):
+                for term in terms:
+                    # only the first lookup of a term scans the paragraphs
+                    tool.lookup('Long Document', term)
+            index_time = (time.perf_counter() - start) / (n_rounds * len(terms))
+            print(f'{n_paragraphs:>5} paragraphs ({len(document.page_content)} chars): scan {scan_time * 1e6:9.1f}us/lookup, indexed {index_time * 1e6:7.1f}us/lookup, speedup {scan_time / index_time:6.1f}x')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+# Description: Benchmark of the exact and IVF queries of SimilarItemRetriever.
+# Usage: PYTHONPATH=. python scripts/bench_similar_item.py
+
+import os
+import json
+import time
+import tempfile
+import numpy as np
+import pandas as pd
+
+from macrec.tools import SimilarItemRetriever
+from macrec.utils.columnar import find_sorted
+
+def main() -> None:
+    """Benchmark of the exact and IVF queries against a per-item Python loop, with the recall of the IVF index."""
+    rng = np.random.default_rng(0)
+    words = [f'word{i}' for i in range(3000)]
+    n_queries, k = 100, 10
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for n_items in [1000, 10000, 50000]:
+            item_info = os.path.join(tmp_dir, f'item{n_items}.csv')
+            topics = rng.integers(0, 50, size=n_items)
+            pd.DataFrame({
+                'item_id': np.arange(1, n_items + 1),
+                'item_attributes': [' '.join(rng.choice(words[topic * 60:(topic + 1) * 60], 15).tolist() + rng.choice(words, 5).tolist()) for topic in topics],
+            }).to_csv(item_info, index=False)
+            retrievers = {}
+            for index in ['exact', 'ivf']:
+                config_path = os.path.join(tmp_dir, f'{index}.json')
+                with open(config_path, 'w') as f:
+                    json.dump({'item_info': item_info, 'index': index, 'dim': 64}, f)
+                start = time.perf_counter()
+                SimilarItemRetriever(config_path=config_path)
+                build_time = time.perf_counter() - start
+                start = time.perf_counter()
+                retrievers[index] = SimilarItemRetriever(config_path=config_path)
+                load_time = time.perf_counter() - start
+                print(f'{n_items:>6} items, {index:>5}: build {build_time:.2f}s, load {load_time * 1e3:.2f}ms')
+            exact = retrievers['exact']
+            queries = rng.integers(1, n_items + 1, size=n_queries).tolist()
+            start = time.perf_counter()
+            for item_id in queries[:10]:
+                query = exact.embeddings[find_sorted(exact.ids, item_id)]
+                looped = sorted(((float(np.dot(embedding, query)), i) for i, embedding in enumerate(exact.embeddings)), reverse=True)[:k + 1]
+            loop_time = (time.perf_counter() - start) / 10
+            times, results = {}, {}
+            for index, retriever in retrievers.items():
+                start = time.perf_counter()
+                results[index] = [set(id for id, _ in retriever.similar(item_id, k)) for item_id in queries]
+                times[index] = (time.perf_counter() - start) / n_queries
+            recall = np.mean([len(approximate & truth) / k for approximate, truth in zip(results['ivf'], results['exact'])])
+            print(f'{"":>6}        loop {loop_time * 1e3:8.2f}ms/query, exact {times["exact"] * 1e3:6.2f}ms/query, ivf {times["ivf"] * 1e3:6.2f}ms/query (recall@{k} {recall:.3f})')
+
+if __name__ == '__main__':
+    main()